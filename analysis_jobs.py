@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+import httpx
+
+from metrics_analyzer import cached_analyze_async
+from worker_limits import worker_share
+
+# Настройки фоновых задач анализа
+ANALYSIS_JOBS_DB = os.getenv("ANALYSIS_JOBS_DB", "analysis_jobs.sqlite3")
+# Обработчики и очередь - на весь сервис, воркеры serve.py делят их
+ANALYSIS_JOB_WORKERS = worker_share(int(os.getenv("ANALYSIS_JOB_WORKERS", "2")))
+ANALYSIS_JOB_QUEUE = worker_share(int(os.getenv("ANALYSIS_JOB_QUEUE", "100")))
+# Аренда задачи процессом, с: процесс продлевает ее, пока жив; задачу с
+# истекшей арендой (процесс упал) забирает другой
+ANALYSIS_JOB_LEASE = float(os.getenv("ANALYSIS_JOB_LEASE", "60"))
+# Сколько хранить завершенные задачи, с
+ANALYSIS_JOB_TTL = float(os.getenv("ANALYSIS_JOB_TTL", str(7 * 24 * 3600)))
+# Callback разрешен только на эти хосты (локальные сервисы)
+ANALYSIS_CALLBACK_HOSTS = [
+    host.strip() for host in os.getenv("ANALYSIS_CALLBACK_HOSTS", "localhost,127.0.0.1,::1").split(",") if host.strip()
+]
+ANALYSIS_CALLBACK_TIMEOUT = float(os.getenv("ANALYSIS_CALLBACK_TIMEOUT", "10"))
+CALLBACK_ATTEMPTS = 3
+
+
+class QueueFullError(Exception):
+    """Очередь задач заполнена"""
+
+
+def validate_callback_url(url: str) -> str:
+    """Разрешены только http(s)-адреса на хостах из ANALYSIS_CALLBACK_HOSTS"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or parsed.hostname not in ANALYSIS_CALLBACK_HOSTS:
+        raise ValueError(f"callback_url должен указывать на локальный хост ({', '.join(ANALYSIS_CALLBACK_HOSTS)})")
+    return url
+
+
+class JobStore:
+    """
+    Состояние задач анализа в SQLite: переживает перезапуск сервиса.
+    Статусы: queued -> running -> done | failed. Входные данные хранятся,
+    пока задача не завершена. Выполняемая задача арендована процессом
+    (owner, lease_until), поэтому несколько воркеров API не перехватывают
+    задачи друг друга.
+    """
+
+    def __init__(self, path: str = ANALYSIS_JOBS_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS analysis_jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                project TEXT,
+                bucket REAL,
+                payload TEXT,
+                result TEXT,
+                cache TEXT,
+                error TEXT,
+                callback_url TEXT,
+                callback_status TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                lease_until REAL
+            );
+            CREATE INDEX IF NOT EXISTS analysis_jobs_status ON analysis_jobs (status, created_at);
+        """)
+        # Базы, созданные до аренды задач
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(analysis_jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE analysis_jobs ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+    def create(self, data: Dict[str, Any], project: Optional[str], bucket: Optional[float],
+               callback_url: Optional[str]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO analysis_jobs (id, status, project, bucket, payload, callback_url, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, project, bucket, json.dumps(data, ensure_ascii=False), callback_url, time.time())
+            )
+            self._conn.commit()
+        return job_id
+
+    def claim(self, job_id: str, owner: str, lease: float) -> Optional[Dict[str, Any]]:
+        """Переводит задачу в running с арендой owner и возвращает ее входные данные"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, project, bucket FROM analysis_jobs WHERE id = ? AND status = 'queued'", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            # Условие на статус: при нескольких воркерах API задачу забирает один процесс
+            now = time.time()
+            cursor = self._conn.execute(
+                "UPDATE analysis_jobs SET status = 'running', started_at = ?, owner = ?, lease_until = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, owner, now + lease, job_id)
+            )
+            self._conn.commit()
+            if cursor.rowcount == 0:
+                return None
+        return {"data": json.loads(row[0]), "project": row[1], "bucket": row[2]}
+
+    def finish(self, job_id: str, result: Optional[str] = None, cache: Optional[str] = None,
+               error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE analysis_jobs SET status = ?, result = ?, cache = ?, error = ?, payload = NULL, "
+                "finished_at = ? WHERE id = ?",
+                ("failed" if error else "done", result, cache, error, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def set_callback_status(self, job_id: str, status: str):
+        with self._lock:
+            self._conn.execute("UPDATE analysis_jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, project, result, cache, error, callback_url, callback_status, "
+                "created_at, started_at, finished_at FROM analysis_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row[0],
+            "status": row[1],
+            "project": row[2],
+            "created_at": row[8],
+            "started_at": row[9],
+            "finished_at": row[10]
+        }
+        if row[1] == "done":
+            job.update(analysis=row[3], cache=row[4])
+        if row[1] == "failed":
+            job["error"] = row[5]
+        if row[6]:
+            job["callback"] = {"url": row[6], "status": row[7]}
+        return job
+
+    def renew(self, owner: str, lease: float) -> int:
+        """Продлевает аренду задач, которые выполняет owner"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE analysis_jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                (time.time() + lease, owner)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def release(self, owner: str) -> int:
+        """Остановка процесса: его невыполненные задачи снова в очереди"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE analysis_jobs SET status = 'queued', started_at = NULL, owner = NULL, lease_until = NULL "
+                "WHERE owner = ? AND status = 'running'", (owner,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def requeue_expired(self) -> List[str]:
+        """Задачи с истекшей арендой (их процесс упал) снова в очередь; возвращает их ID"""
+        with self._lock:
+            rows = self._conn.execute(
+                "UPDATE analysis_jobs SET status = 'queued', started_at = NULL, owner = NULL, lease_until = NULL "
+                "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?) RETURNING id, created_at",
+                (time.time(),)
+            ).fetchall()
+            self._conn.commit()
+        return [row[0] for row in sorted(rows, key=lambda row: row[1])]
+
+    def requeue_pending(self) -> List[str]:
+        """
+        При старте процесса: ожидающие задачи и задачи упавших процессов (в
+        порядке создания). Задачи с действующей арендой выполняют другие
+        воркеры, их не трогаем.
+        """
+        self.requeue_expired()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM analysis_jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        """Удаляет завершенные задачи, закончившиеся раньше older_than"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM analysis_jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (older_than,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+
+class AnalysisJobQueue:
+    """
+    Очередь фоновых задач LLM-анализа: submit сразу возвращает ID задачи,
+    workers корутин выполняют анализ (через кэш и ограничитель LLM, как
+    /analyze_kpi), результат забирается по ID или отправляется на callback_url.
+    Пока процесс жив, он продлевает аренду своих задач и подбирает задачи
+    с истекшей арендой. Обращения к SQLite идут в потоке, callback
+    отправляется отдельной задачей и не занимает обработчик.
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = ANALYSIS_JOB_WORKERS,
+                 max_queue: int = ANALYSIS_JOB_QUEUE, ttl: float = ANALYSIS_JOB_TTL,
+                 lease: float = ANALYSIS_JOB_LEASE):
+        self.store = store or JobStore()
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self.lease = lease
+        self.owner = ""
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._callbacks: Set[asyncio.Task] = set()
+        self._running = 0
+
+    async def start(self):
+        # Владелец аренды уникален для процесса и запуска
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.Queue()
+        await asyncio.to_thread(self.store.purge, time.time() - self.ttl)
+        pending = await asyncio.to_thread(self.store.requeue_pending)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        if pending:
+            print(f"📋 Восстановлено задач анализа: {len(pending)}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._keep_leases()))
+
+    async def stop(self):
+        """Останавливает обработчики; прерванные задачи возвращаются в очередь"""
+        tasks = self._tasks + list(self._callbacks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        released = await asyncio.to_thread(self.store.release, self.owner)
+        if released:
+            print(f"📋 Возвращено в очередь задач анализа: {released}")
+
+    async def submit(self, data: Dict[str, Any], project: Optional[str] = None, bucket: Optional[float] = None,
+                     callback_url: Optional[str] = None) -> str:
+        """
+        Сохраняет задачу и ставит ее в очередь. Вызывается из event loop
+        очереди: asyncio.Queue не потокобезопасна, запись в SQLite идет в потоке.
+        """
+        if self._queue is None:
+            raise RuntimeError("Очередь задач не запущена")
+        if self._queue.qsize() >= self.max_queue:
+            raise QueueFullError(f"в очереди уже {self._queue.qsize()} задач")
+        if callback_url:
+            validate_callback_url(callback_url)
+        job_id = await asyncio.to_thread(self.store.create, data, project, bucket, callback_url)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None and job["status"] == "queued" and self._queue is not None:
+            job["queue_depth"] = self._queue.qsize()
+        return job
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue
+        }
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = await asyncio.to_thread(self.store.claim, job_id, self.owner, self.lease)
+            if job is None:
+                continue
+            self._running += 1
+            try:
+                result, cache_status = await cached_analyze_async(job["data"], job["project"], job["bucket"])
+                await asyncio.to_thread(self.store.finish, job_id, result=result, cache=cache_status)
+            except asyncio.CancelledError:
+                # Остановка сервиса: stop() вернет задачу в очередь
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка задачи анализа {job_id}: {e}")
+                await asyncio.to_thread(self.store.finish, job_id, error=str(e))
+            finally:
+                self._running -= 1
+            task = asyncio.create_task(self._send_callback(job_id))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _keep_leases(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await asyncio.to_thread(self.store.renew, self.owner, self.lease)
+            expired = await asyncio.to_thread(self.store.requeue_expired)
+            for job_id in expired:
+                self._queue.put_nowait(job_id)
+            if expired:
+                print(f"📋 Подобраны задачи анализа упавшего процесса: {len(expired)}")
+
+    async def _send_callback(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if not job or "callback" not in job:
+            return
+        status = "failed"
+        async with httpx.AsyncClient(timeout=ANALYSIS_CALLBACK_TIMEOUT) as client:
+            for attempt in range(CALLBACK_ATTEMPTS):
+                try:
+                    r = await client.post(job["callback"]["url"], json={k: v for k, v in job.items() if k != "callback"})
+                    if r.status_code < 500:
+                        status = f"sent:{r.status_code}"
+                        break
+                    status = f"failed:{r.status_code}"
+                except httpx.HTTPError as e:
+                    status = f"failed:{type(e).__name__}"
+                if attempt + 1 < CALLBACK_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
+        await asyncio.to_thread(self.store.set_callback_status, job_id, status)
+
+
+_job_queue: Optional[AnalysisJobQueue] = None
+
+
+def get_job_queue() -> AnalysisJobQueue:
+    """Общая очередь задач анализа (создается при первом обращении)"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = AnalysisJobQueue()
+    return _job_queue
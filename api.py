@@ -1,17 +1,61 @@
+import time
+import zlib
 from dataclasses import field
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from datetime import date
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional, Dict
 from contextlib import asynccontextmanager
 
+from analysis_jobs import QueueFullError, get_job_queue
+from fast_codec import DECODE_MODES, KPI_DECODE_MODE, DecodeError, decode_backend_response
+from kpi_cache import body_key, content_fingerprint, etag_matches, get_result_cache
+from kpi_index import WindowLimitError, calculate_window_kpis, parse_range, parse_windows
+from kpi_whatif import as_count_matrix, counts_from_result, kpi_from_result, rank_weight_sets
+from kpi_batch import DEFAULT_WORKERS as BATCH_MAX_WORKERS, predict_kpi_batch, shutdown_pool
+from kpi_state import get_state_store
+from metric_accumulator import MetricAccumulator, NDJSONDecoder
 from metric_calculator import prepare_metrics_for_analyzer
-from metrics_analyzer import safe_analyze
+from metric_sketch import SketchAccumulator
+from llm_cache import get_analysis_cache
+from llm_guard import llm_guard_snapshot
+from llm_warmup import get_model_warmer
+from metrics_analyzer import (
+    build_analysis_prompt,
+    cached_analyze_async,
+    close_async_client,
+    format_sse,
+    stream_analysis_events
+)
+from telemetry import (
+    RESULT_CACHE,
+    TimingMiddleware,
+    mark_parsed,
+    render_metrics,
+    stage,
+    start_metrics_export,
+    stop_metrics_export
+)
+
+# Сколько коммитов потокового тела обрабатывать за один переход в threadpool
+STREAM_BATCH_SIZE = 5000
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    start_metrics_export()
+    await get_job_queue().start()
+    await get_model_warmer().start()
     print("API запущен.")
     yield
     print("API завершает работу...")
+    await get_model_warmer().stop()
+    await get_job_queue().stop()
+    shutdown_pool()
+    await close_async_client()
+    stop_metrics_export()
 
 app = FastAPI(
     title="Team KPI Predictor",
@@ -19,6 +63,8 @@ app = FastAPI(
     version="5.0.0",
     lifespan=lifespan
 )
+# Длительности запросов и стадий, заголовок Server-Timing
+app.add_middleware(TimingMiddleware)
 
 # === Модели ===
 class Author(BaseModel):
@@ -59,42 +105,351 @@ class BackendResponse(BaseModel):
     repository: Repository
     commits: List[Commit] = field(default_factory=list)
 
+class WeightScheme(BaseModel):
+    name: Optional[str] = None
+    weights: Dict[str, float] = field(default_factory=dict)
+
+class WhatIfRequest(BaseModel):
+    schemes: List[WeightScheme]
+    # Либо готовый результат /predict_kpi (data), либо матрицы счетчиков по COMMIT_TYPES
+    kpi: Optional[Dict] = None
+    authors: Optional[List[str]] = None
+    type_counts: Optional[List[List[float]]] = None
+    team_counts: Optional[List[float]] = None
+
+
+# Тело /predict_kpi читается вручную, схема для OpenAPI указывается явно
+BACKEND_RESPONSE_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": {"$ref": "#/components/schemas/BackendResponse"}}}
+    }
+}
+
+
+def decode_backend_body(body: bytes, mode: str) -> dict:
+    """Тело BackendResponse в виде dict: strict - модель Pydantic, fast - orjson и проверка используемых полей"""
+    if mode == "fast":
+        with stage("parse"):
+            try:
+                return decode_backend_response(body)
+            except DecodeError as e:
+                # Тот же ответ 422, что и в strict (первая найденная ошибка)
+                raise RequestValidationError([e.to_error()])
+
+    with stage("parse"):
+        try:
+            backend_data = BackendResponse.model_validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+            )
+    with stage("model_dump"):
+        return backend_data.model_dump()
+
 
 # === Эндпоинты ===
-@app.post("/predict_kpi")
-def predict_kpi(backend_data: BackendResponse):
-    """1️⃣ Получает данные проекта и возвращает рассчитанные KPI"""
+@app.post("/predict_kpi", openapi_extra=BACKEND_RESPONSE_BODY)
+async def predict_kpi(request: Request, mode: Optional[str] = None):
+    """
+    1️⃣ Получает данные проекта и возвращает рассчитанные KPI (mode: strict | fast).
+    ETag - отпечаток содержимого (hash коммитов и ветки); If-None-Match с ним дает 304,
+    повторный расчет того же содержимого берется из кэша результатов.
+    """
+    mode = mode or KPI_DECODE_MODE
+    if mode not in DECODE_MODES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный режим разбора: {mode}")
+    body = await request.body()
+    if_none_match = request.headers.get("if-none-match")
+
+    def compute():
+        cache = get_result_cache()
+        data_dict = None
+        with stage("fingerprint"):
+            raw_key = body_key(body, mode)
+            fingerprint = cache.fingerprint_for_body(raw_key)
+        if fingerprint is None:
+            data_dict = decode_backend_body(body, mode)
+            with stage("fingerprint"):
+                fingerprint = content_fingerprint(data_dict)
+            cache.remember_body(raw_key, fingerprint)
+
+        etag = f'"{fingerprint}"'
+        if etag_matches(if_none_match, etag):
+            RESULT_CACHE.inc(result="not_modified")
+            return Response(status_code=304, headers={"ETag": etag})
+        content = cache.get(fingerprint)
+        if content is not None:
+            RESULT_CACHE.inc(result="hit")
+            return Response(content, media_type="application/json", headers={"ETag": etag, "X-Cache": "hit"})
+
+        RESULT_CACHE.inc(result="miss")
+        if data_dict is None:
+            data_dict = decode_backend_body(body, mode)
+        try:
+            print("🚀 Расчёт KPI...")
+            result = prepare_metrics_for_analyzer(data_dict)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ошибка при расчете KPI: {e}")
+        with stage("serialize"):
+            response = ORJSONResponse({
+                "success": True,
+                "message": "KPI рассчитаны успешно",
+                "data": result
+            }, headers={"ETag": etag, "X-Cache": "miss"})
+        cache.put(fingerprint, response.body)
+        return response
+
+    return await run_in_threadpool(compute)
+
+@app.post("/predict_kpi/windows", openapi_extra=BACKEND_RESPONSE_BODY)
+async def predict_kpi_windows(request: Request, date_ranges: Optional[List[str]] = Query(None, alias="range"),
+                              windows: str = "7,30,90", step: int = 7, developers: bool = True,
+                              since: Optional[date] = None, mode: Optional[str] = None):
+    """1️⃣ KPI за интервалы дат (range=YYYY-MM-DD..YYYY-MM-DD) и скользящие окна по дневному индексу"""
+    mode = mode or KPI_DECODE_MODE
+    if mode not in DECODE_MODES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный режим разбора: {mode}")
+    try:
+        ranges = [parse_range(value) for value in date_ranges or []]
+        window_sizes = parse_windows(windows)
+        if step <= 0:
+            raise ValueError("шаг окон должен быть положительным")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректные параметры окон: {e}")
+    body = await request.body()
+
+    def compute():
+        data_dict = decode_backend_body(body, mode)
+        try:
+            print("🚀 Расчёт KPI по окнам...")
+            with stage("windows"):
+                result = calculate_window_kpis(data_dict, ranges, window_sizes, step, developers, since)
+        except WindowLimitError as e:
+            raise HTTPException(status_code=400, detail=f"Превышены лимиты окон: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ошибка при расчете KPI: {e}")
+        with stage("serialize"):
+            return ORJSONResponse({
+                "success": True,
+                "message": "KPI рассчитаны успешно",
+                "data": result
+            })
+
+    return await run_in_threadpool(compute)
+
+@app.post("/predict_kpi/stream")
+async def predict_kpi_stream(request: Request, sketch: bool = False):
+    """
+    1️⃣ Потоковый расчёт KPI: тело - NDJSON (коммит на строку), можно gzip.
+    sketch=true - приближенный расчет в фиксированной памяти с границами ошибок.
+    """
+    try:
+        print("🚀 Потоковый расчёт KPI...")
+        accumulator = SketchAccumulator() if sketch else MetricAccumulator()
+        decoder = NDJSONDecoder(gzipped=request.headers.get("content-encoding") == "gzip")
+        batch = []
+        async for chunk in request.stream():
+            batch.extend(decoder.feed(chunk))
+            if len(batch) >= STREAM_BATCH_SIZE:
+                await run_in_threadpool(accumulator.add_many, batch)
+                batch = []
+        batch.extend(decoder.close())
+        await run_in_threadpool(accumulator.add_many, batch)
+        result = accumulator.result()
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Некорректное тело запроса: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при расчете KPI: {e}")
+
+    return {
+        "success": True,
+        "message": "KPI рассчитаны успешно",
+        "data": result
+    }
+
+@app.post("/predict_kpi/delta")
+def predict_kpi_delta(backend_data: BackendResponse, rebuild: bool = False):
+    """1️⃣ Инкрементальный расчёт KPI: передаются только новые коммиты репозитория"""
+    # Состояние хранится по ключу project.key + repository.name; пустой ключ смешал бы клиентов
+    if not backend_data.project.key or not backend_data.repository.name:
+        raise HTTPException(status_code=400, detail="Для инкрементального расчета нужны project.key и repository.name")
     try:
-        print("🚀 Расчёт KPI...")
-        data_dict = backend_data.model_dump()
-        result = prepare_metrics_for_analyzer(data_dict)
+        mark_parsed()
+        print("🚀 Инкрементальный расчёт KPI...")
+        with stage("model_dump"):
+            data_dict = backend_data.model_dump()
+        result, delta = get_state_store().apply(
+            backend_data.project.key,
+            backend_data.repository.name,
+            data_dict["commits"],
+            rebuild=rebuild
+        )
         return {
             "success": True,
             "message": "KPI рассчитаны успешно",
-            "data": result
+            "data": result,
+            "delta": delta
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при расчете KPI: {e}")
 
+@app.post("/predict_kpi/batch")
+def predict_kpi_batch_endpoint(batch: List[BackendResponse],
+                               workers: Optional[int] = Query(None, ge=1, le=BATCH_MAX_WORKERS)):
+    """1️⃣ Пакетный расчёт KPI многих проектов в пуле процессов"""
+    try:
+        mark_parsed()
+        print(f"🚀 Пакетный расчёт KPI: {len(batch)} проектов...")
+        start = time.perf_counter()
+        with stage("model_dump"):
+            payloads = [backend_data.model_dump() for backend_data in batch]
+        items = predict_kpi_batch(payloads, workers)
+        return {
+            "success": all(item["success"] for item in items),
+            "message": "KPI рассчитаны",
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+            "results": items
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при расчете KPI: {e}")
+
+@app.post("/predict_kpi/what_if")
+def predict_kpi_what_if(request: WhatIfRequest, top: Optional[int] = None):
+    """1️⃣ KPI по многим схемам весов без пересчета коммитов: ранжированные таблицы по каждой схеме"""
+    mark_parsed()
+    start = time.perf_counter()
+    try:
+        if request.kpi is not None:
+            authors, type_counts, team_counts = counts_from_result(request.kpi)
+            baseline, baseline_team = kpi_from_result(request.kpi), request.kpi.get("team_kpi")
+        elif request.authors is not None:
+            authors = request.authors
+            baseline = baseline_team = None
+            type_counts = as_count_matrix(request.type_counts or [], authors)
+            team_counts = None if request.team_counts is None else \
+                as_count_matrix([request.team_counts], ["team"], "team_counts")[0]
+        else:
+            raise ValueError("нужен kpi (результат /predict_kpi) или authors и type_counts")
+        with stage("what_if"):
+            tables = rank_weight_sets(authors, type_counts, team_counts,
+                                      [scheme.model_dump() for scheme in request.schemes], top,
+                                      baseline, baseline_team)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректные параметры what-if: {e}")
+    with stage("serialize"):
+        return ORJSONResponse({
+            "success": True,
+            "message": "KPI рассчитаны",
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+            "developers_total": len(authors),
+            "schemes": tables
+        })
+
 @app.post("/analyze_kpi")
-def analyze_kpi(kpi_data: Dict):
+async def analyze_kpi(kpi_data: Dict, project: Optional[str] = None, bucket: Optional[float] = None):
     """2️⃣ Принимает JSON из /predict_kpi и возвращает LLM-анализ"""
     try:
+        mark_parsed()
         print("🤖 Анализ KPI...")
-        result_text = safe_analyze(kpi_data)
+        result_text, cache_status = await cached_analyze_async(kpi_data, project, bucket)
         return {
             "success": True,
-            "analysis": result_text
+            "analysis": result_text,
+            "cache": cache_status
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка анализа KPI: {e}")
 
+@app.post("/analyze_kpi/jobs", status_code=202)
+async def submit_analysis_job(kpi_data: Dict, project: Optional[str] = None, bucket: Optional[float] = None,
+                              callback_url: Optional[str] = None):
+    """2️⃣ Фоновый LLM-анализ: сразу возвращает ID задачи, результат - по опросу или на callback_url"""
+    try:
+        job_id = await get_job_queue().submit(kpi_data, project, bucket, callback_url)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Очередь задач заполнена: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректные параметры задачи: {e}")
+    print(f"📋 Задача анализа {job_id} поставлена в очередь.")
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/analyze_kpi/jobs/{job_id}"
+    }
+
+@app.get("/analyze_kpi/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """Статус и результат фоновой задачи анализа"""
+    job = await get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return {"success": True, **job}
+
+@app.post("/analyze_kpi/prompt")
+def analyze_kpi_prompt(kpi_data: Dict, bucket: Optional[float] = None):
+    """2️⃣ Промпт, который уйдет в LLM, и оценка числа его токенов (без обращения к LLM)"""
+    try:
+        prompt, stats = build_analysis_prompt(kpi_data, bucket)
+        return {"success": True, "prompt": prompt, "stats": stats}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка построения промпта: {e}")
+
+@app.post("/analyze_kpi/stream")
+async def analyze_kpi_stream(kpi_data: Dict, project: Optional[str] = None, bucket: Optional[float] = None):
+    """2️⃣ LLM-анализ потоком токенов (Server-Sent Events)"""
+    mark_parsed()
+    print("🤖 Потоковый анализ KPI...")
+    return StreamingResponse(
+        stream_analysis_events(kpi_data, project, bucket),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/predict_and_analyze")
+async def predict_and_analyze(backend_data: BackendResponse, bucket: Optional[float] = None):
+    """3️⃣ KPI и LLM-анализ одним запросом: сначала событие kpi, затем поток анализа (SSE)"""
+    try:
+        mark_parsed()
+        print("🚀 Расчёт KPI и анализ...")
+        with stage("model_dump"):
+            data_dict = backend_data.model_dump()
+        result = await run_in_threadpool(prepare_metrics_for_analyzer, data_dict)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при расчете KPI: {e}")
+
+    async def events():
+        yield format_sse("kpi", {"success": True, "message": "KPI рассчитаны успешно", "data": result})
+        async for event in stream_analysis_events(result, backend_data.project.key, bucket):
+            yield event
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/analyze_kpi/cache")
+def invalidate_analysis_cache(project: Optional[str] = None):
+    """Сбрасывает кэш LLM-анализа проекта (без project - весь кэш)"""
+    try:
+        removed = get_analysis_cache().invalidate(project)
+        return {"success": True, "removed": removed}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка очистки кэша: {e}")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Метрики в текстовом формате Prometheus (под serve.py - сумма по всем воркерам)"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/")
 def root():
     return {
         "message": "Team KPI Predictor API",
         "version": "5.0.0",
-        "endpoints": ["/predict_kpi", "/analyze_kpi"]
+        "endpoints": ["/predict_kpi", "/predict_kpi/windows", "/predict_kpi/stream", "/predict_kpi/delta", "/predict_kpi/batch", "/predict_kpi/what_if", "/analyze_kpi", "/analyze_kpi/jobs", "/analyze_kpi/stream", "/predict_and_analyze"]
     }
 
 @app.get("/health")
@@ -102,7 +457,11 @@ def health_check():
     return {
         "status": "healthy",
         "version": "5.0.0",
-        "endpoints": ["/predict_kpi", "/analyze_kpi"]
+        "llm": llm_guard_snapshot(),
+        "models": get_model_warmer().snapshot(),
+        "jobs": get_job_queue().snapshot(),
+        "result_cache": get_result_cache().snapshot(),
+        "endpoints": ["/predict_kpi", "/predict_kpi/windows", "/predict_kpi/stream", "/predict_kpi/delta", "/predict_kpi/batch", "/predict_kpi/what_if", "/analyze_kpi", "/analyze_kpi/jobs", "/analyze_kpi/stream", "/predict_and_analyze"]
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+# Детерминированный генератор синтетических данных в формате BackendResponse
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+# Шаблоны сообщений по типам коммитов
+MESSAGE_TEMPLATES = {
+    "feature": ["feat: add {thing}", "feat({area}): implement {thing}", "Add new {thing} module"],
+    "fix": ["fix: {thing} crash #{issue}", "fix({area}): handle empty {thing}", "Fixed {thing} error in {area}"],
+    "refactor": ["refactor: simplify {thing}", "cleanup: remove unused {thing}", "Optimize {area} code"],
+    "test": ["test: cover {thing}", "Add tests for {thing}", "spec: {area} {thing}"],
+    "docs": ["docs: update {thing} readme", "Document {area} {thing}", "changelog: {thing}"],
+    "other": ["Bump {thing} from 1.{issue} to 1.{next}", "Merge branch '{area}'", "Update {area}/{thing}"]
+}
+
+DEFAULT_MESSAGE_MIX = {"feature": 0.25, "fix": 0.3, "refactor": 0.1, "test": 0.1, "docs": 0.1, "other": 0.15}
+
+# Бот повторяет небольшое число одинаковых сообщений (как elasticsearchmachine)
+BOT_NAME = "elasticsearchmachine"
+BOT_MESSAGES = [
+    "[Automated] Update versions",
+    "Mute org.elasticsearch.test.FooIT testBar #12345",
+    "Bump versions after 9.1.0 release",
+    "Forward port release notes"
+]
+
+THINGS = ["parser", "cache", "login", "index", "scheduler", "api", "config", "shard", "query", "metrics"]
+AREAS = ["core", "search", "ingest", "security", "ui", "build", "docs", "ml"]
+
+
+def iter_commits(commits: int = 1000, authors: int = 20, message_mix: Optional[Dict[str, float]] = None,
+                 bot_share: float = 0.0, merge_share: float = 0.05, days: int = 365,
+                 seed: int = 0) -> Iterator[dict]:
+    """
+    Поток коммитов без хранения всего списка (подходит и для 10M коммитов).
+    Одинаковые параметры и seed дают одинаковые данные.
+    """
+    rnd = random.Random(seed)
+    mix = message_mix or DEFAULT_MESSAGE_MIX
+    types = list(mix)
+    weights = [mix[t] for t in types]
+    start = datetime(2024, 1, 1)
+    # Распределение коммитов по авторам неравномерное, как в реальных командах
+    author_weights = [1.0 / (i + 1) for i in range(authors)]
+    author_names = [f"Developer {i}" for i in range(authors)]
+
+    for i in range(commits):
+        if rnd.random() < bot_share:
+            name = BOT_NAME
+            message = rnd.choice(BOT_MESSAGES)
+        else:
+            name = rnd.choices(author_names, author_weights)[0]
+            template = rnd.choice(MESSAGE_TEMPLATES[rnd.choices(types, weights)[0]])
+            issue = rnd.randrange(1, 5000)
+            message = template.format(thing=rnd.choice(THINGS), area=rnd.choice(AREAS), issue=issue, next=issue + 1)
+
+        created = start + timedelta(seconds=rnd.randrange(days * 86400))
+        email = name.lower().replace(" ", ".") + "@example.com"
+        yield {
+            "hash": f"{seed:04x}{i:012x}",
+            "message": message,
+            "author": {"name": name, "email": email},
+            "committer": {"name": name, "email": email},
+            "createdAt": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "parents": [f"p{i}", f"q{i}"] if rnd.random() < merge_share else [f"p{i}"],
+            "branches": [rnd.choice(["main", "feature/" + rnd.choice(THINGS), "release/9.x"])],
+            "branch_names": None
+        }
+
+
+def generate_backend_response(commits: int = 1000, authors: int = 20, seed: int = 0, **kwargs) -> dict:
+    """Полный payload для /predict_kpi"""
+    return {
+        "success": True,
+        "message": "Данные получены",
+        "project": {"key": f"BENCH-{seed}", "name": "Synthetic", "description": None},
+        "repository": {"name": f"synthetic-{seed}", "createdAt": "2024-01-01T00:00:00Z"},
+        "commits": list(iter_commits(commits, authors, seed=seed, **kwargs))
+    }
+
+
+def write_ndjson(path: str, commits: int = 1000, authors: int = 20, seed: int = 0, **kwargs):
+    """Пишет коммиты в NDJSON (формат /predict_kpi/stream) без хранения в памяти"""
+    with open(path, "w", encoding="utf-8") as f:
+        for commit in iter_commits(commits, authors, seed=seed, **kwargs):
+            f.write(json.dumps(commit, ensure_ascii=False))
+            f.write("\n")
@@ -0,0 +1,185 @@
+# Нагрузочный прогон: поднимает api:app (один воркер uvicorn) и заглушку Ollama,
+# воспроизводит payload'ы с заданной конкурентностью и печатает пропускную
+# способность, перцентили задержки и долю fallback-анализа. Кэш результатов
+# /predict_kpi выключен (иначе predict меряет попадания в кэш), кроме
+# сценария predict_cached.
+# Запуск из корня репозитория: python -m benchmarks.load --concurrency 1,8,32
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.generator import generate_backend_response
+from benchmarks.stub_ollama import free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Заголовок офлайн-анализа (smart_emergency_analysis)
+FALLBACK_MARKER = "(офлайн)"
+
+
+def load_payloads(path: Optional[str], count: int, commits: int, authors: int) -> List[dict]:
+    """Payload'ы из файла (JSON или JSONL с BackendResponse) или сгенерированные"""
+    if not path:
+        return [generate_backend_response(commits, authors, seed=i) for i in range(count)]
+
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+        payloads = data if isinstance(data, list) else [data]
+    except ValueError:
+        payloads = [json.loads(line) for line in text.splitlines() if line.strip()]
+    # Пропускаем строки, не похожие на BackendResponse
+    return [p for p in payloads if isinstance(p, dict) and "commits" in p and "project" in p]
+
+
+def start_process(args: List[str], env: Dict[str, str], url: str, timeout: float = 30) -> subprocess.Popen:
+    process = subprocess.Popen(args, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Процесс завершился при старте: {' '.join(args)}")
+        try:
+            httpx.get(url, timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Процесс не ответил за {timeout}с: {' '.join(args)}")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Метод ближайшего ранга
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+async def run_level(api_url: str, scenario: str, payloads: List[dict], kpis: List[dict],
+                    concurrency: int, duration: float) -> dict:
+    """Нагрузка с фиксированной конкурентностью в течение duration секунд"""
+    latencies, errors, fallbacks, analyses = [], 0, 0, 0
+    requests = itertools.cycle(
+        [("/predict_kpi", p) for p in payloads] if scenario in ("predict", "predict_cached") else
+        [("/analyze_kpi", k) for k in kpis] if scenario == "analyze" else
+        [item for pair in zip([("/predict_kpi", p) for p in payloads], [("/analyze_kpi", k) for k in kpis])
+         for item in pair]
+    )
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors, fallbacks, analyses
+        while time.perf_counter() < deadline:
+            path, body = next(requests)
+            start = time.perf_counter()
+            try:
+                r = await client.post(api_url + path, json=body)
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+            elif path == "/analyze_kpi":
+                analyses += 1
+                if FALLBACK_MARKER in r.json().get("analysis", ""):
+                    fallbacks += 1
+
+    started = time.perf_counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies, default=0) * 1000, 1),
+        "errors": errors,
+        "fallback_rate": round(fallbacks / analyses, 3) if analyses else None
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон KPI API с заглушкой Ollama")
+    parser.add_argument("--scenario", choices=["predict", "predict_cached", "analyze", "mixed"], default="mixed")
+    parser.add_argument("--concurrency", default="1,4,16", help="уровни конкурентности через запятую")
+    parser.add_argument("--duration", type=float, default=10, help="длительность каждого уровня, с")
+    parser.add_argument("--payloads", help="JSON/JSONL файл с BackendResponse (иначе генерация)")
+    parser.add_argument("--count", type=int, default=8, help="сколько payload'ов сгенерировать")
+    parser.add_argument("--commits", type=int, default=2000, help="коммитов в сгенерированном payload")
+    parser.add_argument("--authors", type=int, default=30)
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="задержка заглушки Ollama, с")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="доля ошибок заглушки")
+    parser.add_argument("--llm-cache", action="store_true", help="не отключать кэш LLM-анализа")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    payloads = load_payloads(args.payloads, args.count, args.commits, args.authors)
+    if not payloads:
+        print("Нет payload'ов в формате BackendResponse.")
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix="kpi-load-")
+    stub_port, api_port = free_port(), free_port()
+    stub_url, api_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{api_port}"
+    env = dict(
+        os.environ,
+        OLLAMA_HOST=stub_url,
+        KPI_STATE_DB=os.path.join(workdir, "kpi_state.sqlite3"),
+        LLM_CACHE_DB=os.path.join(workdir, "llm_cache.sqlite3"),
+        ANALYSIS_JOBS_DB=os.path.join(workdir, "analysis_jobs.sqlite3")
+    )
+    if not args.llm_cache:
+        env["LLM_CACHE_TTL"] = "0"
+    if args.scenario != "predict_cached":
+        env["KPI_RESULT_CACHE_ITEMS"] = "0"
+
+    stub = start_process([sys.executable, "-m", "benchmarks.stub_ollama", "--port", str(stub_port),
+                          "--latency", str(args.llm_latency), "--error-rate", str(args.llm_error_rate)],
+                         env, stub_url + "/api/tags")
+    api = None
+    try:
+        api = start_process([sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1",
+                             "--port", str(api_port), "--workers", "1", "--log-level", "warning"],
+                            env, api_url + "/health")
+        kpis = [httpx.post(api_url + "/predict_kpi", json=p, timeout=300).json()["data"] for p in payloads]
+
+        results = []
+        print(f"Сценарий: {args.scenario}, payload'ов: {len(payloads)}, задержка LLM: {args.llm_latency}с")
+        print(f"{'conc':>5} {'req':>7} {'rps':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'err':>5} {'fallback':>9}")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            r = asyncio.run(run_level(api_url, args.scenario, payloads, kpis, concurrency, args.duration))
+            results.append(r)
+            fallback = "-" if r["fallback_rate"] is None else f"{r['fallback_rate']:.1%}"
+            print(f"{r['concurrency']:>5} {r['requests']:>7} {r['throughput_rps']:>9} {r['p50_ms']:>9} "
+                  f"{r['p90_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9} {r['errors']:>5} {fallback:>9}")
+    finally:
+        for process in filter(None, [api, stub]):
+            process.terminate()
+            process.wait(timeout=10)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
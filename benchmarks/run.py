@@ -0,0 +1,167 @@
+# Микробенчмарки сервиса KPI: время и пиковая память, сравнение с JSON-базой.
+# Запуск из корня репозитория: python -m benchmarks.run --commits 1000,100000
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+import metrics_analyzer
+from api import BackendResponse
+from benchmarks.generator import generate_backend_response
+from benchmarks.stub_ollama import StubOllama
+from fast_codec import decode_backend_response
+from kpi_whatif import counts_from_result, rank_weight_sets
+from metric_calculator import prepare_metrics_for_analyzer
+from preprocess import (
+    calculate_real_bus_factor,
+    clear_caches,
+    extract_individual_metrics,
+    extract_team_features,
+    improved_classify_commit,
+    parse_date
+)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Лучшее и среднее время из repeat запусков и пик памяти (tracemalloc) отдельным запуском"""
+    times = []
+    for _ in range(repeat):
+        clear_caches()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    clear_caches()
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "best_ms": round(min(times) * 1000, 3),
+        "mean_ms": round(sum(times) / len(times) * 1000, 3),
+        "peak_kb": round(peak / 1024, 1)
+    }
+
+
+def build_cases(payload: dict, stub_url: str = None) -> Dict[str, Callable[[], object]]:
+    commits = payload["commits"]
+    messages = [commit["message"] for commit in commits]
+    dates = [commit["createdAt"] for commit in commits]
+    authors_commits = extract_individual_metrics(payload)
+    kpi = prepare_metrics_for_analyzer(payload)
+    body = orjson.dumps(payload)
+    response = {"success": True, "message": "KPI рассчитаны успешно", "data": kpi}
+    counts = counts_from_result(kpi)
+    schemes = [{"weights": {"feature": 40 - i % 20, "test": 15 + i % 20, "docs": i % 10}} for i in range(100)]
+
+    cases = {
+        "improved_classify_commit": lambda: [improved_classify_commit(m) for m in messages],
+        "parse_date": lambda: [parse_date(d) for d in dates],
+        "extract_team_features": lambda: extract_team_features(payload),
+        "calculate_real_bus_factor": lambda: calculate_real_bus_factor(authors_commits),
+        "prepare_metrics_for_analyzer": lambda: prepare_metrics_for_analyzer(payload),
+        # 100 схем весов по готовым счетчикам вместо 100 пересчетов
+        "rank_weight_sets[100]": lambda: rank_weight_sets(*counts, schemes),
+        # Разбор тела /predict_kpi: как FastAPI (json + модель), strict и fast режимы
+        "decode[fastapi]": lambda: BackendResponse.model_validate(json.loads(body)).model_dump(),
+        "decode[strict]": lambda: BackendResponse.model_validate_json(body).model_dump(),
+        "decode[fast]": lambda: decode_backend_response(body),
+        # Кодирование ответа: как FastAPI по умолчанию и через orjson
+        "encode[fastapi]": lambda: JSONResponse(jsonable_encoder(response)),
+        "encode[orjson]": lambda: ORJSONResponse(response)
+    }
+    if stub_url:
+        analyzer = metrics_analyzer.UniversalTeamAnalyzer(ollama_host=stub_url)
+        cases["safe_analyze[stub]"] = lambda: analyzer.analyze_team_data(kpi)
+    return cases
+
+
+def run(sizes: List[int], authors: int, bot_share: float, seed: int, repeat: int, use_stub: bool) -> Dict[str, dict]:
+    results = {}
+    stub = StubOllama() if use_stub else None
+    if stub:
+        stub.__enter__()
+    try:
+        for size in sizes:
+            payload = generate_backend_response(size, authors, seed=seed, bot_share=bot_share)
+            for name, fn in build_cases(payload, stub.url if stub else None).items():
+                key = f"{name}@{size}"
+                results[key] = measure(fn, repeat)
+                r = results[key]
+                print(f"{key:<45} best {r['best_ms']:>11.3f} ms   mean {r['mean_ms']:>11.3f} ms   peak {r['peak_kb']:>10.1f} KB")
+    finally:
+        if stub:
+            stub.__exit__(None, None, None)
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Список регрессий: время или память выросли больше чем в threshold раз"""
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric in ("best_ms", "peak_kb"):
+            if base[metric] > 0 and current[metric] > base[metric] * threshold:
+                regressions.append(f"{key}: {metric} {base[metric]} -> {current[metric]} "
+                                   f"(x{current[metric] / base[metric]:.2f})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки KPI-сервиса")
+    parser.add_argument("--commits", default="1000,10000", help="размеры через запятую (1000..10000000)")
+    parser.add_argument("--authors", type=int, default=50)
+    parser.add_argument("--bot-share", type=float, default=0.1, help="доля коммитов бота")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-stub", action="store_true", help="не запускать заглушку Ollama")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="записать результаты как базу")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="сравнить с базой")
+    parser.add_argument("--threshold", type=float, default=1.3, help="допустимый рост относительно базы")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.commits.split(",")]
+    results = run(sizes, args.authors, args.bot_share, args.seed, args.repeat, not args.no_stub)
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": {"authors": args.authors, "bot_share": args.bot_share, "seed": args.seed},
+        "results": results
+    }
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены: {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Регрессии:")
+            for line in regressions:
+                print(f" - {line}")
+            return 1
+        print("Регрессий нет.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
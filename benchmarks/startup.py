@@ -0,0 +1,122 @@
+# Время холодного старта сервиса: импорт api (отдельным процессом, без
+# прогретых кэшей модулей в памяти), время до первого ответа /health для
+# uvicorn и для serve.py с несколькими воркерами, самые дорогие импорты.
+# Запуск из корня репозитория: python -m benchmarks.startup --repeat 5 --workers 4
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.stub_ollama import free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import api; print(time.perf_counter() - start)"
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, cwd=ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def measure_ready(args: List[str], env: Dict[str, str], url: str, timeout: float = 30) -> float:
+    """Секунды от запуска процесса до первого ответа url"""
+    start = time.perf_counter()
+    process = subprocess.Popen(args, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Один клиент на все попытки: создание клиента дороже самого опроса
+    client = httpx.Client(timeout=1)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Процесс завершился при старте: {' '.join(args)}")
+            try:
+                client.get(url)
+                return time.perf_counter() - start
+            except httpx.HTTPError:
+                time.sleep(0.01)
+        raise RuntimeError(f"Процесс не ответил за {timeout}с: {' '.join(args)}")
+    finally:
+        client.close()
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def top_imports(env: Dict[str, str], limit: int) -> List[tuple]:
+    """Самые дорогие модули верхнего уровня по -X importtime (накопительно, мс)"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import api"], env=env, cwd=ROOT,
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        # Отступ в имени - глубина вложенности; интересны прямые импорты api и сам api
+        if len(name) - len(name.lstrip()) <= 3:
+            modules.append((name.strip(), int(parts[1]) / 1000))
+    return sorted(modules, key=lambda item: -item[1])[:limit]
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "best_ms": round(min(values) * 1000, 1),
+        "median_ms": round(statistics.median(values) * 1000, 1)
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Время холодного старта KPI API")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="воркеров serve.py")
+    parser.add_argument("--top", type=int, default=10, help="сколько самых дорогих импортов показать")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="kpi-startup-")
+    env = dict(
+        os.environ,
+        KPI_STATE_DB=os.path.join(workdir, "kpi_state.sqlite3"),
+        LLM_CACHE_DB=os.path.join(workdir, "llm_cache.sqlite3"),
+        ANALYSIS_JOBS_DB=os.path.join(workdir, "analysis_jobs.sqlite3")
+    )
+
+    results = {"import api": summary([measure_import(env) for _ in range(args.repeat)])}
+    launchers = {
+        "uvicorn api:app": lambda port: [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1",
+                                         "--port", str(port), "--log-level", "warning"],
+        f"serve.py --workers {args.workers}": lambda port: [sys.executable, "serve.py", "--host", "127.0.0.1",
+                                                            "--port", str(port), "--workers", str(args.workers),
+                                                            "--log-level", "warning"]
+    }
+    for name, command in launchers.items():
+        times = []
+        for _ in range(args.repeat):
+            port = free_port()
+            times.append(measure_ready(command(port), env, f"http://127.0.0.1:{port}/health"))
+        results[f"ready[{name}]"] = summary(times)
+
+    print(f"{'':<32} {'best ms':>9} {'median ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<32} {r['best_ms']:>9} {r['median_ms']:>10}")
+
+    imports = top_imports(env, args.top)
+    print("\nСамые дорогие импорты (накопительно):")
+    for name, ms in imports:
+        print(f"  {name:<30} {ms:>8.1f} мс")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results, "imports": imports}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
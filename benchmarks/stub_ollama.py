@@ -0,0 +1,156 @@
+# Локальная заглушка Ollama API для бенчмарков и нагрузочных тестов без сети
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_TEXT = "Проблемы команды: мало тестов. Сильные стороны: стабильный поток фич. Действия: усилить ревью."
+# keep_alive Ollama по умолчанию
+DEFAULT_KEEP_ALIVE = 300.0
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive(value) -> float:
+    """keep_alive в секундах: число или строка вида 30s/5m/1h; отрицательное - бессрочно"""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        unit = next((u for u in ("ms", "s", "m", "h") if value.endswith(u)), "")
+        seconds = float(value[:len(value) - len(unit)]) * DURATION_UNITS.get(unit, 1)
+    return float("inf") if seconds < 0 else seconds
+
+
+def create_stub_app(latency: float = 0.0, error_rate: float = 0.0, tokens: int = 20, seed: int = 0,
+                    load_time: float = 0.0) -> FastAPI:
+    """
+    Заглушка /api/generate: отвечает через latency секунд, с вероятностью
+    error_rate возвращает 500. При stream: true отдает tokens фрагментов NDJSON.
+    Первый запрос к незагруженной модели дополнительно ждет load_time секунд;
+    модель выгружается через keep_alive после последнего запроса. Запрос без
+    prompt только загружает модель.
+    """
+    app = FastAPI(title="Ollama stub")
+    rnd = random.Random(seed)
+    words = STUB_TEXT.split(" ")
+    app.state.requests = 0
+    app.state.model_requests = {}
+    app.state.loads = {}
+    # Модель -> момент выгрузки (time.monotonic)
+    app.state.loaded = {}
+    loading = {}
+
+    async def ensure_loaded(model: str, keep_alive):
+        if app.state.loaded.get(model, 0) <= time.monotonic():
+            # Одновременные запросы ждут одну загрузку, как в Ollama
+            if model not in loading:
+                loading[model] = asyncio.ensure_future(asyncio.sleep(load_time))
+                app.state.loads[model] = app.state.loads.get(model, 0) + 1
+            try:
+                await asyncio.shield(loading[model])
+            finally:
+                loading.pop(model, None)
+        app.state.loaded[model] = time.monotonic() + parse_keep_alive(keep_alive)
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model")
+        app.state.requests += 1
+        app.state.model_requests[model] = app.state.model_requests.get(model, 0) + 1
+        await ensure_loaded(model, body.get("keep_alive"))
+        if not body.get("prompt"):
+            return {"model": model, "response": "", "done": True, "done_reason": "load"}
+        if rnd.random() < error_rate:
+            await asyncio.sleep(latency)
+            return JSONResponse({"error": "stub failure"}, status_code=500)
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return {"model": body.get("model"), "response": STUB_TEXT, "done": True}
+
+        async def chunks():
+            delay = latency / max(tokens, 1)
+            for i in range(tokens):
+                await asyncio.sleep(delay)
+                yield json.dumps({"response": words[i % len(words)] + " ", "done": False}, ensure_ascii=False) + "\n"
+            yield json.dumps({"response": "", "done": True}) + "\n"
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    @app.get("/api/ps")
+    async def ps():
+        now = time.monotonic()
+        return {"models": [{"name": model, "expires_in": round(expires - now, 1)}
+                           for model, expires in app.state.loaded.items() if expires > now]}
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubOllama:
+    """Заглушка в фоновом потоке: with StubOllama(latency=1) as stub: stub.url"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, tokens: int = 20, port: int = 0,
+                 load_time: float = 0.0):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.app = create_stub_app(latency, error_rate, tokens, load_time=load_time)
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self) -> "StubOllama":
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Заглушка Ollama не запустилась")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+    @property
+    def requests(self) -> int:
+        return self.app.state.requests
+
+    @property
+    def model_requests(self) -> dict:
+        """Запросов по моделям"""
+        return dict(self.app.state.model_requests)
+
+    @property
+    def loads(self) -> dict:
+        """Сколько раз загружалась каждая модель"""
+        return dict(self.app.state.loads)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Ollama API")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--tokens", type=int, default=20, help="фрагментов в потоковом ответе")
+    parser.add_argument("--load-time", type=float, default=0.0, help="загрузка модели при первом запросе, с")
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(args.latency, args.error_rate, args.tokens, load_time=args.load_time),
+                host="127.0.0.1", port=args.port)
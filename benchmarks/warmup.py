@@ -0,0 +1,116 @@
+# Прогрев и маршрутизация моделей: поднимает заглушку Ollama с временем
+# загрузки модели и api:app с прогревом и без, замеряет первый /analyze_kpi
+# для небольшой и большой команды и показывает, в какую модель ушел каждый
+# запрос и сколько раз заглушка загружала модели.
+# Запуск из корня репозитория: python -m benchmarks.warmup --load-time 3
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import httpx
+
+from benchmarks.generator import generate_backend_response
+from benchmarks.load import start_process
+from benchmarks.stub_ollama import StubOllama, free_port
+
+LARGE_MODEL = "stub-large"
+SMALL_MODEL = "stub-small"
+
+
+def wait_warm(client: httpx.Client, api_url: str, timeout: float) -> float:
+    """Секунды до готовности всех моделей по /health"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        models = client.get(f"{api_url}/health").json()["models"]["models"]
+        if all(m["status"] == "ready" for m in models.values()):
+            return time.perf_counter() - start
+        time.sleep(0.05)
+    raise RuntimeError(f"Модели не прогрелись за {timeout}с")
+
+
+def run_scenario(stub: StubOllama, warmup: bool, teams: Dict[str, dict], args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="kpi-warmup-")
+    env = dict(
+        os.environ,
+        OLLAMA_HOST=stub.url,
+        LLM_MODEL=LARGE_MODEL,
+        LLM_SMALL_MODEL=SMALL_MODEL,
+        LLM_WARMUP="1" if warmup else "0",
+        LLM_KEEP_ALIVE=args.keep_alive,
+        KPI_STATE_DB=os.path.join(workdir, "kpi_state.sqlite3"),
+        LLM_CACHE_DB=os.path.join(workdir, "llm_cache.sqlite3"),
+        ANALYSIS_JOBS_DB=os.path.join(workdir, "analysis_jobs.sqlite3")
+    )
+    port = free_port()
+    api_url = f"http://127.0.0.1:{port}"
+    loads_before = stub.loads
+    # Заглушка общая: модели, загруженные предыдущим сценарием, выгружаются
+    stub.app.state.loaded.clear()
+    process = start_process([sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], env, f"{api_url}/health")
+    result = {}
+    try:
+        with httpx.Client(timeout=120) as client:
+            if warmup:
+                result["warmup_s"] = round(wait_warm(client, api_url, args.load_time * 4 + 30), 3)
+            for name, kpi in teams.items():
+                route = client.post(f"{api_url}/analyze_kpi/prompt", json=kpi).json()["stats"]
+                start = time.perf_counter()
+                client.post(f"{api_url}/analyze_kpi", json=kpi).raise_for_status()
+                result[name] = {"model": route["model"], "first_s": round(time.perf_counter() - start, 3)}
+            metrics = client.get(f"{api_url}/metrics").text
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    result["loads"] = {m: n - loads_before.get(m, 0) for m, n in stub.loads.items() if n > loads_before.get(m, 0)}
+    result["route_metrics"] = [line for line in metrics.splitlines() if line.startswith("kpi_llm_route_seconds_count")]
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Первый /analyze_kpi с прогревом моделей и без")
+    parser.add_argument("--load-time", type=float, default=3.0, help="загрузка модели в заглушке, с")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="генерация в заглушке, с")
+    parser.add_argument("--keep-alive", default="30m")
+    parser.add_argument("--small-authors", type=int, default=3)
+    parser.add_argument("--large-authors", type=int, default=40)
+    parser.add_argument("--commits", type=int, default=2000)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    from api import app
+    from fastapi.testclient import TestClient
+    # KPI считаются в процессе, без lifespan (прогрев здесь не нужен)
+    client = TestClient(app)
+    teams = {
+        f"{label} ({authors} авторов)": client.post(
+            "/predict_kpi", json=generate_backend_response(args.commits, authors, seed=authors)
+        ).json()["data"]
+        for label, authors in (("small", args.small_authors), ("large", args.large_authors))
+    }
+
+    results = {}
+    with StubOllama(latency=args.llm_latency, load_time=args.load_time) as stub:
+        for warmup in (False, True):
+            results["warmup" if warmup else "cold"] = run_scenario(stub, warmup, teams, args)
+
+    for scenario, r in results.items():
+        print(f"[{scenario}]" + (f" прогрев за {r['warmup_s']}с" if "warmup_s" in r else ""))
+        for name in teams:
+            print(f"  {name:<24} {r[name]['model']:<12} первый ответ {r[name]['first_s']:>7.3f}с")
+        print(f"  загрузок моделей: {r['loads']}")
+        for line in r["route_metrics"]:
+            print(f"  {line}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
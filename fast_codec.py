@@ -0,0 +1,102 @@
+import os
+from typing import Any, List, Tuple
+
+import orjson
+
+# Режим разбора тела /predict_kpi по умолчанию: strict (полная модель Pydantic) или fast
+KPI_DECODE_MODE = os.getenv("KPI_DECODE_MODE", "strict")
+DECODE_MODES = ("strict", "fast")
+
+# Ошибки в терминах Pydantic (type, msg), чтобы 422 в обоих режимах имели одну форму
+ERROR_TYPES = {
+    dict: ("model_type", "Input should be an object"),
+    str: ("string_type", "Input should be a valid string"),
+    list: ("list_type", "Input should be a valid list"),
+    bool: ("bool_type", "Input should be a valid boolean"),
+}
+# Значения, которые Pydantic (lax) принимает как bool
+BOOL_VALUES = {"0": False, "off": False, "f": False, "false": False, "n": False, "no": False,
+               "1": True, "on": True, "t": True, "true": True, "y": True, "yes": True}
+_MISSING = object()
+
+
+class DecodeError(ValueError):
+    """Ошибка формата тела: loc - путь до поля, type/msg/input - как в ошибках Pydantic"""
+
+    def __init__(self, loc: Tuple, error_type: str, msg: str, value: Any):
+        super().__init__(f"{'.'.join(map(str, loc)) or 'body'}: {msg}")
+        self.loc = loc
+        self.type = error_type
+        self.msg = msg
+        self.input = value
+
+    def to_error(self) -> dict:
+        """Ошибка в формате RequestValidationError (путь от body)"""
+        return {"type": self.type, "loc": ("body", *self.loc), "msg": self.msg, "input": self.input}
+
+
+def _require(parent: dict, key: str, kind: type, loc: Tuple, optional: bool = False) -> Any:
+    """Значение поля parent[key] типа kind; отсутствует или не того типа - DecodeError"""
+    value = parent.get(key, _MISSING)
+    if value is _MISSING:
+        if optional:
+            return None
+        raise DecodeError(loc + (key,), "missing", "Field required", parent)
+    if value is None and optional:
+        return None
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str):
+            if value.lower() in BOOL_VALUES:
+                return BOOL_VALUES[value.lower()]
+            raise DecodeError(loc + (key,), "bool_parsing",
+                              "Input should be a valid boolean, unable to interpret input", value)
+    elif isinstance(value, kind):
+        return value
+    error_type, msg = ERROR_TYPES[kind]
+    raise DecodeError(loc + (key,), error_type, msg, value)
+
+
+def _check_commit(commit: Any, loc: Tuple):
+    """Проверяет и дополняет только поля коммита, которые читает расчет KPI"""
+    if not isinstance(commit, dict):
+        raise DecodeError(loc, *ERROR_TYPES[dict], commit)
+    _require(commit, "message", str, loc)
+    author = _require(commit, "author", dict, loc)
+    _require(author, "name", str, loc + ("author",))
+    _require(commit, "createdAt", str, loc)
+
+    commit.setdefault("parents", [])
+    _require(commit, "parents", list, loc)
+    _require(commit, "branches", list, loc, optional=True)
+    _require(commit, "hash", str, loc, optional=True)
+
+
+def decode_backend_response(body: bytes) -> dict:
+    """
+    Быстрый разбор BackendResponse: orjson и проверка только используемых
+    полей вместо построения моделей Pydantic и model_dump(). Обязательные
+    поля верхнего уровня (success, message, project, repository) те же, что
+    в модели. Ошибки формата - DecodeError с путем до поля.
+    """
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise DecodeError((), "json_invalid", f"Invalid JSON: {e}", body.decode("utf-8", "replace"))
+
+    if not isinstance(data, dict):
+        raise DecodeError((), *ERROR_TYPES[dict], data)
+    _require(data, "success", bool, ())
+    _require(data, "message", str, ())
+    project = _require(data, "project", dict, ())
+    _require(project, "key", str, ("project",), optional=True)
+    repository = _require(data, "repository", dict, ())
+    _require(repository, "name", str, ("repository",), optional=True)
+    data.setdefault("commits", [])
+    commits: List[dict] = _require(data, "commits", list, ())
+    for i, commit in enumerate(commits):
+        _check_commit(commit, ("commits", i))
+    return data
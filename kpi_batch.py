@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from metric_calculator import prepare_metrics_for_analyzer
+from worker_limits import worker_share
+
+
+def available_cpus() -> int:
+    """CPU, доступные процессу (с учетом affinity/cpuset контейнера, а не всех CPU хоста)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+# Размер общего пула (KPI_BATCH_WORKERS, иначе число доступных CPU - на весь
+# сервис, воркеры serve.py делят его); больше процессов запрос получить не может
+DEFAULT_WORKERS = worker_share(int(os.getenv("KPI_BATCH_WORKERS", "0")) or available_cpus())
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Общий пул процессов фиксированного размера DEFAULT_WORKERS"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=DEFAULT_WORKERS)
+        return _pool
+
+
+def _replace_pool(broken: ProcessPoolExecutor):
+    """Пул сломан падением процесса: следующий _get_pool создаст новый (один раз на поломку)"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    """Останавливает общий пул процессов"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _project_label(payload: Dict) -> Optional[str]:
+    project = payload.get("project") or {}
+    return project.get("key") or project.get("name")
+
+
+def compute_kpi_item(payload: Dict) -> Dict:
+    """Расчет KPI одного проекта с изоляцией ошибок и замером времени"""
+    start = time.perf_counter()
+    try:
+        result = {"success": True, "data": prepare_metrics_for_analyzer(payload)}
+    except Exception as e:
+        result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _crashed_item(e: BaseException) -> Dict:
+    return {"success": False, "error": f"BrokenProcessPool: процесс-воркер упал на этом проекте ({e})",
+            "elapsed_ms": None}
+
+
+def _run_in_pool(payloads: List[Dict], workers: int) -> List[Dict]:
+    """
+    Проекты в общем пуле, не больше workers одновременно. Падение процесса
+    (BrokenProcessPool) ломает все незавершенные задачи пула, поэтому пул
+    пересоздается, а незавершенные проекты отправляются заново по одному:
+    проект, на котором пул ломается в одиночку, помечается ошибкой, остальные
+    считаются нормально.
+    """
+    items: List[Optional[Dict]] = [None] * len(payloads)
+    pending = deque(range(len(payloads)))
+    isolate = False
+    while pending:
+        pool = _get_pool()
+        limit = 1 if isolate else workers
+        running = {}
+        broken = None
+        while (pending or running) and broken is None:
+            while pending and len(running) < limit:
+                index = pending.popleft()
+                try:
+                    running[pool.submit(compute_kpi_item, payloads[index])] = index
+                except BrokenProcessPool as e:
+                    pending.appendleft(index)
+                    broken = e
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    items[index] = future.result()
+                except BrokenProcessPool as e:
+                    if isolate:
+                        items[index] = _crashed_item(e)
+                    else:
+                        pending.appendleft(index)
+                    broken = e
+                except Exception as e:
+                    items[index] = {"success": False, "error": f"{type(e).__name__}: {e}", "elapsed_ms": None}
+
+        if broken is not None:
+            # Задачи, завершившиеся до поломки, сохраняют результат; остальные - заново
+            for future, index in running.items():
+                try:
+                    items[index] = future.result()
+                except BrokenProcessPool:
+                    pending.append(index)
+                except Exception as e:
+                    items[index] = {"success": False, "error": f"{type(e).__name__}: {e}", "elapsed_ms": None}
+            _replace_pool(pool)
+            isolate = True
+    return items
+
+
+def predict_kpi_batch(payloads: List[Dict], workers: Optional[int] = None) -> List[Dict]:
+    """
+    Считает prepare_metrics_for_analyzer для многих проектов в общем пуле
+    процессов. Результаты возвращаются в порядке входа; ошибка одного проекта
+    (включая падение процесса-воркера) не влияет на остальные.
+    workers ограничивает параллелизм запроса (не больше DEFAULT_WORKERS).
+    Даже один проект или workers=1 считаются в пуле, а не в процессе API:
+    падение расчета не должно ронять воркер сервиса.
+    """
+    workers = max(min(workers or DEFAULT_WORKERS, DEFAULT_WORKERS), 1)
+    items = _run_in_pool(payloads, workers)
+
+    for index, (payload, item) in enumerate(zip(payloads, items)):
+        item["index"] = index
+        item["project"] = _project_label(payload)
+    return items
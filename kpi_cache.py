@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import orjson
+
+from preprocess import BRANCH_FIELDS, collect_commits
+
+# Настройки кэша результатов /predict_kpi (в памяти процесса)
+KPI_RESULT_CACHE_MB = float(os.getenv("KPI_RESULT_CACHE_MB", "32"))
+KPI_RESULT_CACHE_ITEMS = int(os.getenv("KPI_RESULT_CACHE_ITEMS", "256"))
+# Входит в отпечаток: при изменении формул KPI старые ETag перестают совпадать
+KPI_FINGERPRINT_VERSION = "1"
+
+
+def _commit_token(commit: dict) -> str:
+    """Hash коммита и его ветки; коммит без hash - по полному содержимому"""
+    token = commit.get("hash") or hashlib.blake2b(
+        orjson.dumps(commit, option=orjson.OPT_SORT_KEYS), digest_size=16
+    ).hexdigest()
+    branches = [branch for field in BRANCH_FIELDS for branch in (commit.get(field) or [])]
+    if branches:
+        token += "\0" + "\0".join(sorted(branches))
+    return token
+
+
+def content_fingerprint(data: dict) -> str:
+    """
+    Отпечаток содержимого проекта: ключ проекта, имя репозитория и
+    отсортированные hash коммитов с ветками. Git-hash определяет содержимое
+    коммита, поэтому порядок коммитов и форматирование JSON на отпечаток не
+    влияют, а ветки учитываются отдельно (от них зависит сложность).
+    """
+    project = data.get("project") or {}
+    repository = data.get("repository") or {}
+    tokens = sorted(_commit_token(commit) for commit in collect_commits(data, dedup=False))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(orjson.dumps([KPI_FINGERPRINT_VERSION, project.get("key"), repository.get("name")]))
+    digest.update("\n".join(tokens).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def body_key(body: bytes, mode: str) -> str:
+    """Ключ сырого тела запроса (режим разбора входит в ключ: проверки у режимов разные)"""
+    digest = hashlib.blake2b(mode.encode("utf-8"), digest_size=16)
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Сравнение If-None-Match с ETag (слабое, как требует RFC 9110 для If-None-Match)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class KPIResultCache:
+    """
+    LRU готовых ответов /predict_kpi (сериализованное тело) по отпечатку
+    содержимого, ограниченный числом записей и суммарным размером.
+    Дополнительно запоминается отпечаток для ключа сырого тела: повторный
+    запрос с теми же байтами обходится без разбора JSON.
+    """
+
+    def __init__(self, max_bytes: int = int(KPI_RESULT_CACHE_MB * 1024 * 1024),
+                 max_items: int = KPI_RESULT_CACHE_ITEMS):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._results: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bodies: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def fingerprint_for_body(self, key: str) -> Optional[str]:
+        with self._lock:
+            fingerprint = self._bodies.get(key)
+            if fingerprint is not None:
+                self._bodies.move_to_end(key)
+            return fingerprint
+
+    def remember_body(self, key: str, fingerprint: str):
+        with self._lock:
+            self._bodies[key] = fingerprint
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.max_items:
+                self._bodies.popitem(last=False)
+
+    def get(self, fingerprint: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._results.get(fingerprint)
+            if content is not None:
+                self._results.move_to_end(fingerprint)
+            return content
+
+    def put(self, fingerprint: str, content: bytes):
+        # Ответ больше всего кэша не сохраняется
+        if len(content) > self.max_bytes or self.max_items <= 0:
+            return
+        with self._lock:
+            previous = self._results.pop(fingerprint, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._results[fingerprint] = content
+            self._size += len(content)
+            while self._size > self.max_bytes or len(self._results) > self.max_items:
+                _, evicted = self._results.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._bodies.clear()
+            self._size = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._results),
+                "bytes": self._size,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes
+            }
+
+
+_result_cache: Optional[KPIResultCache] = None
+
+
+def get_result_cache() -> KPIResultCache:
+    """Общий кэш результатов /predict_kpi (создается при первом обращении)"""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = KPIResultCache()
+    return _result_cache
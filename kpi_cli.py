@@ -0,0 +1,379 @@
+# Офлайн-расчет KPI по каталогу выгрузок проектов без HTTP-сервиса.
+# Запуск: python kpi_cli.py dumps/ "more/**/*.jsonl.gz" -o kpi.jsonl --workers 8
+import argparse
+import glob
+import gzip
+import json
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, Tuple
+
+import orjson
+
+from kpi_batch import DEFAULT_WORKERS, compute_kpi_item
+from metric_accumulator import MetricAccumulator
+from metric_sketch import SketchAccumulator
+
+DUMP_SUFFIXES = (".json", ".jsonl", ".ndjson", ".json.gz", ".jsonl.gz", ".ndjson.gz")
+# Коммитов JSONL-файла, учитываемых за один вызов MetricAccumulator.add_many
+COMMIT_BATCH_SIZE = 5000
+
+# Колонки командных метрик (как team_metrics в ответе /predict_kpi)
+INT_COLUMNS = ["commits_total", "merge_conflicts", "bus_factor", "refactor_commits", "fix_commits",
+               "feature_commits", "docs_commits", "test_commits", "active_days", "team_size"]
+FLOAT_COLUMNS = ["refactor_ratio", "fix_ratio", "feature_ratio", "docs_ratio", "test_ratio",
+                 "avg_commits_per_dev", "avg_complexity"]
+# Колонки дедупликации (как dedup в ответе /predict_kpi)
+DEDUP_COLUMNS = ["commits_received", "duplicates_removed"]
+
+
+def find_dumps(patterns: List[str]) -> List[str]:
+    """Файлы выгрузок по каталогам, файлам и glob-шаблонам (без повторов, по алфавиту)"""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                found.update(os.path.join(root, name) for name in files if name.endswith(DUMP_SUFFIXES))
+        else:
+            found.update(path for path in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(path) and path.endswith(DUMP_SUFFIXES))
+    return sorted(found)
+
+
+def _is_project(item: dict) -> bool:
+    return "commits" in item or "repos" in item
+
+
+def _read_json(path: str):
+    """Целый JSON-документ: обычный файл через mmap без копии в память Python"""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            return orjson.loads(f.read())
+    if os.path.getsize(path) == 0:
+        raise ValueError("пустой файл")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return orjson.loads(memoryview(mm))
+
+
+def _iter_lines(path: str) -> Iterator[bytes]:
+    """Строки JSONL потоком: gzip - через распаковку, обычный файл - через mmap"""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from f
+        return
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from iter(mm.readline, b"")
+
+
+def _file_project(path: str) -> dict:
+    name = os.path.basename(path).split(".")[0]
+    return {"key": name, "name": name}
+
+
+def iter_file_results(path: str, sketch: bool = False) -> Iterator[Tuple[dict, dict]]:
+    """
+    (метаданные проекта, результат compute_kpi_item) для каждого проекта файла.
+    JSON: объект-проект, массив проектов или массив коммитов. JSONL: строки -
+    проекты или коммиты; коммиты файла считаются одним проектом потоково,
+    через MetricAccumulator (sketch - SketchAccumulator в фиксированной
+    памяти), без загрузки всего файла.
+    """
+    if not path.endswith((".jsonl", ".ndjson", ".jsonl.gz", ".ndjson.gz")):
+        data = _read_json(path)
+        if isinstance(data, list) and data and all(isinstance(item, dict) and _is_project(item) for item in data):
+            for item in data:
+                yield item, compute_kpi_item(item)
+        elif isinstance(data, list):
+            payload = {"project": _file_project(path), "commits": data}
+            yield payload, compute_kpi_item(payload)
+        else:
+            yield data, compute_kpi_item(data)
+        return
+
+    start = time.perf_counter()
+    accumulator = SketchAccumulator() if sketch else MetricAccumulator()
+    batch, commits_seen = [], 0
+    try:
+        for number, line in enumerate(_iter_lines(path), 1):
+            if not line.strip():
+                continue
+            try:
+                item = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                raise ValueError(f"строка {number}: {e}")
+            if isinstance(item, dict) and _is_project(item):
+                yield item, compute_kpi_item(item)
+                continue
+            batch.append(item)
+            commits_seen += 1
+            if len(batch) >= COMMIT_BATCH_SIZE:
+                accumulator.add_many(batch)
+                batch = []
+        accumulator.add_many(batch)
+        if commits_seen:
+            result = {"success": True, "data": accumulator.result()}
+        else:
+            return
+    except Exception as e:
+        result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    yield {"project": _file_project(path)}, result
+
+
+def result_row(source: str, item: int, payload: dict, result: dict) -> dict:
+    """Плоская строка результата: колонки метрик команды и разработчики в JSON"""
+    project = payload.get("project") or {}
+    repository = payload.get("repository") or {}
+    data = result.get("data") or {}
+    team = data.get("team_metrics") or {}
+    row = {
+        "source": source,
+        "item": item,
+        "project_key": project.get("key"),
+        "project_name": project.get("name"),
+        "repository": repository.get("name"),
+        "success": result["success"],
+        "error": result.get("error"),
+        "elapsed_ms": result.get("elapsed_ms"),
+        "team_kpi": data.get("team_kpi")
+    }
+    row.update({column: int(team[column]) if column in team else None for column in INT_COLUMNS})
+    row.update({column: float(team[column]) if column in team else None for column in FLOAT_COLUMNS})
+    dedup = data.get("dedup") or {}
+    row.update({column: int(dedup[column]) if column in dedup else None for column in DEDUP_COLUMNS})
+    row["developers"] = json.dumps(data["developers"], ensure_ascii=False) if "developers" in data else None
+    # Приближенный расчет (--sketch): границы ошибок в JSON
+    row["sketch"] = json.dumps(data["sketch"], ensure_ascii=False) if "sketch" in data else None
+    return row
+
+
+def process_source(path: str, sketch: bool = False) -> dict:
+    """Задача воркера: все проекты одного файла; ошибка чтения файла - одна строка с error"""
+    start = time.perf_counter()
+    stat = os.stat(path)
+    try:
+        rows = [result_row(path, i, payload, result)
+                for i, (payload, result) in enumerate(iter_file_results(path, sketch))]
+    except Exception as e:
+        rows = [result_row(path, 0, {}, {"success": False, "error": f"{type(e).__name__}: {e}"})]
+    return {
+        "source": path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "rows": rows,
+        "elapsed": time.perf_counter() - start
+    }
+
+
+class JSONLWriter:
+    """Строки результата в JSONL; позиция после каждого сброса пишется в контрольную точку"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def recover(self, checkpoint: List[dict]):
+        # Отрезаем строки, дописанные после последней контрольной точки
+        offset = max((entry.get("offset", 0) for entry in checkpoint), default=0)
+        if os.path.exists(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def write(self, rows: List[dict]) -> dict:
+        with open(self.path, "ab") as f:
+            for row in rows:
+                f.write(orjson.dumps(row))
+                f.write(b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            return {"offset": f.tell()}
+
+
+class ParquetWriter:
+    """
+    Строки результата частями Parquet (part-NNNNN.parquet) в каталоге output.
+    Часть пишется атомарно; части, не попавшие в контрольную точку, удаляются.
+    """
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Для вывода в Parquet нужен pyarrow (pip install pyarrow) или используйте .jsonl")
+        self.pa, self.pq = pa, pq
+        self.path = path
+        self.schema = pa.schema(
+            [("source", pa.string()), ("item", pa.int64()), ("project_key", pa.string()),
+             ("project_name", pa.string()), ("repository", pa.string()), ("success", pa.bool_()),
+             ("error", pa.string()), ("elapsed_ms", pa.float64()), ("team_kpi", pa.float64())] +
+            [(column, pa.int64()) for column in INT_COLUMNS] +
+            [(column, pa.float64()) for column in FLOAT_COLUMNS] +
+            [(column, pa.int64()) for column in DEDUP_COLUMNS] +
+            # Разработчики и границы ошибок --sketch - JSON-строками, как в JSONL
+            [("developers", pa.string()), ("sketch", pa.string())]
+        )
+        os.makedirs(path, exist_ok=True)
+        self.parts = 0
+
+    def recover(self, checkpoint: List[dict]):
+        known = {entry["part"] for entry in checkpoint if entry.get("part")}
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and name not in known:
+                os.remove(os.path.join(self.path, name))
+        self.parts = len(known)
+
+    def write(self, rows: List[dict]) -> dict:
+        name = f"part-{self.parts:05d}.parquet"
+        target = os.path.join(self.path, name)
+        self.pq.write_table(self.pa.Table.from_pylist(rows, schema=self.schema), target + ".tmp")
+        os.replace(target + ".tmp", target)
+        self.parts += 1
+        return {"part": name}
+
+
+def load_checkpoint(path: str) -> List[dict]:
+    """Записи сбросов; недописанная последняя строка (обрыв при записи) игнорируется"""
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+    return entries
+
+
+def _format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}ч{minutes:02d}м" if hours else f"{minutes}м{seconds:02d}с"
+
+
+def run(sources: List[str], output: str, workers: int, flush_every: int, checkpoint_path: str,
+        resume: bool = True, progress_interval: float = 1.0, sketch: bool = False) -> dict:
+    """
+    Считает KPI всех файлов в пуле процессов. Результаты сбрасываются в
+    output каждые flush_every файлов, после сброса файлы отмечаются в
+    контрольной точке; при повторном запуске отмеченные файлы (с тем же
+    размером и mtime) пропускаются, а недописанный хвост вывода отбрасывается.
+    """
+    writer = ParquetWriter(output) if output.endswith(".parquet") else JSONLWriter(output)
+    if not resume:
+        for path in (checkpoint_path, output):
+            if os.path.isfile(path):
+                os.remove(path)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint:
+        # Переписываем без недописанного хвоста, чтобы новые записи не склеились с ним
+        with open(checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in checkpoint)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+    writer.recover(checkpoint)
+    done = {(item["source"], item["size"], item["mtime"]) for entry in checkpoint for item in entry["files"]}
+
+    pending = []
+    for path in sources:
+        stat = os.stat(path)
+        if (path, stat.st_size, stat.st_mtime) not in done:
+            pending.append(path)
+    skipped = len(sources) - len(pending)
+    if skipped:
+        print(f"Пропущено по контрольной точке: {skipped}", file=sys.stderr)
+
+    stats = {"files": 0, "projects": 0, "errors": 0, "skipped": skipped}
+    buffer: List[dict] = []
+    start = last_report = time.perf_counter()
+
+    def flush():
+        if not buffer:
+            return
+        position = writer.write([row for item in buffer for row in item["rows"]])
+        # Один сброс - одна строка: файлы сброса отмечаются вместе с позицией вывода
+        files = [{"source": item["source"], "size": item["size"], "mtime": item["mtime"],
+                  "rows": len(item["rows"])} for item in buffer]
+        with open(checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"files": files, **position}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        buffer.clear()
+
+    def collect(item: dict):
+        nonlocal last_report
+        buffer.append(item)
+        stats["files"] += 1
+        stats["projects"] += len(item["rows"])
+        stats["errors"] += sum(not row["success"] for row in item["rows"])
+        if len(buffer) >= flush_every:
+            flush()
+        now = time.perf_counter()
+        if now - last_report >= progress_interval or stats["files"] == len(pending):
+            last_report = now
+            rate = stats["files"] / (now - start)
+            eta = (len(pending) - stats["files"]) / rate if rate else 0
+            print(f"[{stats['files']}/{len(pending)}] {stats['files'] / len(pending):.1%}, "
+                  f"{rate:.1f} файлов/с, осталось ~{_format_eta(eta)}, проектов {stats['projects']}, "
+                  f"ошибок {stats['errors']}", file=sys.stderr)
+
+    try:
+        if workers <= 1:
+            for path in pending:
+                collect(process_source(path, sketch))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # Ограничиваем число файлов в работе, чтобы не держать все результаты в памяти
+                queue = iter(pending)
+                running = set()
+                for path in queue:
+                    running.add(pool.submit(process_source, path, sketch))
+                    if len(running) >= workers * 2:
+                        break
+                while running:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        collect(future.result())
+                        path = next(queue, None)
+                        if path is not None:
+                            running.add(pool.submit(process_source, path, sketch))
+    finally:
+        flush()
+
+    stats["elapsed"] = round(time.perf_counter() - start, 2)
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Офлайн-расчет KPI по выгрузкам проектов (JSON, JSONL, gzip)")
+    parser.add_argument("inputs", nargs="+", help="каталоги, файлы или glob-шаблоны выгрузок")
+    parser.add_argument("-o", "--output", default="kpi_results.jsonl",
+                        help="файл .jsonl или каталог .parquet (нужен pyarrow)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="процессов в пуле")
+    parser.add_argument("--flush-every", type=int, default=100, help="файлов между сбросами и контрольными точками")
+    parser.add_argument("--checkpoint", help="файл контрольной точки (по умолчанию <output>.checkpoint)")
+    parser.add_argument("--no-resume", action="store_true", help="начать заново, удалив вывод и контрольную точку")
+    parser.add_argument("--sketch", action="store_true",
+                        help="JSONL-файлы коммитов считать приближенно в фиксированной памяти")
+    args = parser.parse_args(argv)
+
+    sources = find_dumps(args.inputs)
+    if not sources:
+        print("Выгрузки не найдены.", file=sys.stderr)
+        return 1
+
+    checkpoint = args.checkpoint or args.output.rstrip("/") + ".checkpoint"
+    print(f"Файлов: {len(sources)}, процессов: {args.workers}, вывод: {args.output}", file=sys.stderr)
+    stats = run(sources, args.output, args.workers, max(args.flush_every, 1), checkpoint, not args.no_resume,
+                sketch=args.sketch)
+    print(f"Готово: файлов {stats['files']}, проектов {stats['projects']}, ошибок {stats['errors']}, "
+          f"пропущено {stats['skipped']}, {stats['elapsed']}с", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
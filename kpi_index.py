@@ -0,0 +1,272 @@
+import os
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metric_calculator import calculate_developers_from_counts, calculate_kpi_scores
+from preprocess import (
+    COMMIT_TYPES,
+    NO_DAY,
+    TYPE_CODES,
+    CommitTable,
+    build_commit_table,
+    calculate_bus_factor_from_counts,
+    collect_commits
+)
+
+DEFAULT_WINDOWS = (7, 30, 90)
+# Ограничения ответа скользящих окон: число окон (по всем размерам) и значений
+# рядов разработчиков (окна x авторы). Одна дата из 1970 года иначе растягивает
+# историю на десятки тысяч дней
+KPI_MAX_ROLLING_WINDOWS = int(os.getenv("KPI_MAX_ROLLING_WINDOWS", "5000"))
+KPI_MAX_ROLLING_VALUES = int(os.getenv("KPI_MAX_ROLLING_VALUES", "500000"))
+# Максимальная длина истории в днях: командные счетчики индекса плотные по
+# дням, и дата из 1-го года рядом с 2024-м заняла бы сотни МБ
+KPI_MAX_INDEX_DAYS = int(os.getenv("KPI_MAX_INDEX_DAYS", "36600"))
+
+# Порядок типов в счетчиках командных метрик
+TEAM_TYPES = ["refactor", "fix", "feature", "docs", "test"]
+
+
+class WindowLimitError(ValueError):
+    """Запрошено больше скользящих окон или дней истории, чем допускают лимиты"""
+
+
+def _prefix(counts: np.ndarray) -> np.ndarray:
+    """Префиксные суммы по первой оси с нулевой строкой в начале"""
+    result = np.zeros((counts.shape[0] + 1,) + counts.shape[1:], dtype=counts.dtype)
+    np.cumsum(counts, axis=0, out=result[1:])
+    return result
+
+
+class DailyIndex:
+    """
+    Индекс коммитов по дням, авторам и типам с префиксными суммами.
+    Строится один раз по CommitTable; счетчики за любой интервал дней -
+    разность двух префиксов без повторного прохода по коммитам.
+
+    Командные счетчики хранятся плотно по дням. Счетчики авторов - по
+    уникальным парам (автор, день), отсортированным по ключу
+    автор * span + день: память растет с числом активных дней авторов,
+    а не с произведением дней на авторов. Коммиты без даты в окна не
+    попадают (их число - в undated). История длиннее KPI_MAX_INDEX_DAYS
+    отклоняется (WindowLimitError) до выделения плотных массивов.
+    """
+
+    def __init__(self, table: CommitTable):
+        self.authors = table.authors
+        n_types = len(COMMIT_TYPES)
+        known = table.days != NO_DAY
+        self.undated = int((~known).sum())
+
+        days = table.days[known]
+        self.first_day = int(days.min()) if days.size else 0
+        self.span = int(days.max()) - self.first_day + 1 if days.size else 0
+        if self.span > KPI_MAX_INDEX_DAYS:
+            raise WindowLimitError(
+                f"история с {self.to_date(0)} по {self.to_date(self.span - 1)} ({self.span} дн.) длиннее лимита "
+                f"{KPI_MAX_INDEX_DAYS} дн.: проверьте даты коммитов")
+        offsets = days - self.first_day
+        type_codes = table.type_codes[known]
+
+        # Команда: счетчики типов, слияния, сложность и активность по дням
+        per_day = np.bincount(offsets * n_types + type_codes, minlength=self.span * n_types)
+        self.team_cum = _prefix(per_day.reshape(self.span, n_types))
+        self.merge_cum = _prefix(np.bincount(offsets, weights=table.is_merge[known], minlength=self.span))
+        self.complexity_cum = _prefix(np.bincount(offsets, weights=table.complexity[known], minlength=self.span))
+        self.active_cum = _prefix((np.bincount(offsets, minlength=self.span) > 0).astype(np.int64))
+
+        # Авторы: префиксы по отсортированным парам (автор, день)
+        keys = table.author_codes[known] * self.span + offsets
+        self.pair_keys, inverse = np.unique(keys, return_inverse=True)
+        pair_counts = np.bincount(inverse * n_types + type_codes, minlength=len(self.pair_keys) * n_types)
+        self.pair_cum = _prefix(pair_counts.reshape(len(self.pair_keys), n_types))
+        self._author_base = np.arange(len(self.authors), dtype=np.int64) * self.span
+
+    @property
+    def last_day(self) -> int:
+        return self.first_day + self.span - 1
+
+    def to_offset(self, day: date) -> int:
+        """Смещение календарного дня от первого дня индекса"""
+        return int(np.datetime64(day, "D").astype(np.int64)) - self.first_day
+
+    def to_date(self, offset: int) -> str:
+        return str(np.datetime64(self.first_day + int(offset), "D"))
+
+    def team_counts(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Командные счетчики окон [starts, ends] (смещения включительно):
+        типы (k x COMMIT_TYPES), слияния, суммарная сложность, активные дни.
+        """
+        hi, lo = ends + 1, starts
+        return (self.team_cum[hi] - self.team_cum[lo],
+                self.merge_cum[hi] - self.merge_cum[lo],
+                self.complexity_cum[hi] - self.complexity_cum[lo],
+                self.active_cum[hi] - self.active_cum[lo])
+
+    def author_counts(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Счетчики авторов в окнах: типы (k x авторы x COMMIT_TYPES) и
+        активные дни (k x авторы) - число пар (автор, день) внутри окна.
+        """
+        lo = np.searchsorted(self.pair_keys, self._author_base + starts[:, None], side="left")
+        hi = np.searchsorted(self.pair_keys, self._author_base + ends[:, None], side="right")
+        return self.pair_cum[hi] - self.pair_cum[lo], hi - lo
+
+
+def build_daily_index(data: dict, table: Optional[CommitTable] = None) -> DailyIndex:
+    if table is None:
+        table = build_commit_table(collect_commits(data))
+    return DailyIndex(table)
+
+
+def _clip_range(index: DailyIndex, start: Optional[date], end: Optional[date]) -> Tuple[int, int]:
+    """Границы интервала в смещениях индекса (пустой интервал - start > end)"""
+    lo = 0 if start is None else max(index.to_offset(start), 0)
+    hi = index.span - 1 if end is None else min(index.to_offset(end), index.span - 1)
+    return lo, hi
+
+
+def calculate_range_kpi(index: DailyIndex, start: Optional[date] = None,
+                        end: Optional[date] = None) -> dict:
+    """KPI команды и разработчиков за интервал дат (границы включительно)"""
+    lo, hi = _clip_range(index, start, end)
+    result = {
+        "start": str(start) if start else (index.to_date(0) if index.span else None),
+        "end": str(end) if end else (index.to_date(index.span - 1) if index.span else None)
+    }
+    if lo > hi:
+        result.update(team_kpi=None, team_metrics=None, developers={})
+        return result
+
+    starts, ends = np.array([lo]), np.array([hi])
+    type_counts, merges, complexity, active = (values[0] for values in index.team_counts(starts, ends))
+    author_types, author_days = (values[0] for values in index.author_counts(starts, ends))
+    author_totals = author_types.sum(axis=1)
+    present = np.flatnonzero(author_totals)
+    commits_total = int(type_counts.sum())
+
+    if commits_total == 0:
+        result.update(team_kpi=None, team_metrics=None, developers={})
+        return result
+
+    score, ratios = calculate_kpi_scores(type_counts)
+    team_size = len(present)
+    team_metrics = {
+        "commits_total": commits_total,
+        "merge_conflicts": int(merges),
+        "bus_factor": calculate_bus_factor_from_counts(author_totals[present])
+    }
+    team_metrics.update({f"{t}_commits": int(type_counts[TYPE_CODES[t]]) for t in TEAM_TYPES})
+    team_metrics.update({f"{t}_ratio": float(ratios[TYPE_CODES[t]]) for t in TEAM_TYPES})
+    team_metrics.update({
+        "active_days": int(active),
+        "team_size": team_size,
+        "avg_commits_per_dev": commits_total / team_size,
+        "avg_complexity": float(complexity) / commits_total
+    })
+
+    result.update(
+        team_kpi=round(float(score), 2),
+        team_metrics=team_metrics,
+        developers=calculate_developers_from_counts(
+            [index.authors[i] for i in present], author_types[present], author_days[present]
+        )
+    )
+    return result
+
+
+def _rolling_ends(index: DailyIndex, step: int, since: Optional[date]) -> np.ndarray:
+    """Концы окон: последний день истории и далее с шагом step назад, не раньше since"""
+    lo = 0 if since is None else max(index.to_offset(since), 0)
+    return np.arange(index.span - 1, lo - 1, -step)[::-1]
+
+
+def calculate_rolling_kpi(index: DailyIndex, window: int, step: int = 1,
+                          developers: bool = True, since: Optional[date] = None) -> dict:
+    """
+    Скользящие окна по window дней, заканчивающиеся на последнем дне истории
+    и далее с шагом step назад (до since). Для окон без коммитов KPI - None.
+    """
+    ends = _rolling_ends(index, step, since)
+    if ends.size == 0:
+        return {"window": window, "dates": [], "team_kpi": [], "commits": [], "developers": {}}
+
+    starts = np.maximum(ends - window + 1, 0)
+    type_counts, _, _, _ = index.team_counts(starts, ends)
+    commits = type_counts.sum(axis=1)
+    scores, _ = calculate_kpi_scores(type_counts)
+
+    result = {
+        "window": window,
+        "dates": [index.to_date(end) for end in ends],
+        "team_kpi": [round(float(s), 2) if c else None for s, c in zip(scores, commits)],
+        "commits": commits.tolist(),
+        "developers": {}
+    }
+    if developers:
+        author_types, _ = index.author_counts(starts, ends)
+        author_totals = author_types.sum(axis=2)
+        author_scores, _ = calculate_kpi_scores(author_types)
+        for i, author in enumerate(index.authors):
+            result["developers"][author] = [
+                round(float(s), 2) if c else None for s, c in zip(author_scores[:, i], author_totals[:, i])
+            ]
+    return result
+
+
+def check_rolling_limits(index: DailyIndex, windows: Sequence[int], step: int, developers: bool,
+                         since: Optional[date] = None):
+    """WindowLimitError, если ряды скользящих окон превышают лимиты"""
+    count = len(_rolling_ends(index, step, since)) * len(windows)
+    if count > KPI_MAX_ROLLING_WINDOWS:
+        raise WindowLimitError(
+            f"{count} скользящих окон за {index.span} дн. больше лимита {KPI_MAX_ROLLING_WINDOWS}: "
+            f"увеличьте step или ограничьте начало рядов параметром since")
+    values = count * len(index.authors) if developers else 0
+    if values > KPI_MAX_ROLLING_VALUES:
+        raise WindowLimitError(
+            f"рядов разработчиков {count} окон x {len(index.authors)} авторов больше лимита "
+            f"{KPI_MAX_ROLLING_VALUES}: увеличьте step, задайте since или developers=false")
+
+
+def calculate_window_kpis(data: dict, ranges: Sequence[Tuple[Optional[date], Optional[date]]] = (),
+                          windows: Sequence[int] = DEFAULT_WINDOWS, step: int = 7,
+                          developers: bool = True, since: Optional[date] = None) -> dict:
+    """
+    Ответ /predict_kpi/windows: индекс строится один раз, затем по нему
+    считаются KPI за каждый интервал дат и скользящие окна. Размер рядов
+    проверяется до расчета (WindowLimitError).
+    """
+    index = build_daily_index(data)
+    check_rolling_limits(index, windows, step, developers, since)
+    result: Dict[str, object] = {
+        "period": {
+            "start": index.to_date(0) if index.span else None,
+            "end": index.to_date(index.span - 1) if index.span else None,
+            "days": index.span,
+            "undated_commits": index.undated
+        },
+        "ranges": [calculate_range_kpi(index, start, end) for start, end in (ranges or [(None, None)])],
+        "rolling": {str(window): calculate_rolling_kpi(index, window, step, developers, since)
+                    for window in windows}
+    }
+    return result
+
+
+def parse_range(value: str) -> Tuple[Optional[date], Optional[date]]:
+    """Интервал вида 2024-01-01..2024-03-31; любая граница может быть пустой"""
+    start, sep, end = value.partition("..")
+    if not sep:
+        raise ValueError(f"ожидается интервал вида YYYY-MM-DD..YYYY-MM-DD: {value}")
+    return (date.fromisoformat(start) if start else None,
+            date.fromisoformat(end) if end else None)
+
+
+def parse_windows(value: str) -> List[int]:
+    windows = [int(item) for item in value.split(",") if item.strip()]
+    if any(window <= 0 for window in windows):
+        raise ValueError("размер окна должен быть положительным")
+    return windows
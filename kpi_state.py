@@ -0,0 +1,247 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metric_accumulator import MetricAccumulator, accumulated_result
+from preprocess import COMMIT_TYPES, build_commit_records, deduplicate_commits
+from telemetry import record_commits
+
+# Сколько хэшей проверять одним запросом (лимит параметров SQLite - 999)
+HASH_QUERY_CHUNK = 500
+# Сколько ждать блокировку записи, занятую другим процессом, с
+STATE_BUSY_TIMEOUT = 30.0
+
+# Командные счетчики - столбцы repo_counters
+COUNTER_FIELDS = ["commits_total", "merge_conflicts", "refactor_commits", "fix_commits",
+                  "feature_commits", "docs_commits", "test_commits"]
+
+
+def _columns(names: List[str]) -> str:
+    return ", ".join(f'"{name}"' for name in names)
+
+
+def _increments(names: List[str]) -> str:
+    return ", ".join(f'"{name}" = "{name}" + excluded."{name}"' for name in names)
+
+
+class KPIStateStore:
+    """
+    Инкрементальное состояние KPI по репозиториям в SQLite.
+
+    На каждую пару (Project.key, Repository.name) хранятся командные
+    счетчики (строка repo_counters), счетчики типов по авторам (repo_authors),
+    активные дни команды и авторов и множество уже учтенных Commit.hash.
+    Дельта-обновление пропускает известные хэши и прибавляет к счетчикам
+    только вклад новых коммитов: запись стоит O(новых коммитов), а не
+    O(состояния). Число активных дней тоже хранится счетчиком (active_days
+    в repo_counters и repo_authors): таблицы дней нужны только, чтобы понять,
+    новый ли день, поэтому результат читается за O(авторов), а не O(истории).
+    Коммиты без hash дедуплицировать нельзя, они учитываются всегда.
+
+    Чтение и запись дельты идут в одной транзакции BEGIN IMMEDIATE, поэтому
+    параллельные обновления из разных процессов (воркеры serve.py)
+    сериализуются SQLite и не теряют счетчики.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("KPI_STATE_DB", "kpi_state.sqlite3")
+        self._lock = threading.Lock()
+        # Транзакции открываются явно (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(self.path, timeout=STATE_BUSY_TIMEOUT, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        type_columns = ", ".join(f'"{t}" INTEGER NOT NULL DEFAULT 0' for t in COMMIT_TYPES)
+        counter_columns = ", ".join(f'"{c}" INTEGER NOT NULL DEFAULT 0' for c in COUNTER_FIELDS)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS repo_counters (
+                project_key TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                {counter_columns},
+                active_days INTEGER NOT NULL DEFAULT 0,
+                complexity_total REAL NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (project_key, repo_name)
+            );
+            CREATE TABLE IF NOT EXISTS repo_authors (
+                project_key TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                author TEXT NOT NULL,
+                {type_columns},
+                active_days INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (project_key, repo_name, author)
+            );
+            CREATE TABLE IF NOT EXISTS repo_days (
+                project_key TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                PRIMARY KEY (project_key, repo_name, day)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS repo_author_days (
+                project_key TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                author TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                PRIMARY KEY (project_key, repo_name, author, day)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS seen_commits (
+                project_key TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (project_key, repo_name, hash)
+            ) WITHOUT ROWID;
+        """)
+        # Базы, созданные до счетчиков дней: счетчики заполняются по таблицам дней
+        for table, days_table, match in (
+                ("repo_counters", "repo_days", ""),
+                ("repo_authors", "repo_author_days", " AND d.author = t.author")):
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if "active_days" not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN active_days INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute(
+                    f"UPDATE {table} AS t SET active_days = (SELECT COUNT(*) FROM {days_table} AS d "
+                    f"WHERE d.project_key = t.project_key AND d.repo_name = t.repo_name{match})"
+                )
+
+    def _seen_hashes(self, key: Tuple[str, str], hashes: List[str]) -> set:
+        seen = set()
+        for i in range(0, len(hashes), HASH_QUERY_CHUNK):
+            chunk = hashes[i:i + HASH_QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT hash FROM seen_commits WHERE project_key = ? AND repo_name = ? AND hash IN ({placeholders})",
+                (*key, *chunk)
+            )
+            seen.update(row[0] for row in rows)
+        return seen
+
+    def _clear(self, key: Tuple[str, str]):
+        for table in ["repo_counters", "repo_authors", "repo_days", "repo_author_days", "seen_commits"]:
+            self._conn.execute(f"DELETE FROM {table} WHERE project_key = ? AND repo_name = ?", key)
+
+    def _add(self, key: Tuple[str, str], delta: MetricAccumulator):
+        """
+        Прибавляет к сохраненным счетчикам вклад дельты (накопителя только новых
+        коммитов). Новые дни определяются по rowcount INSERT OR IGNORE в таблицы дней.
+        """
+        metrics = delta.metrics
+        new_days = self._conn.executemany(
+            "INSERT OR IGNORE INTO repo_days (project_key, repo_name, day) VALUES (?, ?, ?)",
+            ((*key, day.toordinal()) for day in metrics["active_days"])
+        ).rowcount
+        self._conn.execute(
+            f"INSERT INTO repo_counters (project_key, repo_name, {_columns(COUNTER_FIELDS)}, active_days, "
+            f"complexity_total, updated_at) VALUES (?, ?, {', '.join('?' * len(COUNTER_FIELDS))}, ?, ?, ?) "
+            f"ON CONFLICT (project_key, repo_name) DO UPDATE SET {_increments(COUNTER_FIELDS + ['active_days'])}, "
+            f"complexity_total = complexity_total + excluded.complexity_total, updated_at = excluded.updated_at",
+            (*key, *(metrics[c] for c in COUNTER_FIELDS), new_days, delta.complexity_total, time.time())
+        )
+        for author, types in delta.author_types.items():
+            new_author_days = self._conn.executemany(
+                "INSERT OR IGNORE INTO repo_author_days (project_key, repo_name, author, day) VALUES (?, ?, ?, ?)",
+                ((*key, author, day.toordinal()) for day in delta.author_days[author])
+            ).rowcount
+            self._conn.execute(
+                f"INSERT INTO repo_authors (project_key, repo_name, author, {_columns(COMMIT_TYPES)}, active_days) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(COMMIT_TYPES))}, ?) "
+                f"ON CONFLICT (project_key, repo_name, author) DO UPDATE SET "
+                f"{_increments(COMMIT_TYPES + ['active_days'])}",
+                (*key, author, *types, new_author_days)
+            )
+
+    def _result(self, key: Tuple[str, str]) -> dict:
+        """KPI по сохраненным счетчикам (авторы - в порядке первого появления)"""
+        row = self._conn.execute(
+            f"SELECT {_columns(COUNTER_FIELDS)}, active_days, complexity_total FROM repo_counters "
+            "WHERE project_key = ? AND repo_name = ?", key
+        ).fetchone()
+        if row is None:
+            empty = MetricAccumulator()
+            return accumulated_result(empty.metrics, 0.0, [], np.zeros((0, len(COMMIT_TYPES)), dtype=np.int64),
+                                      np.zeros(0, dtype=np.int64))
+        metrics = dict(zip(COUNTER_FIELDS, row))
+        # Для производных метрик нужно только len(active_days): range не хранит сами дни
+        metrics["active_days"] = range(row[-2])
+
+        rows = self._conn.execute(
+            f"SELECT author, {_columns(COMMIT_TYPES)}, active_days FROM repo_authors "
+            "WHERE project_key = ? AND repo_name = ? ORDER BY rowid", key
+        ).fetchall()
+        authors = [r[0] for r in rows]
+        type_counts = np.array([r[1:-1] for r in rows], dtype=np.int64).reshape(len(rows), len(COMMIT_TYPES))
+        active_days = np.array([r[-1] for r in rows], dtype=np.int64)
+        return accumulated_result(metrics, row[-1], authors, type_counts, active_days)
+
+    def apply(self, project_key: Optional[str], repo_name: Optional[str],
+              commits: List[Dict], rebuild: bool = False) -> Tuple[dict, dict]:
+        """
+        Учитывает новые коммиты репозитория и возвращает (KPI, статистика дельты).
+        При rebuild=True состояние репозитория сбрасывается и строится заново.
+        Без project_key или repo_name - ValueError: состояние не к чему привязать.
+        """
+        if not project_key or not repo_name:
+            raise ValueError("для инкрементального расчета нужны project.key и repository.name")
+        key = (project_key, repo_name)
+        # Классификация - до транзакции, чтобы не держать блокировку записи
+        start = time.perf_counter()
+        unique_commits, _ = deduplicate_commits(commits)
+        records = build_commit_records(unique_commits)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if rebuild:
+                    self._clear(key)
+
+                # Повторы внутри запроса объединяются с ветками, повторы из прошлых запросов пропускаются
+                hashes = [commit.get("hash") for commit in unique_commits if commit.get("hash")]
+                seen = self._seen_hashes(key, hashes)
+                new_records, new_hashes = [], []
+                for commit, record in zip(unique_commits, records):
+                    commit_hash = commit.get("hash")
+                    if commit_hash:
+                        if commit_hash in seen:
+                            continue
+                        seen.add(commit_hash)
+                        new_hashes.append(commit_hash)
+                    new_records.append(record)
+
+                delta = MetricAccumulator()
+                delta.add_records(new_records)
+                self._conn.executemany(
+                    "INSERT INTO seen_commits (project_key, repo_name, hash) VALUES (?, ?, ?)",
+                    ((*key, commit_hash) for commit_hash in new_hashes)
+                )
+                self._add(key, delta)
+                result = self._result(key)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        record_commits(len(new_records), time.perf_counter() - start)
+
+        stats = {
+            "received": len(commits),
+            "new": len(new_records),
+            "duplicates": len(commits) - len(new_records),
+            "rebuild": rebuild
+        }
+        return result, stats
+
+    def close(self):
+        self._conn.close()
+
+
+_store: Optional[KPIStateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_state_store() -> KPIStateStore:
+    """Общее хранилище состояния (создается при первом обращении)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KPIStateStore()
+        return _store
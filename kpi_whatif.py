@@ -0,0 +1,125 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metric_calculator import DEFAULT_KPI_WEIGHTS, KPI_WEIGHT_TYPES, calculate_kpi_score_sets, calculate_kpi_scores
+from preprocess import COMMIT_TYPES
+
+# Максимум схем весов в одном what-if запросе
+MAX_WEIGHT_SETS = 1000
+
+
+def counts_from_result(kpi_data: Dict[str, Any]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Авторы, матрица счетчиков типов (авторы x COMMIT_TYPES) и командные
+    счетчики из готового результата /predict_kpi: доли разработчика
+    умножаются на его total_commits, остаток - other. Пересчета по коммитам нет.
+    """
+    developers = kpi_data.get("developers") or {}
+    authors = list(developers)
+    other = COMMIT_TYPES.index("other")
+
+    type_counts = np.zeros((len(authors), len(COMMIT_TYPES)))
+    for i, name in enumerate(authors):
+        metrics = developers[name].get("metrics") or {}
+        total = metrics.get("total_commits", 0)
+        for commit_type in KPI_WEIGHT_TYPES:
+            type_counts[i, COMMIT_TYPES.index(commit_type)] = round(metrics.get(f"{commit_type}_ratio", 0) * total)
+        type_counts[i, other] = max(total - type_counts[i].sum(), 0)
+
+    team = kpi_data.get("team_metrics") or {}
+    if "commits_total" in team:
+        team_counts = np.zeros(len(COMMIT_TYPES))
+        for commit_type in KPI_WEIGHT_TYPES:
+            team_counts[COMMIT_TYPES.index(commit_type)] = team.get(f"{commit_type}_commits", 0)
+        team_counts[other] = max(team["commits_total"] - team_counts.sum(), 0)
+    else:
+        team_counts = type_counts.sum(axis=0)
+    return authors, type_counts, team_counts
+
+
+def kpi_from_result(kpi_data: Dict[str, Any]) -> np.ndarray:
+    """KPI разработчиков из готового результата /predict_kpi (в порядке counts_from_result)"""
+    developers = kpi_data.get("developers") or {}
+    return np.array([float(info.get("kpi", 0)) for info in developers.values()])
+
+
+def as_count_matrix(rows: List[List[float]], authors: List[str], field: str = "type_counts") -> np.ndarray:
+    """Матрица счетчиков из JSON: строка на автора, столбцы в порядке COMMIT_TYPES"""
+    type_counts = np.asarray(rows, dtype=float) if rows else np.zeros((0, len(COMMIT_TYPES)))
+    if type_counts.ndim != 2 or type_counts.shape[1] != len(COMMIT_TYPES):
+        raise ValueError(f"строки {field} должны содержать {len(COMMIT_TYPES)} счетчиков "
+                         f"({', '.join(COMMIT_TYPES)})")
+    if type_counts.shape[0] != len(authors):
+        raise ValueError(f"строк {field} ({type_counts.shape[0]}) должно быть столько же, сколько authors "
+                         f"({len(authors)})")
+    if not np.isfinite(type_counts).all() or (type_counts < 0).any():
+        raise ValueError("счетчики должны быть неотрицательными числами")
+    return type_counts
+
+
+def rank_weight_sets(authors: List[str], type_counts: np.ndarray, team_counts: Optional[np.ndarray],
+                     schemes: List[Dict[str, Any]], top: Optional[int] = None,
+                     baseline: Optional[np.ndarray] = None,
+                     baseline_team: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Ранжированные таблицы KPI по каждой схеме весов ({"name", "weights"}).
+    Команда и все разработчики оцениваются по всем схемам одним умножением
+    матриц. KPI округляются до сотых и сортируются как целые (сотые доли
+    в пределах 0..10000 помещаются в uint16, для них argsort - поразрядный).
+    Таблица схемы колоночная: developers и kpi в порядке убывания KPI (при
+    равенстве - порядок авторов), rank_change - сдвиг места относительно
+    весов по умолчанию (положительный - подъем). KPI по умолчанию - baseline
+    и baseline_team, как их вернул /predict_kpi; без них они считаются
+    calculate_kpi_scores, как в /predict_kpi. Схема с весами по умолчанию
+    получает ровно эти значения, а не результат матричной формы.
+    """
+    if not schemes:
+        raise ValueError("нужна хотя бы одна схема весов")
+    if len(schemes) > MAX_WEIGHT_SETS:
+        raise ValueError(f"схем весов больше {MAX_WEIGHT_SETS}")
+    if team_counts is None:
+        team_counts = type_counts.sum(axis=0)
+
+    if baseline is None:
+        baseline = np.round(calculate_kpi_scores(type_counts)[0], 2)
+    baseline = np.clip(np.asarray(baseline, dtype=float), 0, 100)
+    if baseline.shape != (len(authors),):
+        raise ValueError(f"KPI по умолчанию нужны для всех {len(authors)} разработчиков")
+    if baseline_team is None:
+        baseline_team = round(float(calculate_kpi_scores(team_counts)[0]), 2)
+    weight_sets = [scheme.get("weights") or {} for scheme in schemes]
+    scores = calculate_kpi_score_sets(np.vstack([type_counts, team_counts]), weight_sets).T
+    for j, weights in enumerate(weight_sets):
+        if all(float(weights.get(t, DEFAULT_KPI_WEIGHTS[t])) == DEFAULT_KPI_WEIGHTS[t] for t in KPI_WEIGHT_TYPES):
+            scores[j, :-1] = baseline
+            scores[j, -1] = baseline_team
+    team_scores = scores[:, -1]
+    # Схемы x разработчики, KPI в сотых долях; последняя строка - веса по умолчанию, для rank_change
+    cents = np.ascontiguousarray(np.rint(np.vstack([scores[:, :-1], baseline]) * 100).astype(np.uint16))
+
+    n = len(authors)
+    order = np.argsort(10000 - cents, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(n)[None, :], axis=1)
+    rank_change = ranks[-1] - ranks[:-1]
+
+    names = np.array(authors, dtype=object)
+    limit = n if top is None else max(min(top, n), 0)
+    order = order[:, :limit]
+    kpis = np.take_along_axis(cents, order, axis=1) / 100
+    changes = np.take_along_axis(rank_change, order[:-1], axis=1)
+    means = cents[:-1].mean(axis=1) / 100 if n else np.zeros(len(schemes))
+
+    tables = []
+    for j, scheme in enumerate(schemes):
+        tables.append({
+            "name": scheme.get("name") or f"scheme_{j + 1}",
+            "weights": {t: float(weight_sets[j].get(t, DEFAULT_KPI_WEIGHTS[t])) for t in KPI_WEIGHT_TYPES},
+            "team_kpi": round(float(team_scores[j]), 2),
+            "mean_kpi": round(float(means[j]), 2),
+            "developers": names[order[j]].tolist(),
+            "kpi": kpis[j].tolist(),
+            "rank_change": changes[j].tolist()
+        })
+    return tables
@@ -0,0 +1,276 @@
+import asyncio
+import copy
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Настройки кэша LLM-анализа
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "64"))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256"))
+# Шаг округления KPI (в процентных пунктах) перед построением промпта; 0 - без округления
+LLM_CACHE_KPI_BUCKET = float(os.getenv("LLM_CACHE_KPI_BUCKET", "0"))
+# Попадания в память отмечаются на диске (accessed_at для вытеснения) пачкой:
+# при накоплении TOUCH_BATCH отметок или раз в TOUCH_INTERVAL секунд
+TOUCH_BATCH = 64
+TOUCH_INTERVAL = 30.0
+# Поколение кэша (счетчик сбросов в SQLite) перечитывается не реже, чем раз в
+# GENERATION_INTERVAL секунд: сброс в одном воркере очищает память остальных
+GENERATION_INTERVAL = 1.0
+# Счетчики, которые попадают в промпт и округляются вместе с KPI
+TEAM_COUNT_KEYS = ("commits_total", "bus_factor", "team_size")
+
+
+def _round_to(value: Any, step: float) -> Any:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return value
+    return round(round(value / step) * step, 6)
+
+
+def _round_count(value: Any, step: float) -> Any:
+    """
+    Счетчик, округленный до step процентов от своего порядка (1000-1999
+    коммитов при шаге 5 - до 50), но не грубее 1: лишний коммит не меняет
+    промпт, а шаг не зависит от самого значения внутри порядка.
+    """
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        return value
+    grain = max(1, round(10 ** math.floor(math.log10(value)) * step / 100))
+    return int(round(value / grain) * grain)
+
+
+def bucket_kpi_data(data: Dict[str, Any], step: float) -> Dict[str, Any]:
+    """
+    Копия данных /predict_kpi с KPI, округленными до шага step (в процентах),
+    долями типов коммитов, округленными до step/100, и счетчиками (коммиты,
+    bus factor, размер команды, коммиты разработчиков), округленными до step
+    процентов от их порядка. Небольшие изменения метрик дают одинаковый
+    промпт и попадают в кэш.
+    """
+    if not step:
+        return data
+
+    data = copy.deepcopy(data)
+    data["team_kpi"] = _round_to(data.get("team_kpi"), step)
+    team = data.get("team_metrics", {})
+    for key, value in team.items():
+        if key.endswith("_ratio"):
+            team[key] = _round_to(value, step / 100)
+        elif key in TEAM_COUNT_KEYS:
+            team[key] = _round_count(value, step)
+    for info in data.get("developers", {}).values():
+        info["kpi"] = _round_to(info.get("kpi"), step)
+        metrics = info.get("metrics")
+        if metrics and "total_commits" in metrics:
+            metrics["total_commits"] = _round_count(metrics["total_commits"], step)
+    return data
+
+
+def cache_key(model_name: str, prompt: str) -> str:
+    """Ключ кэша: модель + итоговый промпт"""
+    return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Двухуровневый кэш LLM-анализа: LRU в памяти и SQLite на диске.
+    Записи старше ttl считаются промахом; при превышении max_bytes на диске
+    удаляются записи с самым давним обращением.
+
+    get/put обращаются к SQLite и блокируют поток; из event loop вызываются
+    aget/aput: попадание в память отдается сразу, работа с диском идет в
+    потоке. Обращения к записям в памяти копятся и пишутся в accessed_at
+    пачкой, чтобы часто читаемые записи не вытеснялись с диска.
+
+    invalidate увеличивает поколение в SQLite; процесс, увидевший новое
+    поколение, очищает свой LRU. aget отдает память без обращения к диску,
+    только пока поколение проверялось не раньше GENERATION_INTERVAL назад.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_DB, ttl: float = LLM_CACHE_TTL,
+                 max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                 memory_items: int = LLM_CACHE_MEMORY_ITEMS):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        # Ключ -> время последнего обращения из памяти, еще не записанное на диск
+        self._touched: Dict[str, float] = {}
+        self._touched_since = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                key TEXT PRIMARY KEY,
+                project TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS analysis_cache_project ON analysis_cache (project);
+            CREATE INDEX IF NOT EXISTS analysis_cache_accessed ON analysis_cache (accessed_at);
+            CREATE TABLE IF NOT EXISTS analysis_cache_meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO analysis_cache_meta (name, value) VALUES ('generation', 0);
+        """)
+        self._conn.commit()
+        self._generation = self._read_generation()
+        self._generation_checked = time.time()
+
+    def _read_generation(self) -> int:
+        return self._conn.execute("SELECT value FROM analysis_cache_meta WHERE name = 'generation'").fetchone()[0]
+
+    def _sync_generation(self, now: float):
+        """Очищает память, если кэш сбросили в другом процессе"""
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._memory.clear()
+            self._generation = generation
+        self._generation_checked = now
+
+    def _remember(self, key: str, value: str, project: Optional[str], created_at: float):
+        self._memory[key] = (value, project, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        value, _, created_at = entry
+        if now - created_at > self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        if not self._touched:
+            self._touched_since = now
+        self._touched[key] = now
+        return value
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?",
+                                   ((at, key) for key, at in self._touched.items()))
+            self._touched = {}
+
+    def flush_touched(self):
+        """Записывает накопленные обращения к записям в памяти"""
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    def _touch_due(self) -> bool:
+        return len(self._touched) >= TOUCH_BATCH or (
+            bool(self._touched) and time.time() - self._touched_since >= TOUCH_INTERVAL)
+
+    def get(self, key: str) -> Optional[str]:
+        """Значение из памяти или с диска; None - промах"""
+        now = time.time()
+        with self._lock:
+            self._sync_generation(now)
+            value = self._get_memory(key, now)
+            if value is not None:
+                return value
+
+            row = self._conn.execute(
+                "SELECT value, project, created_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, project, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._flush_touched()
+            self._conn.commit()
+            self._remember(key, value, project, created_at)
+            return value
+
+    async def aget(self, key: str) -> Optional[str]:
+        """get для event loop: попадание в память - без потока, диск - в потоке"""
+        now = time.time()
+        with self._lock:
+            value = None
+            if now - self._generation_checked < GENERATION_INTERVAL:
+                value = self._get_memory(key, now)
+            flush = self._touch_due()
+        if flush:
+            await asyncio.to_thread(self.flush_touched)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: str, project: Optional[str] = None):
+        """put для event loop: запись и вытеснение - в потоке"""
+        await asyncio.to_thread(self.put, key, value, project)
+
+    def put(self, key: str, value: str, project: Optional[str] = None):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._remember(key, value, project, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, project, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, project, value, size, now, now)
+            )
+            # Перед вытеснением accessed_at должны быть актуальными
+            self._flush_touched()
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM analysis_cache WHERE created_at < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM analysis_cache ORDER BY accessed_at")
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM analysis_cache WHERE key = ?", evicted)
+
+    def invalidate(self, project: Optional[str] = None) -> int:
+        """Удаляет записи проекта (или все записи, если project не задан)"""
+        with self._lock:
+            if project is None:
+                removed = self._conn.execute("DELETE FROM analysis_cache").rowcount
+                self._memory.clear()
+            else:
+                removed = self._conn.execute("DELETE FROM analysis_cache WHERE project = ?", (project,)).rowcount
+                for key in [k for k, (_, p, _) in self._memory.items() if p == project]:
+                    del self._memory[key]
+            self._generation = self._conn.execute(
+                "UPDATE analysis_cache_meta SET value = value + 1 WHERE name = 'generation' RETURNING value"
+            ).fetchone()[0]
+            self._conn.commit()
+            return removed
+
+
+_cache: Optional[AnalysisCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Общий кэш анализа (создается при первом обращении)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnalysisCache()
+        return _cache
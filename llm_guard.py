@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from worker_limits import worker_share
+
+# Настройки допуска запросов к LLM (генерации и очередь - на весь сервис)
+LLM_MAX_IN_FLIGHT = worker_share(int(os.getenv("LLM_MAX_IN_FLIGHT", "2")))
+LLM_MAX_QUEUE = worker_share(int(os.getenv("LLM_MAX_QUEUE", "16")))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+
+class CircuitBreaker:
+    """
+    Размыкатель: после failure_threshold неудач подряд переходит в open и
+    сразу отказывает; через reset_timeout пропускает один пробный запрос
+    (half_open), успех замыкает цепь, неудача снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def cancel_probe(self):
+        """Пробный запрос не состоялся (не получил слот)"""
+        self._probe_in_flight = False
+
+    def record(self, success: bool):
+        self._probe_in_flight = False
+        if success:
+            self.state = "closed"
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class LLMGuard:
+    """
+    Допуск запросов к LLM: не больше max_in_flight генераций одновременно,
+    не больше max_queue ожидающих (каждый ждет не дольше queue_timeout),
+    одинаковые одновременные запросы объединяются в одну генерацию,
+    а при серии отказов размыкатель сразу отправляет в офлайн-анализ.
+    """
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, breaker: Optional[CircuitBreaker] = None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight = 0
+        self._waiting = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def acquire(self) -> Optional[str]:
+        """Занимает слот генерации; None - допущен, иначе причина отказа"""
+        if not self.breaker.allow():
+            return "circuit_open"
+        # Считаем по своим счетчикам: состояние семафора меняется только
+        # после переключения задач и не учитывает уже вставших в очередь
+        if self._in_flight + self._waiting >= self.max_in_flight + self.max_queue:
+            self.breaker.cancel_probe()
+            return "queue_full"
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.breaker.cancel_probe()
+            return "queue_timeout"
+        except BaseException:
+            # Ожидание отменено (клиент отключился): пробный запрос не состоялся,
+            # иначе размыкатель навсегда остается half_open с занятой пробой
+            self.breaker.cancel_probe()
+            raise
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        return None
+
+    def release(self, success: Optional[bool]):
+        """
+        Освобождает слот и сообщает размыкателю результат генерации.
+        success=None - генерацию прервал клиент: размыкатель не меняется,
+        пробный запрос (если это был он) будет выполнен заново.
+        """
+        self._in_flight -= 1
+        self._semaphore.release()
+        if success is None:
+            self.breaker.cancel_probe()
+        else:
+            self.breaker.record(success)
+
+    async def run(self, key: str, generate: Callable[[], Awaitable[Tuple[Any, bool]]],
+                  fallback: Callable[[str], Tuple[Any, bool]]) -> Tuple[Any, bool]:
+        """
+        Выполняет generate() с учетом ограничений. generate и fallback(reason)
+        возвращают (результат, успешна ли генерация LLM). Запросы с тем же
+        key, пришедшие во время генерации, получают ее результат.
+        """
+        pending = self._pending.get(key)
+        if pending is not None:
+            print("🔗 Запрос объединен с уже идущей генерацией.")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Отменен запрос-инициатор, а не текущий: отвечаем офлайн
+                if pending.cancelled():
+                    return fallback("leader_cancelled")
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            reason = await self.acquire()
+            if reason is not None:
+                print(f"⛔ LLM не допущен ({reason}), используем fallback.")
+                result = fallback(reason)
+            else:
+                success = False
+                try:
+                    result = await generate()
+                    success = result[1]
+                except asyncio.CancelledError:
+                    # Отмена вызывающего - не сбой LLM: слот и проба освобождаются нейтрально
+                    success = None
+                    raise
+                finally:
+                    self.release(success)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Помечаем исключение прочитанным, даже если ожидающих не было
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def snapshot(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "coalescing": len(self._pending),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue
+        }
+
+
+_guard: Optional[LLMGuard] = None
+_guard_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def llm_guard_snapshot() -> Optional[dict]:
+    """Состояние ограничителя для /health (None, если LLM еще не вызывался)"""
+    return _guard.snapshot() if _guard is not None else None
+
+
+def get_llm_guard() -> LLMGuard:
+    """Общий ограничитель для текущего event loop"""
+    global _guard, _guard_loop
+    loop = asyncio.get_running_loop()
+    if _guard is None or _guard_loop is not loop:
+        _guard = LLMGuard()
+        _guard_loop = loop
+    return _guard
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from metrics_analyzer import UniversalTeamAnalyzer, get_analyzer, get_async_client
+from telemetry import LLM_WARMUP_SECONDS
+
+# Прогрев моделей при старте API и периодическое продление keep_alive
+LLM_WARMUP = os.getenv("LLM_WARMUP", "1") == "1"
+# Интервал повторного обращения к моделям, с (должен быть меньше LLM_KEEP_ALIVE)
+LLM_KEEP_ALIVE_INTERVAL = float(os.getenv("LLM_KEEP_ALIVE_INTERVAL", "600"))
+# Загрузка модели с диска может быть дольше обычной генерации
+LLM_WARMUP_TIMEOUT = float(os.getenv("LLM_WARMUP_TIMEOUT", "300"))
+# Пауза перед повтором, если Ollama еще не готова (например, скачивает модель)
+WARMUP_RETRY = 10.0
+
+
+class ModelWarmer:
+    """
+    Фоновый прогрев моделей анализатора: запрос без промпта загружает модель
+    в память Ollama, keep_alive задает, сколько ее там держать. Повтор каждые
+    interval секунд не дает Ollama выгрузить модель в простое. Старт API
+    прогрев не задерживает.
+    """
+
+    def __init__(self, analyzer: Optional[UniversalTeamAnalyzer] = None, interval: float = LLM_KEEP_ALIVE_INTERVAL,
+                 enabled: bool = LLM_WARMUP):
+        self.analyzer = analyzer or get_analyzer()
+        self.interval = interval
+        self.enabled = enabled
+        self._task: Optional[asyncio.Task] = None
+        self._models: Dict[str, dict] = {model: {"status": "pending"} for model in self.analyzer.models}
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def warm(self, model: str) -> bool:
+        """Один запрос прогрева; True, если модель загружена"""
+        start = time.perf_counter()
+        try:
+            r = await get_async_client().post(
+                self.analyzer.ollama_url,
+                json={"model": model, "stream": False, "keep_alive": self.analyzer.keep_alive},
+                timeout=httpx.Timeout(LLM_WARMUP_TIMEOUT, connect=5)
+            )
+            status = "ready" if r.status_code == 200 else f"error:{r.status_code}"
+        except httpx.HTTPError as e:
+            status = f"error:{type(e).__name__}"
+        seconds = time.perf_counter() - start
+        LLM_WARMUP_SECONDS.observe(seconds, model=model, status="ok" if status == "ready" else "error")
+        previous = self._models.get(model, {}).get("status")
+        self._models[model] = {"status": status, "seconds": round(seconds, 3), "at": time.time()}
+        # В лог - только смена состояния, а не каждое продление keep_alive
+        if status != previous:
+            if status == "ready":
+                print(f"🔥 Модель {model} загружена за {seconds:.1f}с.")
+            else:
+                print(f"⚠️ Прогрев модели {model} не удался ({status}).")
+        return status == "ready"
+
+    async def _run(self):
+        while True:
+            # Модели прогреваются по очереди: Ollama все равно загружает их последовательно
+            ready = [await self.warm(model) for model in self.analyzer.models]
+            await asyncio.sleep(self.interval if all(ready) else min(self.interval, WARMUP_RETRY))
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "keep_alive": self.analyzer.keep_alive,
+            "interval": self.interval,
+            "models": dict(self._models)
+        }
+
+
+_warmer: Optional[ModelWarmer] = None
+
+
+def get_model_warmer() -> ModelWarmer:
+    """Общий прогрев моделей (создается при первом обращении)"""
+    global _warmer
+    if _warmer is None:
+        _warmer = ModelWarmer()
+    return _warmer
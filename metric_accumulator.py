@@ -0,0 +1,198 @@
+import json
+import time
+import zlib
+from typing import Dict, Iterable, List, Set
+
+import numpy as np
+
+from metric_calculator import calculate_developers_from_counts, calculate_team_kpi
+from preprocess import (
+    COMMIT_TYPES,
+    TYPE_CODES,
+    CommitRecord,
+    build_commit_records,
+    calculate_bus_factor_from_counts,
+    calculate_derived_metrics,
+    create_empty_features,
+    create_features,
+    deduplicate_commits,
+    initialize_metrics,
+    process_all_commits
+)
+from telemetry import record_commits
+
+
+class MetricAccumulator:
+    """
+    Накопитель KPI: коммиты сворачиваются в счетчики по мере поступления,
+    сами коммиты не хранятся. Память зависит от числа авторов и дней и
+    от числа различных hash (для дедупликации, как в /predict_kpi).
+
+    add_many пропускает коммиты с уже учтенным hash: повторы внутри пачки
+    объединяются с ветками (deduplicate_commits), повторы из прошлых пачек
+    отбрасываются - их вклад уже в счетчиках.
+    """
+
+    def __init__(self):
+        self.metrics = initialize_metrics()
+        self.complexity_total = 0.0
+        # По авторам: счетчики типов (в порядке COMMIT_TYPES) и активные дни
+        self.author_types: Dict[str, List[int]] = {}
+        self.author_days: Dict[str, set] = {}
+        self.seen_hashes: Set[str] = set()
+        self.commits_received = 0
+        self.duplicates_removed = 0
+
+    def add_records(self, records: Iterable[CommitRecord]):
+        """Учитывает уже проанализированные коммиты"""
+        records = list(records)
+        process_all_commits(records, self.metrics)
+        for record in records:
+            self.complexity_total += record.complexity
+            types = self.author_types.get(record.author)
+            if types is None:
+                types = self.author_types[record.author] = [0] * len(COMMIT_TYPES)
+                self.author_days[record.author] = set()
+            types[TYPE_CODES.get(record.type, TYPE_CODES["other"])] += 1
+            if record.day:
+                self.author_days[record.author].add(record.day)
+
+    def add_many(self, commits: List[Dict]):
+        """Учитывает пачку коммитов в формате backend API (без повторов по hash)"""
+        if commits:
+            start = time.perf_counter()
+            unique = self.deduplicate(commits)
+            self.add_records(build_commit_records(unique))
+            record_commits(len(unique), time.perf_counter() - start)
+
+    def deduplicate(self, commits: List[Dict]) -> List[Dict]:
+        """Коммиты пачки без повторов внутри пачки и без hash, учтенных раньше"""
+        unique, _ = deduplicate_commits(commits)
+        fresh = []
+        for commit in unique:
+            commit_hash = commit.get("hash")
+            if commit_hash:
+                if commit_hash in self.seen_hashes:
+                    continue
+                self.seen_hashes.add(commit_hash)
+            fresh.append(commit)
+        self.commits_received += len(commits)
+        self.duplicates_removed += len(commits) - len(fresh)
+        return fresh
+
+    def dedup_stats(self) -> Dict[str, int]:
+        return {"commits_received": self.commits_received, "duplicates_removed": self.duplicates_removed}
+
+    def result(self) -> dict:
+        """Результат в формате prepare_metrics_for_analyzer"""
+        authors = list(self.author_types)
+        type_counts = np.array([self.author_types[a] for a in authors], dtype=np.int64).reshape(len(authors), len(COMMIT_TYPES))
+        active_days = np.array([len(self.author_days[a]) for a in authors], dtype=np.int64)
+        result = accumulated_result(self.metrics, self.complexity_total, authors, type_counts, active_days)
+        result["dedup"] = self.dedup_stats()
+        return result
+
+
+def accumulated_result(metrics: dict, complexity_total: float, authors: List[str],
+                       type_counts: np.ndarray, active_days: np.ndarray) -> dict:
+    """
+    Результат в формате prepare_metrics_for_analyzer по накопленным счетчикам:
+    metrics - как у initialize_metrics (из active_days нужно только число дней),
+    type_counts - матрица (авторы x COMMIT_TYPES), active_days - дни по авторам.
+    """
+    team_size = len(authors)
+    commits_total = metrics["commits_total"]
+
+    if commits_total == 0:
+        team_data = create_empty_features()
+    else:
+        team_data = create_features(
+            metrics,
+            calculate_derived_metrics(metrics, team_size),
+            calculate_bus_factor_from_counts(type_counts.sum(axis=1)),
+            team_size,
+            complexity_total / commits_total
+        )
+
+    return {
+        "team_kpi": calculate_team_kpi(team_data),
+        "team_metrics": team_data,
+        "developers": calculate_developers_from_counts(authors, type_counts, active_days)
+    }
+
+
+class NDJSONDecoder:
+    """
+    Инкрементальный разбор NDJSON (один коммит на строку) из чанков тела запроса.
+    Gzip определяется по флагу или по сигнатуре первых байтов; тело из
+    нескольких gzip-членов (конкатенация файлов .gz) разбирается целиком.
+    """
+
+    GZIP_MAGIC = b"\x1f\x8b"
+
+    def __init__(self, gzipped: bool = False):
+        self._gzipped = gzipped
+        self._decompressor = None
+        self._detected = False
+        self._head = b""
+        self._buffer = b""
+        self.line_number = 0
+
+    @staticmethod
+    def _gzip_decompressor():
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+    def _decompress(self, chunk: bytes) -> bytes:
+        if not self._detected:
+            # Для сигнатуры нужны первые два байта, чанк может быть короче
+            chunk = self._head + chunk
+            if not self._gzipped and len(chunk) < len(self.GZIP_MAGIC):
+                self._head = chunk
+                return b""
+            self._head = b""
+            self._detected = True
+            if self._gzipped or chunk.startswith(self.GZIP_MAGIC):
+                self._decompressor = self._gzip_decompressor()
+        if self._decompressor is None:
+            return chunk
+        output = [self._decompressor.decompress(chunk)]
+        # Конец gzip-члена: остаток - следующий член (или мусор, на нем zlib.error)
+        while self._decompressor.eof and self._decompressor.unused_data:
+            rest = self._decompressor.unused_data
+            self._decompressor = self._gzip_decompressor()
+            output.append(self._decompressor.decompress(rest))
+        return b"".join(output)
+
+    def _parse_lines(self, lines: List[bytes]) -> List[dict]:
+        commits = []
+        for line in lines:
+            self.line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                commit = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"строка {self.line_number}: некорректный JSON ({e})")
+            if not isinstance(commit, dict):
+                raise ValueError(f"строка {self.line_number}: ожидался объект коммита")
+            commits.append(commit)
+        return commits
+
+    def feed(self, chunk: bytes) -> List[dict]:
+        """Принимает очередной чанк и возвращает коммиты из завершенных строк"""
+        if not chunk:
+            return []
+        lines = (self._buffer + self._decompress(chunk)).split(b"\n")
+        self._buffer = lines.pop()
+        return self._parse_lines(lines)
+
+    def close(self) -> List[dict]:
+        """Разбирает остаток буфера после последнего чанка"""
+        self._buffer += self._head
+        if self._decompressor is not None:
+            self._buffer += self._decompressor.flush()
+            if not self._decompressor.eof:
+                raise ValueError("тело gzip обрезано")
+        tail, self._buffer = self._buffer, b""
+        return self._parse_lines([tail])
@@ -1,100 +1,184 @@
-from typing import Dict, List
+import time
+
+import numpy as np
+from typing import Dict, List, Tuple
 from preprocess import (
-    extract_features_from_project,
-    extract_individual_metrics,
-    calculate_commit_complexity,
-    improved_classify_commit,
-    parse_date
+    COMMIT_TYPES,
+    NO_DAY,
+    CommitTable,
+    build_commit_table,
+    collect_commits,
+    count_active_days_by_author,
+    count_types_by_author,
+    deduplicate_commits,
+    extract_team_features
 )
+from telemetry import record_commits, stage
 
-# --- функции KPI расчёта ---
-def calculate_individual_kpi(developer_commits: list) -> float:
-    if not developer_commits:
-        return 0.0
-    total = len(developer_commits)
-    feature, fix, refactor, test, docs = 0, 0, 0, 0, 0
-    total_complexity = 0
-    for commit in developer_commits:
-        msg = commit.get("message", "")
-        ctype = improved_classify_commit(msg)
-        total_complexity += calculate_commit_complexity(commit)
-        if ctype == "feature": feature += 1
-        elif ctype == "fix": fix += 1
-        elif ctype == "refactor": refactor += 1
-        elif ctype == "test": test += 1
-        elif ctype == "docs": docs += 1
-    feature_r, fix_r, refactor_r, test_r, docs_r = feature/total, fix/total, refactor/total, test/total, docs/total
-    score = (
-        feature_r * 40 +
-        (1 - fix_r) * 20 +
-        refactor_r * 15 +
-        test_r * 15 +
-        docs_r * 10
-    )
-    return round(min(max(score, 0), 100), 2)
+# Веса KPI по долям типов коммитов; fix входит как доля коммитов без фиксов
+KPI_WEIGHT_TYPES = ["feature", "fix", "refactor", "test", "docs"]
+DEFAULT_KPI_WEIGHTS = {"feature": 40, "fix": 20, "refactor": 15, "test": 15, "docs": 10}
 
+# --- функции KPI расчёта ---
 def calculate_team_kpi(team_data: dict) -> float:
     # простая усреднённая формула
+    w = DEFAULT_KPI_WEIGHTS
     return round(
-        (team_data.get("feature_ratio", 0)*40 +
-         (1 - team_data.get("fix_ratio", 0))*20 +
-         team_data.get("refactor_ratio", 0)*15 +
-         team_data.get("test_ratio", 0)*15 +
-         team_data.get("docs_ratio", 0)*10), 2
+        (team_data.get("feature_ratio", 0)*w["feature"] +
+         (1 - team_data.get("fix_ratio", 0))*w["fix"] +
+         team_data.get("refactor_ratio", 0)*w["refactor"] +
+         team_data.get("test_ratio", 0)*w["test"] +
+         team_data.get("docs_ratio", 0)*w["docs"]), 2
+    )
+
+
+def calculate_kpi_scores(type_counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    KPI (без округления) и доли типов по счетчикам коммитов, последняя ось -
+    COMMIT_TYPES. Подходит для матриц авторов и для рядов окон любой формы.
+    """
+    totals = type_counts.sum(axis=-1)
+    ratios = type_counts / np.maximum(totals, 1)[..., None]
+    feature_r, fix_r, refactor_r, test_r, docs_r = (ratios[..., COMMIT_TYPES.index(t)]
+                                                    for t in ["feature", "fix", "refactor", "test", "docs"])
+    w = DEFAULT_KPI_WEIGHTS
+    scores = np.clip(
+        feature_r * w["feature"] +
+        (1 - fix_r) * w["fix"] +
+        refactor_r * w["refactor"] +
+        test_r * w["test"] +
+        docs_r * w["docs"],
+        0, 100
+    )
+    return scores, ratios
+
+
+def calculate_type_ratios(type_counts: np.ndarray) -> np.ndarray:
+    """Доли типов по счетчикам коммитов (последняя ось - COMMIT_TYPES)"""
+    return type_counts / np.maximum(type_counts.sum(axis=-1), 1)[..., None]
+
+
+# Веса по умолчанию в линейной форме kpi_weight_matrix (строятся один раз)
+DEFAULT_KPI_COEF = np.zeros(len(COMMIT_TYPES))
+for _commit_type, _weight in DEFAULT_KPI_WEIGHTS.items():
+    DEFAULT_KPI_COEF[COMMIT_TYPES.index(_commit_type)] = -_weight if _commit_type == "fix" else _weight
+DEFAULT_KPI_INTERCEPT = float(DEFAULT_KPI_WEIGHTS["fix"])
+
+
+def kpi_weight_matrix(weight_sets: List[Dict[str, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Наборы весов в линейной форме KPI = ratios @ coef.T + intercept:
+    coef - матрица (наборы x COMMIT_TYPES), intercept - вес fix (из 1 - fix_r).
+    Веса, не указанные в наборе, берутся из DEFAULT_KPI_WEIGHTS.
+    """
+    coef = np.tile(DEFAULT_KPI_COEF, (len(weight_sets), 1))
+    intercept = np.full(len(weight_sets), DEFAULT_KPI_INTERCEPT)
+    for i, weights in enumerate(weight_sets):
+        unknown = set(weights) - set(KPI_WEIGHT_TYPES)
+        if unknown:
+            raise ValueError(f"неизвестные типы весов: {', '.join(sorted(unknown))}")
+        for commit_type, weight in weights.items():
+            weight = float(weight)
+            if not np.isfinite(weight):
+                raise ValueError(f"вес {commit_type} должен быть конечным числом")
+            coef[i, COMMIT_TYPES.index(commit_type)] = -weight if commit_type == "fix" else weight
+            if commit_type == "fix":
+                intercept[i] = weight
+    return coef, intercept
+
+
+def calculate_kpi_score_sets(type_counts: np.ndarray, weight_sets: List[Dict[str, float]]) -> np.ndarray:
+    """
+    KPI (без округления) по N наборам весов одним матричным умножением:
+    type_counts (... x COMMIT_TYPES) -> (... x N). Порядок сложения другой,
+    чем в calculate_kpi_scores, поэтому при весах по умолчанию результат может
+    отличаться в последнем знаке; KPI по умолчанию считает calculate_kpi_scores.
+    """
+    coef, intercept = kpi_weight_matrix(weight_sets)
+    return np.clip(calculate_type_ratios(type_counts) @ coef.T + intercept, 0, 100)
+
+
+def calculate_developers_from_counts(authors: List[str], type_counts: np.ndarray,
+                                     active_days: np.ndarray) -> Dict[str, Dict]:
+    """
+    KPI и метрики всех разработчиков разом.
+    type_counts - матрица (авторы x COMMIT_TYPES), active_days - дни по авторам.
+    """
+    totals = type_counts.sum(axis=1)
+    scores, ratios = calculate_kpi_scores(type_counts)
+    feature_r, fix_r, refactor_r, test_r, docs_r = (ratios[:, COMMIT_TYPES.index(t)]
+                                                    for t in ["feature", "fix", "refactor", "test", "docs"])
+
+    developers = {}
+    for i, author in enumerate(authors):
+        developers[author] = {
+            "kpi": round(float(scores[i]), 2),
+            "metrics": {
+                "feature_ratio": float(feature_r[i]),
+                "fix_ratio": float(fix_r[i]),
+                "refactor_ratio": float(refactor_r[i]),
+                "test_ratio": float(test_r[i]),
+                "docs_ratio": float(docs_r[i]),
+                "total_commits": int(totals[i]),
+                "active_days": int(active_days[i])
+            }
+        }
+    return developers
+
+
+def calculate_developers(table: CommitTable) -> Dict[str, Dict]:
+    """KPI и метрики разработчиков по колоночному представлению коммитов"""
+    return calculate_developers_from_counts(
+        table.authors, count_types_by_author(table), count_active_days_by_author(table)
     )
 
+
+def _single_developer(commits: List[Dict]) -> Dict:
+    """KPI и метрики по коммитам одного разработчика (все коммиты - одному автору)"""
+    table = build_commit_table(commits)
+    type_counts = np.bincount(table.type_codes, minlength=len(COMMIT_TYPES)).reshape(1, -1)
+    active_days = np.unique(table.days[table.days != NO_DAY]).size
+    return calculate_developers_from_counts(["developer"], type_counts, np.array([active_days]))["developer"]
+
+
+def calculate_individual_kpi(developer_commits: list) -> float:
+    """KPI разработчика по его коммитам; расчет тот же, что в calculate_developers"""
+    if not developer_commits:
+        return 0.0
+    return _single_developer(developer_commits)["kpi"]
+
+
 def calculate_developer_metrics(commits: List[Dict]) -> Dict:
-    total = len(commits)
-    if total == 0:
+    """Доли типов, число коммитов и активных дней разработчика по его коммитам"""
+    if not commits:
         return {
             "feature_ratio": 0, "fix_ratio": 0, "refactor_ratio": 0,
             "test_ratio": 0, "docs_ratio": 0,
             "total_commits": 0, "active_days": 0
         }
-
-    types = {"feature": 0, "fix": 0, "refactor": 0, "test": 0, "docs": 0, "other": 0}
-    active_days = set()
-
-    for commit in commits:
-        msg = commit.get("message", "")
-        ctype = improved_classify_commit(msg)
-        if ctype not in types:
-            ctype = "other"
-        types[ctype] += 1
-
-        dt = parse_date(commit.get("createdAt"))
-        if dt:
-            active_days.add(dt.date())
-
-    total_typed = sum(types.values()) or 1
-    return {
-        "feature_ratio": types["feature"] / total_typed,
-        "fix_ratio": types["fix"] / total_typed,
-        "refactor_ratio": types["refactor"] / total_typed,
-        "test_ratio": types["test"] / total_typed,
-        "docs_ratio": types["docs"] / total_typed,
-        "total_commits": total,
-        "active_days": len(active_days)
-    }
+    return _single_developer(commits)["metrics"]
 
 
 # --- основная функция для API ---
 def prepare_metrics_for_analyzer(data_dict: dict) -> dict:
     """Возвращает JSON для /analyze_kpi"""
-    team_features = extract_features_from_project(data_dict)
-    team_data = team_features.iloc[0].to_dict()
-    team_kpi = calculate_team_kpi(team_data)
+    start = time.perf_counter()
+    with stage("extract"):
+        commits, dedup_stats = deduplicate_commits(collect_commits(data_dict, dedup=False))
+    # Классификация, сложность и даты считаются один раз на коммит
+    table = build_commit_table(commits)
 
-    individual_metrics = extract_individual_metrics(data_dict)
-    developers = {}
-    for author, commits in individual_metrics.items():
-        metrics = calculate_developer_metrics(commits)
-        kpi = calculate_individual_kpi(commits)
-        developers[author] = {"kpi": kpi, "metrics": metrics}
+    with stage("aggregate"):
+        team_data = extract_team_features(data_dict, table)
+        team_kpi = calculate_team_kpi(team_data)
+
+        developers = calculate_developers(table)
+    record_commits(table.size, time.perf_counter() - start)
 
     result = {
         "team_kpi": team_kpi,
         "team_metrics": team_data,
-        "developers": developers
+        "developers": developers,
+        "dedup": dedup_stats
     }
     return result
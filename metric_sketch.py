@@ -0,0 +1,313 @@
+import hashlib
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metric_calculator import calculate_developers_from_counts, calculate_team_kpi
+from preprocess import (
+    COMMIT_TYPES,
+    NO_DAY,
+    TYPE_CODES,
+    build_commit_table,
+    create_empty_features,
+    create_features,
+    deduplicate_commits
+)
+from telemetry import record_commits
+
+# Настройки приближенного режима
+# Сколько самых активных разработчиков отслеживается поименно (Misra-Gries)
+KPI_SKETCH_TOP_K = int(os.getenv("KPI_SKETCH_TOP_K", "1000"))
+# Точность HyperLogLog для числа авторов и дней: 2^p регистров, ошибка ~1.04/sqrt(2^p)
+KPI_SKETCH_PRECISION = int(os.getenv("KPI_SKETCH_PRECISION", "14"))
+# Точность HyperLogLog активных дней отдельного разработчика (256 байт на разработчика)
+AUTHOR_DAYS_PRECISION = 8
+# Шаг гистограммы сложности коммита (сложность в пределах 0..3.0)
+COMPLEXITY_STEP = 0.01
+COMPLEXITY_MAX = 3.0
+COMPLEXITY_QUANTILES = (50, 90, 99)
+# Ширина доверительного интервала HyperLogLog в стандартных ошибках (~95%)
+HLL_SIGMAS = 2
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """Перемешивание 64-битных целых (splitmix64) - хэш для HyperLogLog"""
+    with np.errstate(over="ignore"):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def hash_strings(values: List[str]) -> np.ndarray:
+    """Стабильные между запусками 64-битные хэши строк"""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little") for value in values),
+        dtype=np.uint64, count=len(values)
+    )
+
+
+def hll_positions(hashes: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Номер регистра (старшие precision бит) и ранг - позиция первой единицы в остальных битах"""
+    width = min(64 - precision, 52)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+    # Не больше 52 бит: такие целые переводятся во float без округления
+    rest = (hashes >> np.uint64(64 - precision - width)) & np.uint64((1 << width) - 1)
+    _, bit_length = np.frexp(rest.astype(np.float64))
+    return index, (width - bit_length + 1).astype(np.uint8)
+
+
+def hll_estimate(registers: np.ndarray) -> float:
+    """Оценка HyperLogLog с линейным подсчетом для малых значений"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -registers.astype(np.int64))))
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)
+    return raw
+
+
+class HyperLogLog:
+    """Число различных значений в фиксированной памяти (2^precision байт)"""
+
+    def __init__(self, precision: int = KPI_SKETCH_PRECISION):
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+        self.precision = precision
+
+    def add_hashes(self, hashes: np.ndarray):
+        if hashes.size:
+            index, rank = hll_positions(hashes, self.precision)
+            np.maximum.at(self.registers, index, rank)
+
+    def count(self) -> float:
+        return hll_estimate(self.registers)
+
+    @property
+    def relative_error(self) -> float:
+        """Стандартная относительная ошибка оценки"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def bounds(self) -> dict:
+        estimate = self.count()
+        spread = HLL_SIGMAS * self.relative_error
+        return {
+            "estimate": round(estimate),
+            "low": math.floor(estimate * (1 - spread)),
+            "high": math.ceil(estimate * (1 + spread)),
+            "relative_error": round(self.relative_error, 5)
+        }
+
+
+class _TrackedAuthor:
+    """Разработчик в таблице Misra-Gries"""
+    __slots__ = ("count", "types", "missed", "day_registers")
+
+    def __init__(self, missed: int):
+        # Счетчик Misra-Gries (уменьшается при вытеснении)
+        self.count = 0
+        # Коммиты по типам, учтенные с момента попадания в таблицу
+        self.types = np.zeros(len(COMMIT_TYPES), dtype=np.int64)
+        # Верхняя граница коммитов до попадания в таблицу
+        self.missed = missed
+        self.day_registers = np.zeros(1 << AUTHOR_DAYS_PRECISION, dtype=np.uint8)
+
+
+def _bus_factor(counts: np.ndarray, half: float) -> Optional[int]:
+    """Число первых (по убыванию) разработчиков, покрывающих half коммитов; None - не хватает"""
+    cumulative = np.cumsum(np.sort(counts)[::-1])
+    if cumulative.size == 0 or cumulative[-1] < half:
+        return None
+    return int(np.searchsorted(cumulative, half, side="left")) + 1
+
+
+class SketchAccumulator:
+    """
+    Приближенный накопитель KPI в фиксированной памяти для очень больших историй.
+    Точно (счетчиками): число коммитов, типы, слияния, средняя сложность -
+    поэтому team_kpi и доли типов точные. Приближенно: число авторов и
+    активных дней (HyperLogLog), bus factor и разработчики (Misra-Gries,
+    top_k самых активных), квантили сложности (гистограмма с шагом
+    COMPLEXITY_STEP). Память не зависит ни от числа коммитов, ни от числа
+    авторов; границы ошибок возвращаются в поле sketch результата.
+    Повторы по hash отбрасываются только внутри пачки add_many (множество
+    всех hash нарушило бы фиксированную память): sketch.dedup_scope - batch.
+    """
+
+    def __init__(self, top_k: int = KPI_SKETCH_TOP_K, precision: int = KPI_SKETCH_PRECISION):
+        self.top_k = top_k
+        self.commits_total = 0
+        self.merge_conflicts = 0
+        self.type_counts = np.zeros(len(COMMIT_TYPES), dtype=np.int64)
+        self.complexity_total = 0.0
+        self.complexity_hist = np.zeros(round(COMPLEXITY_MAX / COMPLEXITY_STEP) + 1, dtype=np.int64)
+        self.authors = HyperLogLog(precision)
+        self.days = HyperLogLog(precision)
+        self.tracked: Dict[str, _TrackedAuthor] = {}
+        # Сумма вычтенного при вытеснениях: недосчет любого разработчика не больше нее
+        self.decremented = 0
+        self.commits_received = 0
+        self.duplicates_removed = 0
+
+    def add_many(self, commits: List[Dict]):
+        """Учитывает пачку коммитов в формате backend API"""
+        if not commits:
+            return
+        start = time.perf_counter()
+        received = len(commits)
+        commits, _ = deduplicate_commits(commits)
+        self.commits_received += received
+        self.duplicates_removed += received - len(commits)
+        table = build_commit_table(commits)
+        n_types = len(COMMIT_TYPES)
+        n_authors = len(table.authors)
+
+        self.commits_total += table.size
+        self.merge_conflicts += int(table.is_merge.sum())
+        self.type_counts += np.bincount(table.type_codes, minlength=n_types)
+        self.complexity_total += float(table.complexity.sum())
+        bins = np.clip(np.rint(table.complexity / COMPLEXITY_STEP).astype(np.int64), 0, len(self.complexity_hist) - 1)
+        self.complexity_hist += np.bincount(bins, minlength=len(self.complexity_hist))
+
+        known = table.days != NO_DAY
+        day_hashes = _splitmix64(table.days[known])
+        self.days.add_hashes(np.unique(day_hashes))
+        self.authors.add_hashes(hash_strings(table.authors))
+
+        # Счетчики авторов пачки и их дни, сгруппированные по автору
+        author_types = np.bincount(table.author_codes * n_types + table.type_codes,
+                                   minlength=n_authors * n_types).reshape(n_authors, n_types)
+        day_authors = table.author_codes[known]
+        order = np.argsort(day_authors, kind="stable")
+        bounds = np.searchsorted(day_authors[order], np.arange(n_authors + 1))
+        day_index, day_rank = hll_positions(day_hashes[order], AUTHOR_DAYS_PRECISION)
+
+        for code, author in enumerate(table.authors):
+            tracked = self.tracked.get(author)
+            if tracked is None:
+                tracked = self.tracked[author] = _TrackedAuthor(self.decremented)
+            tracked.types += author_types[code]
+            tracked.count += int(author_types[code].sum())
+            lo, hi = bounds[code], bounds[code + 1]
+            if hi > lo:
+                np.maximum.at(tracked.day_registers, day_index[lo:hi], day_rank[lo:hi])
+
+        if len(self.tracked) > self.top_k:
+            self._compact()
+        record_commits(table.size, time.perf_counter() - start)
+
+    def _compact(self):
+        """Шаг Misra-Gries: вычитает (top_k + 1)-й по величине счетчик, остаются не больше top_k"""
+        counts = np.fromiter((tracked.count for tracked in self.tracked.values()), dtype=np.int64,
+                             count=len(self.tracked))
+        threshold = int(np.partition(counts, len(counts) - self.top_k - 1)[len(counts) - self.top_k - 1])
+        self.decremented += threshold
+        for author in list(self.tracked):
+            tracked = self.tracked[author]
+            tracked.count -= threshold
+            if tracked.count <= 0:
+                del self.tracked[author]
+
+    def _bus_factor_bounds(self, observed: np.ndarray, missed: np.ndarray) -> dict:
+        """
+        Bus factor и его границы. Коммиты отслеживаемого разработчика лежат в
+        [observed, observed + missed], неотслеживаемого - не больше decremented.
+        """
+        half = self.commits_total * 0.5
+        high = _bus_factor(observed, half)
+        upper = observed + missed
+        low = _bus_factor(upper, half)
+        if self.decremented:
+            # Неотслеживаемых разработчиков может быть сколько угодно, у каждого
+            # не больше decremented коммитов: берем их вместо меньших верхних границ
+            big = np.sort(upper[upper >= self.decremented])[::-1]
+            cumulative = np.cumsum(big)
+            if cumulative.size and cumulative[-1] >= half:
+                low = int(np.searchsorted(cumulative, half, side="left")) + 1
+            else:
+                covered = float(cumulative[-1]) if cumulative.size else 0.0
+                low = len(big) + math.ceil((half - covered) / self.decremented)
+        estimate = _bus_factor(observed + missed / 2, half)
+        return {"estimate": estimate if estimate is not None else low, "low": low, "high": high}
+
+    def complexity_quantiles(self) -> Dict[str, float]:
+        cumulative = np.cumsum(self.complexity_hist)
+        return {
+            f"p{q}": round(float(np.searchsorted(cumulative, cumulative[-1] * q / 100, side="left")) * COMPLEXITY_STEP, 4)
+            for q in COMPLEXITY_QUANTILES
+        }
+
+    def memory_bytes(self) -> int:
+        per_author = (1 << AUTHOR_DAYS_PRECISION) + len(COMMIT_TYPES) * 8
+        return (self.authors.registers.nbytes + self.days.registers.nbytes + self.complexity_hist.nbytes
+                + len(self.tracked) * per_author)
+
+    def result(self) -> dict:
+        """Результат в формате prepare_metrics_for_analyzer и поле sketch с границами ошибок"""
+        commits_total = self.commits_total
+        sketch = {
+            "approximate": True,
+            "top_k": self.top_k,
+            "tracked_developers": len(self.tracked),
+            "memory_bytes": self.memory_bytes(),
+            "dedup_scope": "batch"
+        }
+        dedup = {"commits_received": self.commits_received, "duplicates_removed": self.duplicates_removed}
+        if commits_total == 0:
+            team_data = create_empty_features()
+            return {
+                "team_kpi": calculate_team_kpi(team_data),
+                "team_metrics": team_data,
+                "developers": {},
+                "dedup": dedup,
+                "sketch": sketch
+            }
+
+        authors = sorted(self.tracked, key=lambda author: -int(self.tracked[author].types.sum()))
+        types = np.array([self.tracked[a].types for a in authors], dtype=np.int64).reshape(len(authors), len(COMMIT_TYPES))
+        observed = types.sum(axis=1)
+        missed = np.array([self.tracked[a].missed for a in authors], dtype=np.int64)
+
+        team_size_bounds = self.authors.bounds()
+        days_bounds = self.days.bounds()
+        # Отслеживаемые разработчики заведомо различны
+        team_size = max(team_size_bounds["estimate"], len(authors), 1)
+        active_days = max(days_bounds["estimate"], 1)
+        bus_factor = self._bus_factor_bounds(observed, missed)
+
+        metrics = {
+            "commits_total": commits_total,
+            "merge_conflicts": self.merge_conflicts,
+            **{f"{t}_commits": int(self.type_counts[TYPE_CODES[t]]) for t in ["refactor", "fix", "feature", "docs", "test"]}
+        }
+        derived = {f"{t}_ratio": self.type_counts[TYPE_CODES[t]] / commits_total
+                   for t in ["refactor", "fix", "feature", "docs", "test"]}
+        derived.update(active_days_count=active_days, avg_commits_per_dev=commits_total / team_size)
+        team_data = create_features(metrics, derived, bus_factor["estimate"], team_size,
+                                    self.complexity_total / commits_total)
+
+        # Активные дни разработчика не больше его коммитов и дней команды
+        author_days = np.array([min(round(hll_estimate(self.tracked[a].day_registers)), int(observed[i]), active_days)
+                                for i, a in enumerate(authors)], dtype=np.int64)
+        developers = calculate_developers_from_counts(authors, types, author_days)
+        for i, author in enumerate(authors):
+            developers[author]["bounds"] = {"total_commits": [int(observed[i]), int(observed[i] + missed[i])]}
+
+        sketch["error_bounds"] = {
+            "team_size": team_size_bounds,
+            "active_days": days_bounds,
+            "bus_factor": bus_factor,
+            "developer_commits_max_undercount": self.decremented,
+            "developer_active_days_relative_error": round(1.04 / math.sqrt(1 << AUTHOR_DAYS_PRECISION), 5),
+            "complexity_quantiles": {**self.complexity_quantiles(), "absolute_error": COMPLEXITY_STEP / 2}
+        }
+        return {
+            "team_kpi": calculate_team_kpi(team_data),
+            "team_metrics": team_data,
+            "developers": developers,
+            "dedup": dedup,
+            "sketch": sketch
+        }
@@ -1,27 +1,241 @@
-import requests
+import httpx
+import json
+import math
+import os
 import time
-from typing import Dict, Any
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from llm_cache import LLM_CACHE_KPI_BUCKET, bucket_kpi_data, cache_key, get_analysis_cache
+from llm_guard import get_llm_guard
+from telemetry import LLM_FALLBACKS, LLM_PROMPT_TOKENS, LLM_REQUESTS, LLM_ROUTE_SECONDS, observe_stage, stage
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "90"))
+# Бюджет промпта в токенах и число лучших/худших разработчиков, перечисляемых поименно
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "1200"))
+LLM_PROMPT_TOP_N = int(os.getenv("LLM_PROMPT_TOP_N", "10"))
+# Основная модель и быстрая модель для небольших команд и коротких промптов
+# (пустое LLM_SMALL_MODEL - все запросы идут в основную)
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5-coder:7b-instruct-q4_K_M")
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "")
+LLM_SMALL_MAX_DEVELOPERS = int(os.getenv("LLM_SMALL_MAX_DEVELOPERS", "5"))
+LLM_SMALL_MAX_TOKENS = int(os.getenv("LLM_SMALL_MAX_TOKENS", "250"))
+# Сколько Ollama держит модель в памяти после запроса (формат keep_alive Ollama)
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+
+# Границы корзин KPI для сводки по разработчикам
+KPI_BUCKETS = [0, 20, 40, 60, 80, 100]
+
+# Общие пулы соединений к Ollama: синхронный и асинхронный
+_session = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_session():
+    """
+    Общая синхронная сессия requests. requests нужен только синхронному
+    анализу, поэтому импортируется при первом обращении, а не при старте API.
+    """
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Общий асинхронный клиент (создается при первом обращении)"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=5),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=8)
+        )
+    return _async_client
+
+
+async def close_async_client():
+    """Закрывает общий асинхронный клиент (вызывается при остановке API)"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора модели: около 4 символов латиницы
+    и 2 символов кириллицы на токен (с запасом для BPE-словарей вроде Qwen).
+    """
+    # Лишние байты UTF-8 примерно равны числу не-ASCII символов
+    non_ascii = len(text.encode("utf-8")) - len(text)
+    return math.ceil((len(text) - non_ascii) / 4 + non_ascii / 2)
+
+
+def _developer_line(name: str, dev: Dict[str, Any]) -> str:
+    return f"- {name}: {dev['kpi']}%"
+
+
+def _commits(dev: Dict[str, Any]) -> int:
+    return dev.get("metrics", {}).get("total_commits", 0)
+
+
+def _summarize_developers(ranked: List[Tuple[str, Dict[str, Any]]], listed_n: int) -> str:
+    """Раздел разработчиков: лучшие и худшие listed_n по KPI и статистика по остальным"""
+    top, rest, bottom = ranked[:listed_n], ranked[listed_n:len(ranked) - listed_n], ranked[len(ranked) - listed_n:]
+    lines = []
+    if listed_n:
+        lines.append(f"Лучшие {listed_n} по KPI:")
+        lines.extend(f"{_developer_line(n, d)} ({_commits(d)} коммитов)" for n, d in top)
+        lines.append(f"Худшие {listed_n} по KPI:")
+        lines.extend(f"{_developer_line(n, d)} ({_commits(d)} коммитов)" for n, d in bottom)
+    if rest:
+        kpis = np.array([d["kpi"] for _, d in rest], dtype=float)
+        total_commits = sum(_commits(d) for _, d in ranked)
+        share = sum(_commits(d) for _, d in rest) / total_commits * 100 if total_commits else 0
+        p10, p25, p50, p75, p90 = np.percentile(kpis, [10, 25, 50, 75, 90])
+        counts, _ = np.histogram(kpis, bins=KPI_BUCKETS)
+        buckets = ", ".join(f"{lo}-{hi}%: {count}" for lo, hi, count in zip(KPI_BUCKETS, KPI_BUCKETS[1:], counts))
+        lines.append(f"Остальные {len(rest)} разработчиков ({share:.1f}% коммитов):")
+        lines.append(f"KPI: p10 {p10:.1f}%, p25 {p25:.1f}%, медиана {p50:.1f}%, p75 {p75:.1f}%, p90 {p90:.1f}%")
+        lines.append(f"Распределение KPI: {buckets}")
+    return "\n".join(lines)
+
 
 class UniversalTeamAnalyzer:
-    def __init__(self, model_name: str = "qwen2.5-coder:7b-instruct-q4_K_M"):
+    def __init__(self, model_name: str = LLM_MODEL, ollama_host: Optional[str] = None,
+                 token_budget: Optional[int] = None, top_n: Optional[int] = None,
+                 small_model_name: Optional[str] = None, keep_alive: str = LLM_KEEP_ALIVE):
         self.model_name = model_name
-        self.ollama_url = "http://localhost:11434/api/generate"
+        self.small_model_name = LLM_SMALL_MODEL if small_model_name is None else small_model_name
+        self.keep_alive = keep_alive
+        self.ollama_url = f"{(ollama_host or OLLAMA_HOST).rstrip('/')}/api/generate"
+        self.token_budget = LLM_PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+        self.top_n = LLM_PROMPT_TOP_N if top_n is None else top_n
+
+    @property
+    def models(self) -> List[str]:
+        """Модели, которые нужно держать загруженными (основная первой)"""
+        return [self.model_name] + ([self.small_model_name] if self.small_model_name not in ("", self.model_name) else [])
+
+    def route(self, stats: Dict[str, Any]) -> str:
+        """
+        Маршрут по статистике промпта: small - команды до LLM_SMALL_MAX_DEVELOPERS
+        человек или короткие промпты со всеми разработчиками поименно, large -
+        остальное (в том числе сокращенные промпты больших команд).
+        """
+        if self.small_model_name in ("", self.model_name):
+            return "large"
+        if stats["developers_total"] <= LLM_SMALL_MAX_DEVELOPERS:
+            return "small"
+        if not stats["summarized"] and stats["estimated_tokens"] <= LLM_SMALL_MAX_TOKENS:
+            return "small"
+        return "large"
+
+    def model_for(self, route: str) -> str:
+        return self.small_model_name if route == "small" else self.model_name
+
+    def _payload(self, prompt: str, route: str, stream: bool) -> Dict[str, Any]:
+        return {"model": self.model_for(route), "prompt": prompt, "stream": stream, "keep_alive": self.keep_alive}
 
-    def _send_llm_request(self, prompt: str) -> str:
+    def _observe_route(self, route: str, seconds: float):
+        LLM_ROUTE_SECONDS.observe(seconds, route=route, model=self.model_for(route))
+
+    def _send_llm_request(self, prompt: str, route: str = "large") -> str:
+        import requests
         try:
-            r = requests.post(
-                self.ollama_url,
-                json={"model": self.model_name, "prompt": prompt, "stream": False},
-                timeout=90
-            )
+            start = time.perf_counter()
+            with stage("llm"):
+                r = get_session().post(self.ollama_url, json=self._payload(prompt, route, False), timeout=LLM_TIMEOUT)
+            self._observe_route(route, time.perf_counter() - start)
+            LLM_REQUESTS.inc(status=str(r.status_code))
             if r.status_code == 200:
                 return r.json().get("response", "")
             return f"Ошибка API: {r.status_code}"
         except requests.exceptions.RequestException:
+            LLM_REQUESTS.inc(status="connection_error")
             return "Ошибка: невозможно подключиться к LLM сервису"
 
+    async def _send_llm_request_async(self, prompt: str, route: str = "large") -> str:
+        try:
+            start = time.perf_counter()
+            with stage("llm"):
+                r = await get_async_client().post(self.ollama_url, json=self._payload(prompt, route, False))
+            self._observe_route(route, time.perf_counter() - start)
+            LLM_REQUESTS.inc(status=str(r.status_code))
+            if r.status_code == 200:
+                return r.json().get("response", "")
+            return f"Ошибка API: {r.status_code}"
+        except httpx.HTTPError:
+            LLM_REQUESTS.inc(status="connection_error")
+            return "Ошибка: невозможно подключиться к LLM сервису"
+
+    async def stream_llm_tokens(self, prompt: str, route: str = "large") -> AsyncIterator[str]:
+        """
+        Потоковая генерация (stream: true): отдает токены по мере готовности.
+        Ошибки соединения и статуса пробрасываются как httpx.HTTPError.
+        """
+        async with get_async_client().stream("POST", self.ollama_url, json=self._payload(prompt, route, True)) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+
     def analyze_team_data(self, data: Dict[str, Any]) -> str:
         """LLM-анализ уже рассчитанных метрик"""
+        with stage("prompt"):
+            prompt, stats = self.build_prompt_info(data)
+        return self._send_llm_request(prompt, self.route(stats))
+
+    async def analyze_team_data_async(self, data: Dict[str, Any]) -> str:
+        """Асинхронный LLM-анализ уже рассчитанных метрик"""
+        with stage("prompt"):
+            prompt, stats = self.build_prompt_info(data)
+        return await self._send_llm_request_async(prompt, self.route(stats))
+
+    def build_prompt(self, data: Dict[str, Any]) -> str:
+        """Промпт для LLM по рассчитанным метрикам"""
+        return self.build_prompt_info(data)[0]
+
+    def build_prompt_info(self, data: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Промпт в пределах бюджета токенов и статистика по нему. Если список
+        всех разработчиков не помещается, в промпт попадают top/bottom-N по
+        KPI, а остальные описываются квантилями и распределением по корзинам;
+        N уменьшается, пока промпт не уложится в бюджет.
+        """
+        devs = data["developers"]
+        prompt = self._render_prompt(data, "\n".join(_developer_line(n, d) for n, d in devs.items()))
+        tokens = estimate_tokens(prompt)
+        listed = len(devs)
+
+        if tokens > self.token_budget and devs:
+            # При равном KPI выше тот, у кого больше коммитов
+            ranked = sorted(devs.items(), key=lambda item: (item[1]["kpi"], _commits(item[1])), reverse=True)
+            for listed_n in range(min(self.top_n, len(ranked) // 2), -1, -1):
+                prompt = self._render_prompt(data, _summarize_developers(ranked, listed_n))
+                tokens = estimate_tokens(prompt)
+                listed = 2 * listed_n
+                if tokens <= self.token_budget:
+                    break
+
+        stats = {
+            "estimated_tokens": tokens,
+            "token_budget": self.token_budget,
+            "developers_total": len(devs),
+            "developers_listed": listed,
+            "summarized": listed < len(devs)
+        }
+        return prompt, stats
+
+    def _render_prompt(self, data: Dict[str, Any], developers_section: str) -> str:
         t = data["team_metrics"]
         kpi = data["team_kpi"]
         devs = data["developers"]
@@ -41,7 +255,7 @@ Commits total: {t.get('commits_total', '?')}
 Документация: {t.get('docs_ratio', 0)*100:.1f}%
 
 Разработчики:
-{chr(10).join([f"- {n}: {d['kpi']}%" for n, d in devs.items()])}
+{developers_section}
 
 Сформулируй:
 1. Проблемы команды
@@ -49,7 +263,7 @@ Commits total: {t.get('commits_total', '?')}
 3. Приоритетные действия на 2 недели
 4. KPI цели на 2 недели вперед.
 """
-        return self._send_llm_request(prompt)
+        return prompt
 
     def smart_emergency_analysis(self, data: Dict[str, Any]) -> str:
         """Анализ без LLM"""
@@ -78,18 +292,167 @@ Commits total: {t.get('commits_total', '?')}
         return analysis
 
 
+_analyzer: Optional[UniversalTeamAnalyzer] = None
+
+
+def get_analyzer() -> UniversalTeamAnalyzer:
+    """Общий анализатор вместо создания нового на каждый запрос"""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = UniversalTeamAnalyzer()
+    return _analyzer
+
+
+def fallback_analysis(analyzer: UniversalTeamAnalyzer, data: Dict[str, Any], reason: str) -> str:
+    """Офлайн-анализ с учетом причины в kpi_llm_fallbacks_total"""
+    LLM_FALLBACKS.inc(reason=reason)
+    with stage("fallback"):
+        return analyzer.smart_emergency_analysis(data)
+
+
 def safe_analyze(data: Dict[str, Any]) -> str:
     """Безопасный анализ с fallback"""
-    analyzer = UniversalTeamAnalyzer()
+    analyzer = get_analyzer()
     try:
         start = time.time()
         result = analyzer.analyze_team_data(data)
         if not result or result.startswith("Ошибка"):
             print("⚠️ LLM недоступен, используем fallback.")
-            result = analyzer.smart_emergency_analysis(data)
+            result = fallback_analysis(analyzer, data, "llm_error")
         else:
             print(f"✅ LLM-анализ завершен за {time.time()-start:.1f}с.")
         return result
     except Exception as e:
         print(f"❌ Ошибка анализа: {e}")
-        return analyzer.smart_emergency_analysis(data)
+        return fallback_analysis(analyzer, data, "exception")
+
+
+
+async def _analyze_prompt_async(analyzer: UniversalTeamAnalyzer, prompt: str,
+                                data: Dict[str, Any], route: str = "large") -> Tuple[str, bool]:
+    """LLM-анализ готового промпта; возвращает (текст, получен ли он от LLM)"""
+    try:
+        start = time.time()
+        result = await analyzer._send_llm_request_async(prompt, route)
+        if not result or result.startswith("Ошибка"):
+            print("⚠️ LLM недоступен, используем fallback.")
+            return fallback_analysis(analyzer, data, "llm_error"), False
+        print(f"✅ LLM-анализ завершен за {time.time()-start:.1f}с.")
+        return result, True
+    except Exception as e:
+        print(f"❌ Ошибка анализа: {e}")
+        return fallback_analysis(analyzer, data, "exception"), False
+
+
+async def safe_analyze_async(data: Dict[str, Any]) -> str:
+    """Асинхронный безопасный анализ с fallback: не занимает поток на время генерации"""
+    analyzer = get_analyzer()
+    with stage("prompt"):
+        prompt, stats = analyzer.build_prompt_info(data)
+    result, _ = await _analyze_prompt_async(analyzer, prompt, data, analyzer.route(stats))
+    return result
+
+
+def build_analysis_prompt(data: Dict[str, Any], bucket: Optional[float] = None,
+                          analyzer: Optional[UniversalTeamAnalyzer] = None) -> Tuple[str, Dict[str, Any]]:
+    """Промпт, который уйдет в LLM (по округленным KPI), его статистика, маршрут и модель"""
+    analyzer = analyzer or get_analyzer()
+    bucket = LLM_CACHE_KPI_BUCKET if bucket is None else bucket
+    with stage("prompt"):
+        prompt, stats = analyzer.build_prompt_info(bucket_kpi_data(data, bucket))
+    stats["route"] = analyzer.route(stats)
+    stats["model"] = analyzer.model_for(stats["route"])
+    LLM_PROMPT_TOKENS.observe(stats["estimated_tokens"])
+    return prompt, stats
+
+
+async def _cache_lookup(analyzer: UniversalTeamAnalyzer, data: Dict[str, Any],
+                        bucket: Optional[float]) -> Tuple[str, str, str, Optional[str]]:
+    """Промпт (по округленным KPI), маршрут, ключ кэша (по модели маршрута) и найденный результат"""
+    prompt, stats = build_analysis_prompt(data, bucket, analyzer)
+    key = cache_key(stats["model"], prompt)
+    return prompt, stats["route"], key, await get_analysis_cache().aget(key)
+
+
+async def cached_analyze_async(data: Dict[str, Any], project: Optional[str] = None,
+                               bucket: Optional[float] = None) -> Tuple[str, str]:
+    """
+    Анализ через кэш: возвращает (текст, "hit" | "miss").
+    Кэшируются только ответы LLM, офлайн-анализ не сохраняется.
+    """
+    analyzer = get_analyzer()
+    prompt, route, key, cached = await _cache_lookup(analyzer, data, bucket)
+    if cached is not None:
+        print("💾 Анализ взят из кэша.")
+        return cached, "hit"
+
+    result, from_llm = await get_llm_guard().run(
+        key,
+        lambda: _analyze_prompt_async(analyzer, prompt, data, route),
+        lambda reason: (fallback_analysis(analyzer, data, reason), False)
+    )
+    if from_llm:
+        await get_analysis_cache().aput(key, result, project)
+    return result, "miss"
+
+
+def format_sse(event: str, payload: Dict[str, Any]) -> str:
+    """Одно событие Server-Sent Events с JSON-данными"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def stream_analysis_events(data: Dict[str, Any], project: Optional[str] = None,
+                                 bucket: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    Server-Sent Events с токенами LLM-анализа.
+    События: token (очередной фрагмент), fallback (офлайн-анализ, если LLM
+    недоступен до первого токена), error (обрыв после начала), done.
+    При попадании в кэш весь текст приходит одним событием token.
+    """
+    analyzer = get_analyzer()
+    start = time.time()
+    prompt, route, key, cached = await _cache_lookup(analyzer, data, bucket)
+    if cached is not None:
+        yield format_sse("token", {"token": cached})
+        yield format_sse("done", {"elapsed": round(time.time() - start, 3), "cache": "hit"})
+        return
+
+    guard = get_llm_guard()
+    reason = await guard.acquire()
+    if reason is not None:
+        print(f"⛔ LLM не допущен ({reason}), используем fallback.")
+        yield format_sse("fallback", {"analysis": fallback_analysis(analyzer, data, reason), "reason": reason})
+        yield format_sse("done", {"elapsed": round(time.time() - start, 3), "cache": "miss"})
+        return
+
+    tokens = []
+    completed = False
+    # Итог для размыкателя: None, пока LLM не ответил и не отказал. Отключение
+    # клиента (CancelledError/GeneratorExit) его не меняет - это не сбой LLM
+    success = None
+    llm_start = time.perf_counter()
+    try:
+        async for token in analyzer.stream_llm_tokens(prompt, route):
+            tokens.append(token)
+            yield format_sse("token", {"token": token})
+        completed = True
+        # Пустой ответ считается отказом
+        success = bool(tokens)
+        print(f"✅ LLM-анализ (поток) завершен за {time.time()-start:.1f}с.")
+        if tokens:
+            await get_analysis_cache().aput(key, "".join(tokens), project)
+    except Exception as e:
+        success = False
+        if tokens:
+            print(f"❌ Обрыв потока LLM: {e}")
+            yield format_sse("error", {"error": str(e)})
+        else:
+            print("⚠️ LLM недоступен, используем fallback.")
+            yield format_sse("fallback", {"analysis": fallback_analysis(analyzer, data, "llm_error")})
+    finally:
+        guard.release(success)
+        observe_stage("llm", time.perf_counter() - llm_start)
+        if completed:
+            analyzer._observe_route(route, time.perf_counter() - llm_start)
+        LLM_REQUESTS.inc(status="200" if completed else "stream_error" if success is False else "client_closed")
+    yield format_sse("done", {"elapsed": round(time.time() - start, 3), "cache": "miss"})
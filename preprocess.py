@@ -1,50 +1,93 @@
-import pandas as pd
+import numpy as np
 import re
-from datetime import datetime
+from datetime import datetime, date, timedelta, timezone
 from collections import defaultdict
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import logging
 
+from telemetry import stage
+
 logger = logging.getLogger(__name__)
 
+class CommitRecord(NamedTuple):
+    """Предрассчитанные признаки одного коммита"""
+    author: str
+    type: str
+    complexity: float
+    day: Optional[date]
+    is_merge: bool
+
+
+# Типы коммитов в порядке их кодов в CommitTable.type_codes
+COMMIT_TYPES = ["feature", "fix", "refactor", "test", "docs", "other"]
+TYPE_CODES = {commit_type: code for code, commit_type in enumerate(COMMIT_TYPES)}
+
+# Значение CommitTable.days для коммитов без распознанной даты (NaT)
+NO_DAY = np.iinfo(np.int64).min
+
+
+class CommitTable(NamedTuple):
+    """
+    Колоночное представление коммитов проекта.
+    Авторы и типы хранятся целочисленными кодами (authors[code], COMMIT_TYPES[code]),
+    дни - числом дней от 1970-01-01, NO_DAY для нераспознанных дат.
+    """
+    authors: List[str]
+    author_codes: np.ndarray
+    type_codes: np.ndarray
+    complexity: np.ndarray
+    days: np.ndarray
+    is_merge: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return len(self.type_codes)
+
+
+# Факторы сложности по типу коммита
+COMPLEXITY_FACTORS = {
+    "feature": 1.5,
+    "refactor": 1.8,
+    "fix": 1.3,
+    "test": 1.1,
+    "docs": 0.8,
+    "other": 1.0
+}
+
+# Сложные ключевые слова и релизные ветки, собранные в одно выражение
+COMPLEX_KEYWORDS_RE = re.compile("|".join([
+    "architecture", "refactor", "performance", "optimize",
+    "security", "migration", "integration", "database"
+]))
+RELEASE_BRANCHES_RE = re.compile("|".join(["main", "master", "release", "prod", "stable"]))
+
+
 # Переносим функцию calculate_commit_complexity в preprocess.py
-def calculate_commit_complexity(commit: dict) -> float:
+def calculate_commit_complexity(commit: dict, commit_type: Optional[str] = None) -> float:
     """
     Рассчитывает сложность коммита на основе различных факторов.
-    Возвращает коэффициент сложности от 0.5 до 3.0
+    Возвращает коэффициент сложности от 0.5 до 3.0.
+    Если тип коммита уже известен, он передается в commit_type,
+    чтобы не классифицировать сообщение повторно.
     """
     complexity = 1.0  # Базовая сложность
 
     message = commit.get("message", "").lower()
     branches = commit.get("branches", [])
 
-    # Факторы сложности
-    factors = {
-        # Сложность по типу коммита
-        "feature": 1.5,
-        "refactor": 1.8,
-        "fix": 1.3,
-        "test": 1.1,
-        "docs": 0.8,
-        "other": 1.0
-    }
-
     # Определяем тип для расчета сложности
-    commit_type = improved_classify_commit(message)
-    complexity *= factors.get(commit_type, 1.0)
+    if commit_type is None:
+        commit_type = improved_classify_commit(message)
+    complexity *= COMPLEXITY_FACTORS.get(commit_type, 1.0)
 
     # Бонус за сложные ключевые слова в сообщении
-    complex_keywords = [
-        "architecture", "refactor", "performance", "optimize",
-        "security", "migration", "integration", "database"
-    ]
-    if any(keyword in message for keyword in complex_keywords):
+    if COMPLEX_KEYWORDS_RE.search(message):
         complexity *= 1.4
 
     # Бонус за работу в релизных ветках
-    release_branches = ["main", "master", "release", "prod", "stable"]
-    if any(branch in str(branches).lower() for branch in release_branches):
+    if branches and RELEASE_BRANCHES_RE.search(str(branches).lower()):
         complexity *= 1.3
 
     # Бонус за коммиты с задачами (скорее всего, это осознанная работа)
@@ -53,55 +96,181 @@ def calculate_commit_complexity(commit: dict) -> float:
 
     return min(complexity, 3.0)  # Ограничиваем максимальную сложность
 
+
+# Регулярные выражения для точного определения типа коммита.
+# Порядок важен: побеждает первый совпавший паттерн.
+COMMIT_TYPE_PATTERNS = {
+    "feature": [
+        r'^(feat|feature|add|implement|create|new)(\([^)]+\))?:',
+        r'\b(adds?|implements?|creates?|new)\b.*\b(feature|functionality|module)\b'
+    ],
+    "fix": [
+        r'^(fix|bug|error|issue|resolve|patch|repair)(\([^)]+\))?:',
+        r'\b(fix|fixes|fixed|bug|error|issue|resolve)\b.*\b(#\d+)?\b'
+    ],
+    "refactor": [
+        r'^(refactor|cleanup|remove|optimize|improve|restructure)(\([^)]+\))?:',
+        r'\b(refactor|cleanup|optimize|improve|restructure)\b.*\b(code|performance)\b'
+    ],
+    "test": [
+        r'^(test|spec|coverage|unittest|integration)(\([^)]+\))?:',
+        r'\b(test|tests|testing|spec|coverage)\b.*\b(add|implement|create)\b'
+    ],
+    "docs": [
+        r'^(doc|readme|comment|document|changelog)(\([^)]+\))?:',
+        r'\b(doc|docs|documentation|readme|changelog|comment)\b'
+    ]
+}
+
+
+class CommitClassifier:
+    """
+    Классификатор коммитов с однократной компиляцией паттернов.
+
+    Все паттерны собираются в одно выражение с именованными группами.
+    Каждая альтернатива - lookahead от начала строки, поэтому результат
+    совпадает с последовательными re.search: побеждает первый паттерн
+    в порядке COMMIT_TYPE_PATTERNS, а не самое левое совпадение.
+    Результаты кэшируются в LRU по нормализованному сообщению.
+    """
+
+    def __init__(self, patterns: Optional[Dict[str, List[str]]] = None, cache_size: int = 16384):
+        patterns = patterns or COMMIT_TYPE_PATTERNS
+        alternatives = []
+        self._group_types = {}
+        for commit_type, regex_list in patterns.items():
+            for i, pattern in enumerate(regex_list):
+                group = f"{commit_type}_{i}"
+                self._group_types[group] = commit_type
+                # Паттерны с ^ проверяются только в начале строки, остальным
+                # нужен префикс, эквивалентный поиску по всей строке
+                prefix = "" if pattern.startswith("^") else "[\\s\\S]*?"
+                alternatives.append(f"(?P<{group}>(?={prefix}(?:{pattern})))")
+
+        self._regex = re.compile(r"\A(?:" + "|".join(alternatives) + ")")
+        self._classify_normalized = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, msg: str) -> str:
+        match = self._regex.match(msg)
+        if match is None:
+            return "other"
+        return self._group_types[match.lastgroup]
+
+    def classify(self, message: str) -> str:
+        """Тип одного коммита"""
+        if not message:
+            return "other"
+        return self._classify_normalized(message.lower().strip())
+
+    def classify_many(self, messages: Iterable[str]) -> List[str]:
+        """Пакетная классификация сообщений"""
+        classify = self.classify
+        return [classify(message) for message in messages]
+
+    def cache_info(self):
+        """Статистика LRU-кэша (hits, misses, maxsize, currsize)"""
+        return self._classify_normalized.cache_info()
+
+    def cache_clear(self):
+        self._classify_normalized.cache_clear()
+
+
+default_classifier = CommitClassifier()
+
+
 def improved_classify_commit(message: str) -> str:
     """
     Улучшенная классификация коммитов с использованием регулярных выражений
     для предотвращения ложных срабатываний.
     """
-    if not message:
-        return "other"
-
-    msg = message.lower().strip()
-
-    # Регулярные выражения для точного определения типа коммита
-    patterns = {
-        "feature": [
-            r'^(feat|feature|add|implement|create|new)(\([^)]+\))?:',
-            r'\b(adds?|implements?|creates?|new)\b.*\b(feature|functionality|module)\b'
-        ],
-        "fix": [
-            r'^(fix|bug|error|issue|resolve|patch|repair)(\([^)]+\))?:',
-            r'\b(fix|fixes|fixed|bug|error|issue|resolve)\b.*\b(#\d+)?\b'
-        ],
-        "refactor": [
-            r'^(refactor|cleanup|remove|optimize|improve|restructure)(\([^)]+\))?:',
-            r'\b(refactor|cleanup|optimize|improve|restructure)\b.*\b(code|performance)\b'
-        ],
-        "test": [
-            r'^(test|spec|coverage|unittest|integration)(\([^)]+\))?:',
-            r'\b(test|tests|testing|spec|coverage)\b.*\b(add|implement|create)\b'
-        ],
-        "docs": [
-            r'^(doc|readme|comment|document|changelog)(\([^)]+\))?:',
-            r'\b(doc|docs|documentation|readme|changelog|comment)\b'
-        ]
-    }
+    return default_classifier.classify(message)
+
+
+# Поля со списками веток, объединяемые у дубликатов коммита
+BRANCH_FIELDS = ("branches", "branch_names")
 
-    # Проверяем каждый паттерн
-    for commit_type, regex_list in patterns.items():
-        for pattern in regex_list:
-            if re.search(pattern, msg):
-                return commit_type
 
-    return "other"
+class CommitDedupIndex:
+    """
+    Индекс коммитов по hash: проверка за O(1) и слияние веток дубликатов.
+    Один и тот же коммит из нескольких репозиториев (форки, зеркала) или
+    веток учитывается один раз, его branches/branch_names объединяются.
+    Коммиты без hash не дедуплицируются. Входные словари не изменяются:
+    при слиянии сохраненный коммит заменяется копией.
+    """
+
+    def __init__(self):
+        self.commits: List[Dict] = []
+        self.received = 0
+        self.duplicates = 0
+        self._positions: Dict[str, int] = {}
+        self._copied = set()
+
+    def add(self, commit: Dict) -> bool:
+        """Добавляет коммит; False - это дубликат уже учтенного"""
+        self.received += 1
+        commit_hash = commit.get("hash")
+        if not commit_hash:
+            self.commits.append(commit)
+            return True
+
+        position = self._positions.get(commit_hash)
+        if position is None:
+            self._positions[commit_hash] = len(self.commits)
+            self.commits.append(commit)
+            return True
+
+        self.duplicates += 1
+        self._merge(position, commit)
+        return False
+
+    def extend(self, commits: Iterable[Dict]):
+        for commit in commits:
+            self.add(commit)
+
+    def _merge(self, position: int, duplicate: Dict):
+        kept = self.commits[position]
+        for field in BRANCH_FIELDS:
+            extra = duplicate.get(field)
+            if not extra:
+                continue
+            current = kept.get(field) or []
+            missing = [branch for branch in extra if branch not in current]
+            if not missing:
+                continue
+            if position not in self._copied:
+                kept = self.commits[position] = dict(kept)
+                self._copied.add(position)
+            kept[field] = list(current) + missing
+
+    def stats(self) -> Dict[str, int]:
+        return {"commits_received": self.received, "duplicates_removed": self.duplicates}
+
+
+def deduplicate_commits(commits: List[Dict]) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Коммиты без повторов по hash и статистика. Если дубликатов нет (частый
+    случай), список возвращается как есть после проверки одним set().
+    """
+    hashes = [commit.get("hash") for commit in commits]
+    unique_hashes = set(hashes)
+    unique_hashes.discard(None)
+    unique_hashes.discard("")
+    if len(unique_hashes) == len(hashes) - hashes.count(None) - hashes.count(""):
+        return commits, {"commits_received": len(commits), "duplicates_removed": 0}
 
+    index = CommitDedupIndex()
+    index.extend(commits)
+    return index.commits, index.stats()
 
-def extract_commits_from_data(data: dict) -> Tuple[List[Dict], Dict[str, List[Dict]]]:
+
+def collect_commits(data: dict, dedup: bool = True) -> List[Dict]:
     """
-    Универсальное извлечение коммитов из разных форматов данных.
+    Универсальное извлечение списка коммитов из разных форматов данных.
+    Повторы одного коммита (по hash) в разных репозиториях и ветках
+    объединяются, если не передан dedup=False.
     """
     commits = []
-    authors_commits = defaultdict(list)
 
     # Определяем формат данных и извлекаем коммиты
     if "commits" in data:
@@ -113,12 +282,157 @@ def extract_commits_from_data(data: dict) -> Tuple[List[Dict], Dict[str, List[Di
         for repo in data.get("repos", []):
             commits.extend(repo.get("commits", []))
 
-    # Группируем коммиты по авторам
-    for commit in commits:
-        author_name = commit.get("author", {}).get("name", "Unknown")
-        authors_commits[author_name].append(commit)
+    if dedup:
+        commits, _ = deduplicate_commits(commits)
+    return commits
+
+
+def get_commit_date(commit: dict) -> Optional[str]:
+    """Строка даты коммита (createdAt или created_at)"""
+    return commit.get("createdAt") or commit.get("created_at")
+
+
+def _make_record(commit: dict, commit_type: str, day: Optional[date]) -> CommitRecord:
+    return CommitRecord(
+        author=commit.get("author", {}).get("name", "Unknown"),
+        type=commit_type,
+        complexity=calculate_commit_complexity(commit, commit_type),
+        day=day,
+        is_merge=len(commit.get("parents", [])) > 1
+    )
+
+
+def build_commit_records(commits: List[Dict]) -> List[CommitRecord]:
+    """Один проход по коммитам: все признаки считаются ровно один раз"""
+    types = default_classifier.classify_many(commit.get("message", "") for commit in commits)
+    # Даты разбираются всей колонкой; NaT превращается в None
+    days = parse_date_column(get_commit_date(commit) for commit in commits)
+    days = days.astype("datetime64[D]").tolist()
+    return [_make_record(commit, commit_type, day) for commit, commit_type, day in zip(commits, types, days)]
+
+
+def group_records_by_author(records: List[CommitRecord]) -> Dict[str, List[CommitRecord]]:
+    """Группирует предрассчитанные записи по авторам"""
+    authors_records = defaultdict(list)
+    for record in records:
+        authors_records[record.author].append(record)
+    return dict(authors_records)
+
+
+def build_commit_table(commits: List[Dict]) -> CommitTable:
+    """Один проход по коммитам с раскладкой признаков по колонкам"""
+    n = len(commits)
+    with stage("classify"):
+        types = default_classifier.classify_many(commit.get("message", "") for commit in commits)
+
+    # Коды авторов в порядке первого появления
+    authors = {}
+    author_codes = np.fromiter(
+        (authors.setdefault(commit.get("author", {}).get("name", "Unknown"), len(authors)) for commit in commits),
+        dtype=np.int64, count=n
+    )
+    type_codes = np.fromiter((TYPE_CODES[commit_type] for commit_type in types), dtype=np.int64, count=n)
+    with stage("complexity"):
+        complexity = np.fromiter(
+            (calculate_commit_complexity(commit, commit_type) for commit, commit_type in zip(commits, types)),
+            dtype=np.float64, count=n
+        )
+    with stage("parse_dates"):
+        days = parse_date_column(get_commit_date(commit) for commit in commits)
+    is_merge = np.fromiter((len(commit.get("parents", [])) > 1 for commit in commits), dtype=bool, count=n)
+
+    return CommitTable(
+        authors=list(authors),
+        author_codes=author_codes,
+        type_codes=type_codes,
+        complexity=complexity,
+        days=days.astype("datetime64[D]").view(np.int64),
+        is_merge=is_merge
+    )
+
+
+def count_types_by_author(table: CommitTable) -> np.ndarray:
+    """Матрица (авторы x COMMIT_TYPES) с числом коммитов каждого типа"""
+    n_types = len(COMMIT_TYPES)
+    flat = np.bincount(table.author_codes * n_types + table.type_codes,
+                       minlength=len(table.authors) * n_types)
+    return flat.reshape(len(table.authors), n_types)
+
+
+def count_active_days_by_author(table: CommitTable) -> np.ndarray:
+    """Число уникальных активных дней у каждого автора"""
+    known = table.days != NO_DAY
+    if not known.any():
+        return np.zeros(len(table.authors), dtype=np.int64)
+
+    days = table.days[known]
+    first_day = days.min()
+    span = int(days.max() - first_day) + 1
+    # Уникальные пары (автор, день), упакованные в одно число
+    pairs = np.unique(table.author_codes[known] * span + (days - first_day))
+    return np.bincount(pairs // span, minlength=len(table.authors))
+
+
+def aggregate_table_metrics(table: CommitTable) -> dict:
+    """
+    Командные счетчики в формате initialize_metrics. В active_days лежит
+    массив уникальных дней, поэтому len() работает так же, как для set.
+    """
+    type_counts = np.bincount(table.type_codes, minlength=len(COMMIT_TYPES))
+    return {
+        "commits_total": table.size,
+        "merge_conflicts": int(table.is_merge.sum()),
+        "refactor_commits": int(type_counts[TYPE_CODES["refactor"]]),
+        "fix_commits": int(type_counts[TYPE_CODES["fix"]]),
+        "feature_commits": int(type_counts[TYPE_CODES["feature"]]),
+        "docs_commits": int(type_counts[TYPE_CODES["docs"]]),
+        "test_commits": int(type_counts[TYPE_CODES["test"]]),
+        "active_days": np.unique(table.days[table.days != NO_DAY])
+    }
+
+
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+
+# Форматы, которые не покрывает datetime.fromisoformat
+DATE_FORMATS = [
+    "%Y-%m-%dT%H:%M:%S.%fZ",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S"
+]
 
-    return commits, dict(authors_commits)
+
+@lru_cache(maxsize=65536)
+def _parse_date_cached(date_str: str) -> Optional[datetime]:
+    """
+    Парсинг одной строки даты. Результат - наивное время в UTC:
+    метки со смещением часового пояса переводятся в UTC, а не теряются.
+    """
+    # Быстрый путь: ISO-8601, включая 'Z', доли секунды и смещения
+    try:
+        dt = datetime.fromisoformat(date_str)
+    except ValueError:
+        dt = None
+        for fmt in DATE_FORMATS:
+            try:
+                dt = datetime.strptime(date_str, fmt)
+                break
+            except ValueError:
+                continue
+
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+@lru_cache(maxsize=65536)
+def _parse_date_seconds(date_str: str) -> Optional[int]:
+    """Секунды от 1970-01-01 (UTC) или None, если дата не распознана"""
+    dt = _parse_date_cached(date_str)
+    if dt is None:
+        return None
+    return (dt - EPOCH) // SECOND
 
 
 def parse_date(date_str: str) -> datetime:
@@ -126,49 +440,69 @@ def parse_date(date_str: str) -> datetime:
     if not date_str:
         return None
 
-    formats = [
-        "%Y-%m-%dT%H:%M:%S.%fZ",
-        "%Y-%m-%dT%H:%M:%SZ",
-        "%Y-%m-%dT%H:%M:%S",
-        "%Y-%m-%d %H:%M:%S"
-    ]
+    dt = _parse_date_cached(date_str)
+    if dt is None:
+        logger.warning(f"Не удалось распарсить дату: {date_str}")
+    return dt
 
-    for fmt in formats:
-        try:
-            return datetime.strptime(date_str, fmt)
-        except ValueError:
-            continue
 
-    logger.warning(f"Не удалось распарсить дату: {date_str}")
-    return None
+def clear_caches():
+    """Сбрасывает кэши классификатора и парсера дат (для замеров "с холода")"""
+    default_classifier.cache_clear()
+    _parse_date_cached.cache_clear()
+    _parse_date_seconds.cache_clear()
 
 
-def extract_features_from_project(data: dict) -> pd.DataFrame:
+def parse_date_column(values: Iterable[Optional[str]]) -> np.ndarray:
     """
-    Преобразует JSON из backend API в DataFrame с вычисляемыми признаками.
+    Пакетный парсинг колонки createdAt/created_at в datetime64[s].
+    Повторяющиеся строки берутся из кэша, нераспознанные значения
+    становятся NaT, а предупреждение пишется одно на всю колонку.
     """
-    all_commits, authors_commits = extract_commits_from_data(data)
-
-    if not all_commits:
-        return create_empty_features_df()
+    parsed = []
+    failed = 0
+    example = None
+    for value in values:
+        seconds = _parse_date_seconds(value) if value else None
+        if seconds is None:
+            if value:
+                failed += 1
+                example = example or value
+            seconds = NO_DAY
+        parsed.append(seconds)
+
+    if failed:
+        logger.warning(f"Не удалось распарсить дат: {failed} (например: {example})")
+    # NO_DAY совпадает с целочисленным представлением NaT
+    return np.array(parsed, dtype=np.int64).view("datetime64[s]")
+
+
+def extract_team_features(data: dict, table: Optional[CommitTable] = None) -> dict:
+    """
+    Командные признаки проекта из JSON backend API (словарь, счетчики - int).
+    Если колоночное представление уже построено (build_commit_table), оно
+    передается в table и повторно не вычисляется.
+    """
+    if table is None:
+        table = build_commit_table(collect_commits(data))
 
-    # Инициализация счетчиков
-    metrics = initialize_metrics()
+    if table.size == 0:
+        return create_empty_features()
 
-    # Обработка всех коммитов
-    process_all_commits(all_commits, metrics)
+    # Командные счетчики
+    metrics = aggregate_table_metrics(table)
 
     # Расчет производных метрик
-    team_size = len(authors_commits)
+    team_size = len(table.authors)
     derived_metrics = calculate_derived_metrics(metrics, team_size)
 
     # Расчет реального bus factor
-    bus_factor = calculate_real_bus_factor(authors_commits)
+    bus_factor = calculate_bus_factor_from_counts(np.bincount(table.author_codes, minlength=team_size))
 
     # Расчет средней сложности коммитов
-    avg_complexity = calculate_average_complexity(all_commits)
+    avg_complexity = calculate_average_complexity_from_values(table.complexity)
 
-    return create_features_dataframe(metrics, derived_metrics, bus_factor, team_size, avg_complexity)
+    return create_features(metrics, derived_metrics, bus_factor, team_size, avg_complexity)
 
 
 def calculate_average_complexity(commits: List[Dict]) -> float:
@@ -176,8 +510,15 @@ def calculate_average_complexity(commits: List[Dict]) -> float:
     if not commits:
         return 1.0
 
-    total_complexity = sum(calculate_commit_complexity(commit) for commit in commits)
-    return total_complexity / len(commits)
+    return calculate_average_complexity_from_values(build_commit_table(commits).complexity)
+
+
+def calculate_average_complexity_from_values(complexity: np.ndarray) -> float:
+    """Средняя сложность по уже посчитанной колонке CommitTable.complexity"""
+    if len(complexity) == 0:
+        return 1.0
+
+    return float(np.mean(complexity))
 
 
 def initialize_metrics() -> dict:
@@ -194,22 +535,20 @@ def initialize_metrics() -> dict:
     }
 
 
-def process_all_commits(commits: List[Dict], metrics: dict):
+def process_all_commits(records: List[CommitRecord], metrics: dict):
     """Обработка всех коммитов для сбора метрик"""
-    for commit in commits:
+    for record in records:
         metrics["commits_total"] += 1
 
-        # Анализ сообщения коммита с улучшенной классификацией
-        msg = commit.get("message", "")
-        ctype = improved_classify_commit(msg)
-        update_commit_type_metrics(ctype, metrics)
+        # Тип коммита уже определен при построении записи
+        update_commit_type_metrics(record.type, metrics)
 
         # Анализ merge конфликтов
-        if len(commit.get("parents", [])) > 1:
+        if record.is_merge:
             metrics["merge_conflicts"] += 1
 
         # Анализ даты
-        process_commit_date(commit, metrics)
+        process_commit_date(record, metrics)
 
 
 def update_commit_type_metrics(commit_type: str, metrics: dict):
@@ -226,13 +565,10 @@ def update_commit_type_metrics(commit_type: str, metrics: dict):
         metrics[type_mapping[commit_type]] += 1
 
 
-def process_commit_date(commit: Dict, metrics: dict):
+def process_commit_date(record: CommitRecord, metrics: dict):
     """Обработка даты коммита"""
-    created_at = commit.get("createdAt") or commit.get("created_at")
-    if created_at:
-        dt = parse_date(created_at)
-        if dt:
-            metrics["active_days"].add(dt.date())
+    if record.day:
+        metrics["active_days"].add(record.day)
 
 
 def calculate_derived_metrics(metrics: dict, team_size: int) -> dict:
@@ -252,43 +588,51 @@ def calculate_derived_metrics(metrics: dict, team_size: int) -> dict:
     }
 
 
-def create_features_dataframe(base_metrics: dict, derived_metrics: dict, bus_factor: int,
-                              team_size: int, avg_complexity: float) -> pd.DataFrame:
-    """Создание итогового DataFrame с признаками"""
-    features = {
-        "commits_total": base_metrics["commits_total"],
-        "merge_conflicts": base_metrics["merge_conflicts"],
-        "bus_factor": bus_factor,
-        "refactor_commits": base_metrics["refactor_commits"],
-        "fix_commits": base_metrics["fix_commits"],
-        "feature_commits": base_metrics["feature_commits"],
-        "docs_commits": base_metrics["docs_commits"],
-        "test_commits": base_metrics["test_commits"],
-        "refactor_ratio": derived_metrics["refactor_ratio"],
-        "fix_ratio": derived_metrics["fix_ratio"],
-        "feature_ratio": derived_metrics["feature_ratio"],
-        "docs_ratio": derived_metrics["docs_ratio"],
-        "test_ratio": derived_metrics["test_ratio"],
-        "active_days": derived_metrics["active_days_count"],
-        "team_size": team_size,
-        "avg_commits_per_dev": derived_metrics["avg_commits_per_dev"],
-        "avg_complexity": avg_complexity
+def create_features(base_metrics: dict, derived_metrics: dict, bus_factor: int,
+                    team_size: int, avg_complexity: float) -> dict:
+    """Создание итогового словаря признаков"""
+    return {
+        "commits_total": int(base_metrics["commits_total"]),
+        "merge_conflicts": int(base_metrics["merge_conflicts"]),
+        "bus_factor": int(bus_factor),
+        "refactor_commits": int(base_metrics["refactor_commits"]),
+        "fix_commits": int(base_metrics["fix_commits"]),
+        "feature_commits": int(base_metrics["feature_commits"]),
+        "docs_commits": int(base_metrics["docs_commits"]),
+        "test_commits": int(base_metrics["test_commits"]),
+        "refactor_ratio": float(derived_metrics["refactor_ratio"]),
+        "fix_ratio": float(derived_metrics["fix_ratio"]),
+        "feature_ratio": float(derived_metrics["feature_ratio"]),
+        "docs_ratio": float(derived_metrics["docs_ratio"]),
+        "test_ratio": float(derived_metrics["test_ratio"]),
+        "active_days": int(derived_metrics["active_days_count"]),
+        "team_size": int(team_size),
+        "avg_commits_per_dev": float(derived_metrics["avg_commits_per_dev"]),
+        "avg_complexity": float(avg_complexity)
     }
 
-    return pd.DataFrame([features])
 
-
-def create_empty_features_df() -> pd.DataFrame:
-    """Создание пустого DataFrame с правильной структурой"""
-    empty_features = {
+def create_empty_features() -> dict:
+    """Признаки проекта без коммитов"""
+    return {
         "commits_total": 0, "merge_conflicts": 0, "bus_factor": 0,
         "refactor_commits": 0, "fix_commits": 0, "feature_commits": 0,
-        "docs_commits": 0, "test_commits": 0, "refactor_ratio": 0,
-        "fix_ratio": 0, "feature_ratio": 0, "docs_ratio": 0, "test_ratio": 0,
-        "active_days": 0, "team_size": 0, "avg_commits_per_dev": 0,
+        "docs_commits": 0, "test_commits": 0, "refactor_ratio": 0.0,
+        "fix_ratio": 0.0, "feature_ratio": 0.0, "docs_ratio": 0.0, "test_ratio": 0.0,
+        "active_days": 0, "team_size": 0, "avg_commits_per_dev": 0.0,
         "avg_complexity": 1.0
     }
-    return pd.DataFrame([empty_features])
+
+
+def calculate_bus_factor_from_counts(commit_counts: np.ndarray) -> int:
+    """Bus factor по массиву числа коммитов на разработчика"""
+    if len(commit_counts) == 0:
+        return 0
+
+    cumulative = np.cumsum(np.sort(commit_counts)[::-1])
+    target = cumulative[-1] * 0.5
+    # Первый префикс самых активных разработчиков, покрывающий 50% коммитов
+    return int(np.searchsorted(cumulative, target, side="left")) + 1
 
 
 def calculate_real_bus_factor(developers_commits: dict) -> int:
@@ -296,36 +640,23 @@ def calculate_real_bus_factor(developers_commits: dict) -> int:
     if not developers_commits:
         return 0
 
-    commit_counts = sorted([len(commits) for commits in developers_commits.values()], reverse=True)
-    total_commits = sum(commit_counts)
-    target = total_commits * 0.5
+    commit_counts = np.array([len(commits) for commits in developers_commits.values()])
+    return calculate_bus_factor_from_counts(commit_counts)
 
-    current_sum = 0
-    bus_factor = 0
-    for count in commit_counts:
-        current_sum += count
-        bus_factor += 1
-        if current_sum >= target:
-            break
-    return bus_factor
 
-
-def extract_individual_metrics(data: dict) -> Dict[str, List[Dict]]:
+def extract_individual_metrics(data: dict, records: Optional[List[CommitRecord]] = None) -> Dict[str, List[CommitRecord]]:
     """
     Извлекает метрики для каждого разработчика отдельно.
     """
-    _, authors_commits = extract_commits_from_data(data)
-    return authors_commits
+    if records is None:
+        records = build_commit_records(collect_commits(data))
+    return group_records_by_author(records)
 
 
 # === Пример локального запуска ===
 if __name__ == "__main__":
-    import json
-
-    with open("sample_commits.json", "r", encoding="utf-8") as f:
-        sample = json.load(f)
+    # Офлайн-расчет KPI по выгрузкам: python preprocess.py <каталоги/файлы/шаблоны> -o kpi.jsonl
+    import sys
+    from kpi_cli import main
 
-    df = extract_features_from_project(sample)
-    print("Извлеченные признаки:")
-    print(df)
-    print(f"\nBus factor: {calculate_real_bus_factor(extract_individual_metrics(sample))}")
\ No newline at end of file
+    sys.exit(main())
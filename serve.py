@@ -0,0 +1,148 @@
+# Продакшен-запуск API: приложение импортируется один раз в главном процессе,
+# затем воркеры uvicorn создаются fork'ом и принимают соединения на общем
+# сокете. Воркер готов сразу после fork (импорты и сборка app уже сделаны),
+# память кода разделяется между воркерами copy-on-write. Лимиты параллелизма
+# (LLM_MAX_IN_FLIGHT, ANALYSIS_JOB_WORKERS, KPI_BATCH_WORKERS и т.п.) - на весь
+# сервис, каждый воркер получает свою долю (worker_limits.py); модели Ollama
+# прогревает только первый воркер. Метрики воркеров пишутся в общий каталог
+# KPI_METRICS_DIR, /metrics любого воркера отдает сумму по сервису.
+# Запуск: python serve.py --workers 4 (для разработки - uvicorn api:app --reload)
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict, Tuple
+
+import uvicorn
+from fastapi import FastAPI
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Число воркеров (имя переменной - как у uvicorn/gunicorn). Не по числу CPU:
+# os.cpu_count() в контейнере видит CPU хоста, а не квоту
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "2"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+# Воркер, упавший быстрее этого срока, перезапускается с паузой
+RESTART_BACKOFF = 1.0
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def load_app(workers: int) -> FastAPI:
+    """
+    Импорт приложения; число воркеров задается до него - по нему делятся
+    лимиты. При нескольких воркерах задается и каталог снимков метрик
+    (KPI_METRICS_DIR или временный), снимки прошлого запуска удаляются.
+    """
+    os.environ["SERVE_WORKERS"] = str(max(workers, 1))
+    if workers > 1:
+        directory = os.environ.get("KPI_METRICS_DIR") or tempfile.mkdtemp(prefix="kpi-metrics-")
+        os.makedirs(directory, exist_ok=True)
+        os.environ["KPI_METRICS_DIR"] = directory
+        from telemetry import clear_snapshots
+        clear_snapshots(directory)
+    from api import app
+    return app
+
+
+def run_worker(app: FastAPI, sock: socket.socket, log_level: str):
+    """Один uvicorn-сервер на унаследованном сокете (lifespan - в воркере)"""
+    config = uvicorn.Config(app, log_level=log_level, timeout_graceful_shutdown=30)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker(app: FastAPI, sock: socket.socket, log_level: str, index: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # Обработчики сигналов главного процесса воркеру не нужны: их ставит uvicorn
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            if index > 0:
+                # Прогрев и продление keep_alive достаточно одного на сервис
+                from llm_warmup import get_model_warmer
+                get_model_warmer().enabled = False
+            run_worker(app, sock, log_level)
+        except BaseException as e:
+            print(f"❌ Воркер {os.getpid()} завершился с ошибкой: {e}", file=sys.stderr)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(host: str = HOST, port: int = PORT, workers: int = WEB_CONCURRENCY, log_level: str = LOG_LEVEL) -> int:
+    sock = bind_socket(host, port)
+    app = load_app(workers)
+    if workers <= 1:
+        run_worker(app, sock, log_level)
+        return 0
+
+    # Объекты, созданные при импорте, больше не трогает сборщик мусора:
+    # их страницы памяти остаются общими для воркеров после fork
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+    # pid -> (номер воркера, время запуска); перезапущенный воркер сохраняет номер
+    children: Dict[int, Tuple[int, float]] = {}
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        children[spawn_worker(app, sock, log_level, index)] = (index, time.monotonic())
+    print(f"API запущен: http://{host}:{port}, воркеров: {workers} (pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        child = children.pop(pid, None)
+        if stopping or child is None:
+            continue
+        index, started = child
+        print(f"⚠️ Воркер {pid} завершился (код {os.waitstatus_to_exitcode(status)}), перезапуск", file=sys.stderr)
+        if time.monotonic() - started < RESTART_BACKOFF:
+            time.sleep(RESTART_BACKOFF)
+        if not stopping:
+            children[spawn_worker(app, sock, log_level, index)] = (index, time.monotonic())
+
+    sock.close()
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Запуск KPI API с предзагрузкой и несколькими воркерами")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="число воркеров (WEB_CONCURRENCY)")
+    parser.add_argument("--log-level", default=LOG_LEVEL)
+    args = parser.parse_args(argv)
+    return serve(args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Включить Server-Timing для всех ответов (иначе - по заголовку запроса X-Server-Timing: 1)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Каталог снимков метрик процессов (задает serve.py при нескольких воркерах):
+# каждый процесс пишет свой файл, /metrics любого воркера суммирует все файлы
+KPI_METRICS_DIR = os.getenv("KPI_METRICS_DIR", "")
+KPI_METRICS_FLUSH_INTERVAL = float(os.getenv("KPI_METRICS_FLUSH_INTERVAL", "2"))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: list) -> Labels:
+    """Метки из JSON-снимка (списки пар) в ключ словаря значений"""
+    return tuple((key, value) for key, value in labels)
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, snapshots: List[list]) -> Dict[Labels, float]:
+        """Сумма значений из снимков процессов"""
+        values: Dict[Labels, float] = {}
+        for snapshot in snapshots:
+            for labels, value in snapshot:
+                key = _labels_key(labels)
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def render(self, values: Optional[Dict[Labels, float]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Последнее наблюдаемое значение (по всем процессам - самое свежее)"""
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._updated: Dict[Labels, float] = {}
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+            self._updated[key] = time.time()
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), value, self._updated.get(labels, 0.0)] for labels, value in self._values.items()]
+
+    def merge(self, snapshots: List[list]) -> Dict[Labels, float]:
+        latest: Dict[Labels, Tuple[float, float]] = {}
+        for snapshot in snapshots:
+            for labels, value, updated in snapshot:
+                key = _labels_key(labels)
+                if key not in latest or updated > latest[key][0]:
+                    latest[key] = (updated, value)
+        return {key: value for key, (_, value) in latest.items()}
+
+    def render(self, values: Optional[Dict[Labels, float]] = None) -> List[str]:
+        lines = super().render(values)
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Счетчики по корзинам, сумма, количество
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), list(counts), total, count] for labels, (counts, total, count) in self._series.items()]
+
+    def merge(self, snapshots: List[list]) -> Dict[Labels, list]:
+        """Поэлементная сумма корзин, сумм и количеств из снимков процессов"""
+        merged: Dict[Labels, list] = {}
+        for snapshot in snapshots:
+            for labels, counts, total, count in snapshot:
+                series = merged.setdefault(_labels_key(labels), [[0] * len(self.buckets), 0.0, 0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+        return merged
+
+    def render(self, series: Optional[Dict[Labels, list]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        if series is None:
+            with self._lock:
+                series = {labels: [list(counts), total, count] for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+            inf_labels = _format_labels(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("kpi_stage_seconds", "Длительность стадий обработки запроса, с")
+REQUEST_SECONDS = Histogram("kpi_request_seconds", "Длительность HTTP-запросов, с")
+REQUESTS = Counter("kpi_requests_total", "Число HTTP-запросов")
+LLM_REQUESTS = Counter("kpi_llm_requests_total", "Обращения к LLM по результату")
+LLM_FALLBACKS = Counter("kpi_llm_fallbacks_total", "Ответы офлайн-анализом по причинам")
+LLM_PROMPT_TOKENS = Histogram("kpi_llm_prompt_tokens", "Оценка числа токенов промпта",
+                              (250, 500, 1000, 1500, 2000, 4000, 8000, 16000))
+COMMITS_PROCESSED = Counter("kpi_commits_processed_total", "Обработано коммитов")
+COMMITS_SECONDS = Counter("kpi_commits_processing_seconds_total", "Время обработки коммитов, с")
+COMMITS_PER_SECOND = Gauge("kpi_commits_per_second", "Скорость обработки коммитов в последнем расчете")
+RESULT_CACHE = Counter("kpi_result_cache_total", "Обращения к кэшу результатов /predict_kpi по результату")
+LLM_ROUTE_SECONDS = Histogram("kpi_llm_route_seconds", "Длительность генерации LLM по маршрутам и моделям, с")
+LLM_WARMUP_SECONDS = Histogram("kpi_llm_warmup_seconds", "Длительность прогрева моделей LLM по результату, с")
+
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, LLM_REQUESTS, LLM_FALLBACKS, LLM_PROMPT_TOKENS,
+           COMMITS_PROCESSED, COMMITS_SECONDS, COMMITS_PER_SECOND, RESULT_CACHE, LLM_ROUTE_SECONDS,
+           LLM_WARMUP_SECONDS]
+
+# Тайминги текущего запроса для Server-Timing (None - не собираются)
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+_request_start: ContextVar[Optional[float]] = ContextVar("request_start", default=None)
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Замер стадии: в гистограмму kpi_stage_seconds и в Server-Timing запроса"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def mark_parsed():
+    """Вызывается в начале обработчика: время от приема запроса до валидированной модели"""
+    start = _request_start.get()
+    if start is not None:
+        observe_stage("parse", time.perf_counter() - start)
+
+
+def record_commits(count: int, seconds: float):
+    """Учет обработанных коммитов и скорости обработки"""
+    if count <= 0:
+        return
+    COMMITS_PROCESSED.inc(count)
+    COMMITS_SECONDS.inc(seconds)
+    if seconds > 0:
+        COMMITS_PER_SECOND.set(round(count / seconds, 1))
+
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def flush_metrics(directory: str = KPI_METRICS_DIR):
+    """Снимок метрик процесса в его файл каталога (атомарно, через rename)"""
+    if not directory:
+        return
+    path = _snapshot_path(directory, os.getpid())
+    snapshot = {metric.name: metric.snapshot() for metric in METRICS}
+    # Свой временный файл у потока: пишут и фоновый экспорт, и /metrics
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def read_snapshots(directory: str) -> List[dict]:
+    """Снимки всех процессов, включая завершившиеся: счетчики не должны убывать при перезапуске воркера"""
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(directory, "metrics-*.json"))):
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def clear_snapshots(directory: str):
+    """Удаляет снимки прежнего запуска (вызывается до старта воркеров)"""
+    for path in glob.glob(os.path.join(directory, "metrics-*.json*")):
+        os.remove(path)
+
+
+_exporter: Optional[threading.Thread] = None
+_exporter_stop = threading.Event()
+_exporter_lock = threading.Lock()
+
+
+def start_metrics_export(directory: str = KPI_METRICS_DIR, interval: float = KPI_METRICS_FLUSH_INTERVAL):
+    """Фоновая запись снимка метрик процесса раз в interval секунд (в каждом воркере после fork)"""
+    global _exporter
+    if not directory:
+        return
+    with _exporter_lock:
+        if _exporter is not None and _exporter.is_alive():
+            return
+        _exporter_stop.clear()
+
+        def run():
+            while not _exporter_stop.wait(interval):
+                try:
+                    flush_metrics(directory)
+                except OSError as e:
+                    print(f"⚠️ Не удалось записать метрики: {e}")
+
+        _exporter = threading.Thread(target=run, name="metrics-export", daemon=True)
+        _exporter.start()
+
+
+def stop_metrics_export(directory: str = KPI_METRICS_DIR):
+    """Останавливает запись и сохраняет последний снимок"""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is not None:
+            _exporter_stop.set()
+            _exporter.join()
+            _exporter = None
+    if directory:
+        flush_metrics(directory)
+
+
+def render_metrics(directory: str = KPI_METRICS_DIR) -> str:
+    """
+    Все метрики в текстовом формате Prometheus. С каталогом снимков - сумма
+    по всем процессам сервиса (свой снимок обновляется перед чтением, чужие
+    отстают не больше чем на KPI_METRICS_FLUSH_INTERVAL).
+    """
+    lines = []
+    if not directory:
+        for metric in METRICS:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    flush_metrics(directory)
+    snapshots = read_snapshots(directory)
+    for metric in METRICS:
+        lines.extend(metric.render(metric.merge([snapshot.get(metric.name, []) for snapshot in snapshots])))
+    return "\n".join(lines) + "\n"
+
+
+def format_server_timing(timings: List[Tuple[str, float]]) -> str:
+    # Повторяющиеся стадии суммируются
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+def route_template(scope) -> str:
+    """
+    Шаблон маршрута запроса. FastAPI кладет маршрут в scope["route"];
+    у маршрутов Starlette (/docs, /openapi.json) есть только endpoint.
+    """
+    route = scope.get("route")
+    if route is None and "endpoint" in scope and "app" in scope:
+        route = next((r for r in getattr(scope["app"], "routes", [])
+                      if getattr(r, "endpoint", None) is scope["endpoint"]), None)
+    return getattr(route, "path", None) or "unmatched"
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: длительность запросов по маршрутам и, если включено
+    (SERVER_TIMING=1 или заголовок X-Server-Timing: 1), заголовок Server-Timing
+    со стадиями текущего запроса.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        enabled = SERVER_TIMING or (b"x-server-timing", b"1") in scope.get("headers", [])
+        timings = [] if enabled else None
+        timings_token = _request_timings.set(timings)
+        start_token = _request_start.set(start)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if timings is not None:
+                    timings.append(("total", time.perf_counter() - start))
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", format_server_timing(timings).encode()))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Метка - шаблон маршрута (/analyze_kpi/jobs/{job_id}), а не сырой
+            # путь: иначе каждый ID и случайный URL создает новый ряд метрик
+            path = route_template(scope)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+            REQUESTS.inc(path=path, status=str(status["code"]))
+            _request_timings.reset(timings_token)
+            _request_start.reset(start_token)
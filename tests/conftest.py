@@ -0,0 +1,24 @@
+# Общая настройка тестов: базы SQLite во временном каталоге, без прогрева
+# моделей и без обращений к настоящему Ollama. Переменные задаются до импорта
+# модулей сервиса - настройки читаются при импорте.
+import os
+import tempfile
+
+import pytest
+
+_DATA_DIR = tempfile.mkdtemp(prefix="kpi-tests-")
+os.environ.setdefault("LLM_CACHE_DB", os.path.join(_DATA_DIR, "llm_cache.sqlite3"))
+os.environ.setdefault("KPI_STATE_DB", os.path.join(_DATA_DIR, "kpi_state.sqlite3"))
+os.environ.setdefault("ANALYSIS_JOBS_DB", os.path.join(_DATA_DIR, "analysis_jobs.sqlite3"))
+os.environ["LLM_WARMUP"] = "0"
+os.environ["KPI_METRICS_DIR"] = ""
+os.environ.setdefault("OLLAMA_HOST", "http://127.0.0.1:9")
+
+
+@pytest.fixture
+def client():
+    """TestClient API без lifespan (очередь задач и прогрев не запускаются)"""
+    from fastapi.testclient import TestClient
+
+    from api import app
+    return TestClient(app)
@@ -0,0 +1,185 @@
+# Фоновые задачи анализа: аренда задачи процессом, возврат в очередь задач
+# остановленного или упавшего процесса, повтор callback с паузами и отправка
+# callback, не занимающая обработчик очереди.
+# Запуск из корня репозитория: python -m pytest -q tests
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import analysis_jobs
+from analysis_jobs import AnalysisJobQueue, JobStore
+
+CALLBACK_URL = "http://localhost/callback"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    async def analyze(data, project, bucket):
+        return f"анализ {project}", "miss"
+
+    monkeypatch.setattr(analysis_jobs, "cached_analyze_async", analyze)
+
+
+@pytest.fixture
+def callbacks(monkeypatch):
+    """Ответы callback-сервера по очереди; запросы и паузы между попытками записываются"""
+    state = {"responses": [], "requests": [], "sleeps": [], "gate": None}
+
+    async def handler(request):
+        state["requests"].append(request)
+        if state["gate"] is not None:
+            await state["gate"].wait()
+        status = state["responses"].pop(0) if state["responses"] else 200
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status)
+
+    client_class = httpx.AsyncClient
+    monkeypatch.setattr(analysis_jobs.httpx, "AsyncClient",
+                        lambda **kwargs: client_class(transport=httpx.MockTransport(handler), **kwargs))
+    sleep = asyncio.sleep
+
+    async def fast_sleep(delay, *args, **kwargs):
+        # Паузы между попытками callback не ждем; остальные (аренда, ожидание в тесте) - как обычно
+        if asyncio.current_task().get_coro().__name__ == "_send_callback":
+            state["sleeps"].append(delay)
+            delay = 0
+        await sleep(delay, *args, **kwargs)
+
+    monkeypatch.setattr(analysis_jobs.asyncio, "sleep", fast_sleep)
+    return state
+
+
+async def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "условие не выполнилось"
+        await asyncio.sleep(0.01)
+
+
+def test_claim_is_exclusive_and_expired_lease_is_requeued(store):
+    job_id = store.create({"team_kpi": 1}, "P", None, None)
+    assert store.claim(job_id, "a", lease=60)["project"] == "P"
+    assert store.claim(job_id, "b", lease=60) is None
+
+    # Аренда действует: другой процесс задачу не подбирает
+    assert store.requeue_expired() == []
+    assert store.requeue_pending() == []
+
+    store.renew("a", lease=-1)
+    assert store.requeue_expired() == [job_id]
+    assert store.claim(job_id, "b", lease=60) is not None
+    assert store.get(job_id)["status"] == "running"
+
+
+def test_release_and_requeue_pending_keep_order(store):
+    first = store.create({}, "P", None, None)
+    second = store.create({}, "P", None, None)
+    store.claim(first, "a", lease=60)
+    store.claim(second, "b", lease=60)
+
+    assert store.release("a") == 1
+    store.renew("b", lease=-1)
+    assert store.requeue_pending() == [first, second]
+
+
+def test_finished_job_drops_payload_and_is_purged(store):
+    job_id = store.create({"team_kpi": 1}, "P", None, None)
+    store.claim(job_id, "a", lease=60)
+    store.finish(job_id, error="ошибка")
+    assert store.get(job_id)["error"] == "ошибка"
+    assert store.purge(time.time() - 3600) == 0
+    assert store.purge(time.time() + 1) == 1
+    assert store.get(job_id) is None
+
+
+def test_queue_runs_jobs_and_requeues_on_stop(store, fake_llm):
+    async def scenario():
+        queue = AnalysisJobQueue(store, workers=1, max_queue=10, lease=60)
+        await queue.start()
+        job_id = await queue.submit({"team_kpi": 1}, project="P")
+        await wait_for(lambda: store.get(job_id)["status"] == "done")
+        job = await queue.get(job_id)
+        assert job["analysis"] == "анализ P" and job["cache"] == "miss"
+        await queue.stop()
+
+        # Задача, прерванная остановкой, подхватывается следующим запуском
+        stuck = store.create({}, "Q", None, None)
+        store.claim(stuck, queue.owner, lease=60)
+        await queue.stop()
+        assert store.get(stuck)["status"] == "queued"
+        await queue.start()
+        await wait_for(lambda: store.get(stuck)["status"] == "done")
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_callback_is_retried_with_backoff(store, fake_llm, callbacks):
+    callbacks["responses"] = [503, httpx.ConnectError("нет соединения"), 200]
+
+    async def scenario():
+        queue = AnalysisJobQueue(store, workers=1, max_queue=10, lease=60)
+        await queue.start()
+        job_id = await queue.submit({}, project="P", callback_url=CALLBACK_URL)
+        await wait_for(lambda: (store.get(job_id).get("callback") or {}).get("status") is not None)
+        await queue.stop()
+        return job_id
+
+    job_id = asyncio.run(scenario())
+    assert store.get(job_id)["callback"]["status"] == "sent:200"
+    assert len(callbacks["requests"]) == 3
+    assert callbacks["sleeps"] == [1, 2]
+
+
+def test_failed_callback_does_not_sleep_after_last_attempt(store, fake_llm, callbacks):
+    callbacks["responses"] = [500, 500, 502]
+
+    async def scenario():
+        queue = AnalysisJobQueue(store, workers=1, max_queue=10, lease=60)
+        await queue.start()
+        job_id = await queue.submit({}, project="P", callback_url=CALLBACK_URL)
+        await wait_for(lambda: (store.get(job_id).get("callback") or {}).get("status") is not None)
+        await queue.stop()
+        return job_id
+
+    job_id = asyncio.run(scenario())
+    assert store.get(job_id)["callback"]["status"] == "failed:502"
+    assert callbacks["sleeps"] == [1, 2]
+
+
+def test_slow_callback_does_not_block_worker(store, fake_llm, callbacks):
+    async def scenario():
+        callbacks["gate"] = asyncio.Event()
+        queue = AnalysisJobQueue(store, workers=1, max_queue=10, lease=60)
+        await queue.start()
+        first = await queue.submit({}, project="P", callback_url=CALLBACK_URL)
+        await wait_for(lambda: len(callbacks["requests"]) == 1)
+        # Callback первой задачи висит, единственный обработчик выполняет вторую
+        second = await queue.submit({}, project="Q")
+        await wait_for(lambda: store.get(second)["status"] == "done")
+        assert store.get(first)["callback"]["status"] is None
+
+        callbacks["gate"].set()
+        await wait_for(lambda: store.get(first)["callback"]["status"] == "sent:200")
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_callback_url_must_be_local(store):
+    async def scenario():
+        queue = AnalysisJobQueue(store, workers=1, max_queue=1, lease=60)
+        await queue.start()
+        with pytest.raises(ValueError):
+            await queue.submit({}, callback_url="http://example.com/hook")
+        await queue.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,204 @@
+# Эквивалентность оптимизированного пути прежней реализации: CommitClassifier
+# (одно скомпилированное выражение + LRU) против последовательных re.search и
+# prepare_metrics_for_analyzer (колоночный расчет) против поштучного подсчета
+# по коммитам, как до оптимизаций. Корпус фиксированный.
+# Запуск из корня репозитория: python -m pytest -q tests
+import re
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+
+from benchmarks.generator import MESSAGE_TEMPLATES, generate_backend_response
+from metric_calculator import calculate_developer_metrics, calculate_individual_kpi, prepare_metrics_for_analyzer
+from preprocess import COMMIT_TYPE_PATTERNS, CommitClassifier, calculate_average_complexity
+
+# Сообщения, на которых легко ошибиться: порядок паттернов, ^ только в начале
+# строки, многострочные сообщения, регистр и пробелы по краям
+EDGE_MESSAGES = [
+    "", " ", "feat: add parser", "FEAT(core): implement cache", "  fix: crash #12  ",
+    "Add tests for login", "add new feature module", "fix the test",
+    "Merge branch 'fix: login'", "update docs\nfix: crash", "docs: fix typo", "test: fix flaky test",
+    "refactor: fix naming", "cleanup: remove dead code", "Optimize query performance", "improve code",
+    "readme", "changelog: 1.2", "resolved issue #42", "patch(ui): button", "new functionality for api",
+    "implements shard module", "coverage: add tests", "spec: search parser", "WIP", "Bump lodash from 1.2 to 1.3",
+    "fix(ui):", "feature(x)y: z", "issue", "documentation\nand more", "add\nfeature", "error handling in api",
+    "Revert \"feat: add parser\"", "рефакторинг: переименование", "fix: исправлена ошибка",
+]
+
+DATE_FORMATS = ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"]
+COMPLEXITY_FACTORS = {"feature": 1.5, "refactor": 1.8, "fix": 1.3, "test": 1.1, "docs": 0.8, "other": 1.0}
+COMPLEX_KEYWORDS = ["architecture", "refactor", "performance", "optimize",
+                    "security", "migration", "integration", "database"]
+RELEASE_BRANCHES = ["main", "master", "release", "prod", "stable"]
+RATIO_TYPES = ["feature", "fix", "refactor", "test", "docs"]
+
+
+# --- эталон: прежняя поштучная реализация ---
+def reference_classify(message: str) -> str:
+    if not message:
+        return "other"
+    msg = message.lower().strip()
+    for commit_type, regex_list in COMMIT_TYPE_PATTERNS.items():
+        for pattern in regex_list:
+            if re.search(pattern, msg):
+                return commit_type
+    return "other"
+
+
+def reference_complexity(commit: dict) -> float:
+    complexity = 1.0
+    message = commit.get("message", "").lower()
+    branches = commit.get("branches", [])
+    complexity *= COMPLEXITY_FACTORS[reference_classify(message)]
+    if any(keyword in message for keyword in COMPLEX_KEYWORDS):
+        complexity *= 1.4
+    if any(branch in str(branches).lower() for branch in RELEASE_BRANCHES):
+        complexity *= 1.3
+    if "#" in message:
+        complexity *= 1.2
+    return min(complexity, 3.0)
+
+
+def reference_date(date_str):
+    if not date_str:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def reference_kpi(types: dict, total: int) -> float:
+    ratios = {t: types[t] / total for t in RATIO_TYPES}
+    return (ratios["feature"] * 40 + (1 - ratios["fix"]) * 20 + ratios["refactor"] * 15 +
+            ratios["test"] * 15 + ratios["docs"] * 10)
+
+
+def reference_metrics(commits: list) -> dict:
+    authors = defaultdict(list)
+    for commit in commits:
+        authors[commit.get("author", {}).get("name", "Unknown")].append(commit)
+
+    team_types = defaultdict(int)
+    team_days = set()
+    for commit in commits:
+        team_types[reference_classify(commit.get("message", ""))] += 1
+        dt = reference_date(commit.get("createdAt"))
+        if dt:
+            team_days.add(dt.date())
+    total = len(commits)
+
+    counts = sorted((len(c) for c in authors.values()), reverse=True)
+    bus_factor, covered = 0, 0
+    for count in counts:
+        covered += count
+        bus_factor += 1
+        if covered >= total * 0.5:
+            break
+
+    team_metrics = {
+        "commits_total": total,
+        "merge_conflicts": sum(len(c.get("parents", [])) > 1 for c in commits),
+        "bus_factor": bus_factor,
+        **{f"{t}_commits": team_types[t] for t in RATIO_TYPES},
+        **{f"{t}_ratio": team_types[t] / total for t in RATIO_TYPES},
+        "active_days": len(team_days),
+        "team_size": len(authors),
+        "avg_commits_per_dev": total / len(authors),
+        "avg_complexity": sum(reference_complexity(c) for c in commits) / total
+    }
+
+    developers = {}
+    for author, author_commits in authors.items():
+        types = defaultdict(int)
+        days = set()
+        for commit in author_commits:
+            types[reference_classify(commit.get("message", ""))] += 1
+            dt = reference_date(commit.get("createdAt"))
+            if dt:
+                days.add(dt.date())
+        n = len(author_commits)
+        developers[author] = {
+            "kpi": min(max(reference_kpi(types, n), 0), 100),
+            "metrics": {**{f"{t}_ratio": types[t] / n for t in RATIO_TYPES},
+                        "total_commits": n, "active_days": len(days)}
+        }
+    return {"team_kpi": reference_kpi(team_types, total), "team_metrics": team_metrics, "developers": developers}
+
+
+def template_messages() -> list:
+    """Все шаблоны генератора с подставленными значениями"""
+    return [template.format(thing="parser", area="core", issue=7, next=8)
+            for templates in MESSAGE_TEMPLATES.values() for template in templates]
+
+
+def corpus_payload() -> dict:
+    """Сгенерированные коммиты плюс сообщения, ветки и даты на границах"""
+    payload = generate_backend_response(3000, 25, seed=7, bot_share=0.05)
+    edge_dates = ["2024-02-29T23:59:59.999Z", "2024-03-01 00:00:00", "2024-03-02T12:00:00", "not a date", None]
+    edge_branches = [[], None, ["develop"], ["Release/1.0"], ["feature/main-menu"], ["hotfix"]]
+    for i, message in enumerate(EDGE_MESSAGES + template_messages()):
+        payload["commits"].append({
+            "hash": f"edge{i:04d}",
+            "message": message,
+            "author": {"name": f"Edge {i % 4}", "email": f"edge{i % 4}@example.com"},
+            "createdAt": edge_dates[i % len(edge_dates)],
+            "parents": ["a", "b"] if i % 5 == 0 else ["a"],
+            "branches": edge_branches[i % len(edge_branches)]
+        })
+    return payload
+
+
+@pytest.mark.parametrize("message", EDGE_MESSAGES + template_messages())
+def test_classify_matches_sequential_search(message):
+    assert CommitClassifier().classify(message) == reference_classify(message)
+
+
+def test_classify_many_and_cache_match_reference():
+    classifier = CommitClassifier(cache_size=8)
+    messages = [commit["message"] for commit in corpus_payload()["commits"]]
+    expected = [reference_classify(message) for message in messages]
+    # Второй проход идет через LRU (и вытеснение при маленьком кэше)
+    assert classifier.classify_many(messages) == expected
+    assert classifier.classify_many(messages) == expected
+    assert classifier.cache_info().hits > 0
+
+
+def test_prepare_metrics_matches_reference():
+    payload = corpus_payload()
+    result = prepare_metrics_for_analyzer(payload)
+    expected = reference_metrics(payload["commits"])
+
+    assert result["team_kpi"] == pytest.approx(round(expected["team_kpi"], 2), abs=1e-9)
+    for key, value in expected["team_metrics"].items():
+        assert result["team_metrics"][key] == pytest.approx(value, rel=1e-12), key
+
+    assert list(result["developers"]) == list(expected["developers"])
+    for author, developer in expected["developers"].items():
+        actual = result["developers"][author]
+        assert actual["kpi"] == pytest.approx(round(developer["kpi"], 2), abs=1e-9), author
+        for key, value in developer["metrics"].items():
+            assert actual["metrics"][key] == pytest.approx(value, rel=1e-12), (author, key)
+
+
+def test_per_developer_helpers_match_reference():
+    commits = corpus_payload()["commits"]
+    expected = reference_metrics(commits)
+    by_author = defaultdict(list)
+    for commit in commits:
+        by_author[commit["author"]["name"]].append(commit)
+
+    assert calculate_average_complexity(commits) == pytest.approx(
+        expected["team_metrics"]["avg_complexity"], rel=1e-12)
+    assert calculate_average_complexity([]) == 1.0
+    assert calculate_individual_kpi([]) == 0.0
+    assert calculate_developer_metrics([])["total_commits"] == 0
+    for author, author_commits in by_author.items():
+        developer = expected["developers"][author]
+        assert calculate_individual_kpi(author_commits) == pytest.approx(round(developer["kpi"], 2), abs=1e-9)
+        metrics = calculate_developer_metrics(author_commits)
+        for key, value in developer["metrics"].items():
+            assert metrics[key] == pytest.approx(value, rel=1e-12), (author, key)
@@ -0,0 +1,98 @@
+# Дедупликация коммитов по hash: один коммит из нескольких репозиториев
+# (форки, зеркала) или веток учитывается один раз с объединенными ветками,
+# статистика dedup одинакова в /predict_kpi, потоковом накопителе и API;
+# sketch дедуплицирует только внутри пачки.
+# Запуск из корня репозитория: python -m pytest -q tests
+import copy
+
+import orjson
+import pytest
+
+from benchmarks.generator import generate_backend_response
+from metric_accumulator import MetricAccumulator
+from metric_calculator import prepare_metrics_for_analyzer
+from metric_sketch import SketchAccumulator
+from preprocess import deduplicate_commits
+
+
+def payload() -> dict:
+    return generate_backend_response(800, 6, seed=13)
+
+
+def with_fork(data: dict, count: int) -> dict:
+    """Проект из двух репозиториев: форк повторяет первые count коммитов"""
+    project = {key: value for key, value in data.items() if key != "commits"}
+    fork = copy.deepcopy(data["commits"][:count])
+    project["repos"] = [{"name": "main", "commits": data["commits"]}, {"name": "fork", "commits": fork}]
+    return project
+
+
+def test_without_duplicates_list_is_not_copied():
+    commits = payload()["commits"]
+    unique, stats = deduplicate_commits(commits)
+    assert unique is commits
+    assert stats == {"commits_received": len(commits), "duplicates_removed": 0}
+
+
+def test_duplicates_merge_branches_without_modifying_input():
+    commit = {"hash": "abc", "message": "fix: x", "branches": ["develop"]}
+    duplicate = {"hash": "abc", "message": "fix: x", "branches": ["release/1.0", "develop"]}
+    no_hash = [{"message": "docs: y"}, {"message": "docs: y"}]
+
+    unique, stats = deduplicate_commits([commit, duplicate, *no_hash])
+    assert stats == {"commits_received": 4, "duplicates_removed": 1}
+    assert [c.get("hash") for c in unique] == ["abc", None, None]
+    assert unique[0]["branches"] == ["develop", "release/1.0"]
+    assert commit["branches"] == ["develop"]
+
+
+def test_fork_is_counted_once():
+    data = payload()
+    result = prepare_metrics_for_analyzer(with_fork(data, 300))
+    expected = prepare_metrics_for_analyzer(data)
+
+    assert result["dedup"] == {"commits_received": 1100, "duplicates_removed": 300}
+    assert result["team_metrics"] == expected["team_metrics"]
+    assert result["developers"] == expected["developers"]
+
+
+def test_accumulator_dedups_across_batches():
+    data = payload()
+    commits = data["commits"]
+    accumulator = MetricAccumulator()
+    accumulator.add_many(commits[:500])
+    # Повторы внутри пачки и из прошлой пачки
+    accumulator.add_many(commits[400:] + commits[700:])
+
+    result = accumulator.result()
+    expected = prepare_metrics_for_analyzer(data)
+    assert result["dedup"] == {"commits_received": 1000, "duplicates_removed": 200}
+    assert result["team_kpi"] == expected["team_kpi"]
+    assert result["team_metrics"] == pytest.approx(expected["team_metrics"], rel=1e-12)
+    assert result["developers"] == expected["developers"]
+
+
+def test_sketch_dedups_within_batch_only():
+    commits = payload()["commits"]
+    sketch = SketchAccumulator(top_k=10, precision=10)
+    sketch.add_many(commits[:500] + commits[:100])
+    sketch.add_many(commits[400:])
+
+    result = sketch.result()
+    assert result["sketch"]["dedup_scope"] == "batch"
+    assert result["dedup"] == {"commits_received": 1000, "duplicates_removed": 100}
+    assert result["team_metrics"]["commits_total"] == 900
+
+
+def test_api_reports_same_dedup(client):
+    data = payload()
+    data["commits"] += copy.deepcopy(data["commits"][:50])
+    predict = client.post("/predict_kpi", json=data).json()["data"]
+
+    body = b"\n".join(orjson.dumps(commit) for commit in data["commits"])
+    stream = client.post("/predict_kpi/stream", content=body,
+                         headers={"Content-Type": "application/x-ndjson"}).json()["data"]
+
+    assert predict["dedup"] == stream["dedup"] == {"commits_received": 850, "duplicates_removed": 50}
+    assert stream["team_kpi"] == predict["team_kpi"]
+    assert stream["developers"] == predict["developers"]
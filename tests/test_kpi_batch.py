@@ -0,0 +1,61 @@
+# Изоляция падений в /predict_kpi/batch: процесс-воркер, упавший на проекте,
+# не роняет процесс API, проект помечается ошибкой, остальные проекты
+# отправляются в новый пул заново и считаются как обычно.
+# Запуск из корня репозитория: python -m pytest -q tests
+import os
+
+import pytest
+
+import kpi_batch
+from benchmarks.generator import generate_backend_response
+from metric_calculator import prepare_metrics_for_analyzer
+
+
+class CrashOnUnpickle:
+    """Завершает процесс при распаковке - то есть в процессе-воркере пула"""
+
+    def __reduce__(self):
+        return os._exit, (3,)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(kpi_batch, "DEFAULT_WORKERS", 2)
+    kpi_batch.shutdown_pool()
+    yield
+    kpi_batch.shutdown_pool()
+
+
+def payloads(count: int) -> list:
+    return [generate_backend_response(200, 5, seed=i) for i in range(count)]
+
+
+def test_single_payload_runs_in_pool(pool):
+    # При расчете в процессе API os._exit завершил бы и pytest
+    payload = payloads(1)[0]
+    payload["crash"] = CrashOnUnpickle()
+    items = kpi_batch.predict_kpi_batch([payload], workers=1)
+
+    assert len(items) == 1
+    assert items[0]["success"] is False
+    assert items[0]["error"].startswith("BrokenProcessPool")
+    assert items[0]["index"] == 0
+
+
+def test_crash_is_isolated_and_rest_resubmitted(pool):
+    batch = payloads(5)
+    expected = [prepare_metrics_for_analyzer(payload) for payload in batch]
+    batch[2]["crash"] = CrashOnUnpickle()
+
+    items = kpi_batch.predict_kpi_batch(batch, workers=2)
+
+    assert [item["index"] for item in items] == list(range(5))
+    assert items[2]["success"] is False
+    assert items[2]["error"].startswith("BrokenProcessPool")
+    for index in (0, 1, 3, 4):
+        assert items[index]["success"] is True, items[index]
+        assert items[index]["data"] == expected[index]
+
+    # Пул пересоздан и снова работает
+    again = kpi_batch.predict_kpi_batch(batch[:2], workers=2)
+    assert [item["data"] for item in again] == expected[:2]
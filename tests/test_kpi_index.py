@@ -0,0 +1,88 @@
+# KPI по дневному индексу: интервал дат и последнее скользящее окно совпадают
+# с /predict_kpi по коммитам этого интервала; история и ряды окон сверх
+# лимитов отклоняются (400) до выделения памяти и расчета.
+# Запуск из корня репозитория: python -m pytest -q tests
+from datetime import date, timedelta
+
+import pytest
+
+import kpi_index
+from benchmarks.generator import generate_backend_response
+from kpi_index import WindowLimitError, build_daily_index, calculate_range_kpi, calculate_rolling_kpi
+from metric_calculator import prepare_metrics_for_analyzer
+
+
+def payload() -> dict:
+    return generate_backend_response(1500, 8, seed=4)
+
+
+def commits_between(data: dict, start: date, end: date) -> dict:
+    commits = [c for c in data["commits"] if start.isoformat() <= c["createdAt"][:10] <= end.isoformat()]
+    return {**data, "commits": commits}
+
+
+def assert_same_kpi(result: dict, expected: dict):
+    assert result["team_kpi"] == expected["team_kpi"]
+    # Сложность суммируется в другом порядке
+    assert result["team_metrics"] == pytest.approx(expected["team_metrics"], rel=1e-12)
+    assert result["developers"] == expected["developers"]
+
+
+@pytest.mark.parametrize("start, end", [(None, None), (date(2024, 2, 1), date(2024, 2, 29)),
+                                        (date(2024, 12, 25), date(2025, 1, 10))])
+def test_range_matches_full_calculation(start, end):
+    data = payload()
+    expected_data = data if start is None else commits_between(data, start, end)
+    result = calculate_range_kpi(build_daily_index(data), start, end)
+    assert_same_kpi(result, prepare_metrics_for_analyzer(expected_data))
+
+
+def test_last_rolling_window_matches_range():
+    index = build_daily_index(payload())
+    rolling = calculate_rolling_kpi(index, 30, step=7)
+    end = date.fromisoformat(rolling["dates"][-1])
+    window = calculate_range_kpi(index, end - timedelta(days=29), end)
+
+    assert rolling["team_kpi"][-1] == window["team_kpi"]
+    assert rolling["commits"][-1] == window["team_metrics"]["commits_total"]
+    for author, kpi in window["developers"].items():
+        assert rolling["developers"][author][-1] == kpi["kpi"]
+
+
+def test_api_range_matches_predict_kpi(client):
+    data = payload()
+    windows = client.post("/predict_kpi/windows", json=data,
+                          params={"range": "2024-03-01..2024-03-31", "windows": "30"})
+    assert windows.status_code == 200
+    expected = client.post("/predict_kpi", json=commits_between(data, date(2024, 3, 1), date(2024, 3, 31)))
+
+    result = windows.json()["data"]["ranges"][0]
+    expected_data = expected.json()["data"]
+    assert result["team_kpi"] == expected_data["team_kpi"]
+    assert result["developers"] == expected_data["developers"]
+
+
+def test_long_history_is_rejected_before_allocation(client):
+    data = payload()
+    data["commits"][0]["createdAt"] = "1900-01-01T00:00:00Z"
+    with pytest.raises(WindowLimitError):
+        build_daily_index(data)
+
+    response = client.post("/predict_kpi/windows", json=data)
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Превышены лимиты окон")
+
+
+@pytest.mark.parametrize("limit, params", [
+    ("KPI_MAX_ROLLING_WINDOWS", {"windows": "7,30", "step": 1}),
+    ("KPI_MAX_ROLLING_VALUES", {"windows": "30", "step": 1}),
+])
+def test_rolling_limits(client, monkeypatch, limit, params):
+    monkeypatch.setattr(kpi_index, limit, 300)
+    response = client.post("/predict_kpi/windows", json=payload(), params=params)
+    assert response.status_code == 400
+
+    # since и developers=false укладывают ряды в лимит
+    response = client.post("/predict_kpi/windows", json=payload(),
+                           params={**params, "since": "2024-10-01", "developers": False})
+    assert response.status_code == 200
@@ -0,0 +1,84 @@
+# Инкрементальное состояние /predict_kpi/delta: сумма дельт равна полному
+# расчету, повторно присланные хэши не учитываются дважды, rebuild строит
+# состояние заново, без project.key или repository.name - ошибка (400 в API).
+# Запуск из корня репозитория: python -m pytest -q tests
+import pytest
+
+from benchmarks.generator import generate_backend_response
+from kpi_state import KPIStateStore
+from metric_calculator import prepare_metrics_for_analyzer
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = KPIStateStore(str(tmp_path / "state.sqlite3"))
+    yield store
+    store.close()
+
+
+def payload() -> dict:
+    return generate_backend_response(600, 8, seed=5)
+
+
+def assert_same_kpi(result: dict, expected: dict):
+    assert result["team_kpi"] == expected["team_kpi"]
+    assert result["team_metrics"] == pytest.approx(expected["team_metrics"], rel=1e-12)
+    assert result["developers"] == expected["developers"]
+
+
+def test_deltas_sum_to_full_calculation(store):
+    data = payload()
+    commits = data["commits"]
+    for part in (commits[:200], commits[200:450], commits[450:]):
+        result, stats = store.apply("P", "repo", part)
+        assert stats["new"] == len(part)
+
+    assert_same_kpi(result, prepare_metrics_for_analyzer(data))
+
+
+def test_seen_hashes_are_skipped(store):
+    commits = payload()["commits"]
+    first, _ = store.apply("P", "repo", commits[:400])
+
+    # Повтор уже учтенных коммитов вместе с новыми: учитываются только новые
+    again, stats = store.apply("P", "repo", commits[:400])
+    assert stats == {"received": 400, "new": 0, "duplicates": 400, "rebuild": False}
+    assert again == first
+
+    _, stats = store.apply("P", "repo", commits[300:])
+    assert stats["new"] == len(commits) - 400
+    assert stats["duplicates"] == 100
+
+
+def test_repositories_are_independent(store):
+    commits = payload()["commits"]
+    store.apply("P", "repo", commits)
+    _, stats = store.apply("P", "fork", commits[:10])
+    assert stats["new"] == 10
+
+
+def test_rebuild_replaces_state(store):
+    data = payload()
+    store.apply("P", "repo", data["commits"])
+
+    subset = {**data, "commits": data["commits"][:250]}
+    result, stats = store.apply("P", "repo", subset["commits"], rebuild=True)
+
+    assert stats["rebuild"] is True
+    assert stats["new"] == 250
+    assert_same_kpi(result, prepare_metrics_for_analyzer(subset))
+
+
+@pytest.mark.parametrize("project_key, repo_name", [(None, "repo"), ("P", None), ("", "repo")])
+def test_missing_key_is_rejected(store, project_key, repo_name):
+    with pytest.raises(ValueError):
+        store.apply(project_key, repo_name, payload()["commits"][:5])
+
+
+def test_api_missing_key_is_400(client):
+    data = payload()
+    data["commits"] = data["commits"][:5]
+    data["repository"]["name"] = None
+
+    response = client.post("/predict_kpi/delta", json=data)
+    assert response.status_code == 400
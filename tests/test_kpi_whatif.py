@@ -0,0 +1,88 @@
+# What-if по схемам весов: схема с весами по умолчанию (пустая или явная)
+# дает ровно KPI и порядок /predict_kpi, rank_change для нее нулевой, другие
+# веса совпадают со скалярной формулой KPI.
+# Запуск из корня репозитория: python -m pytest -q tests
+import numpy as np
+import pytest
+
+from benchmarks.generator import generate_backend_response
+from kpi_whatif import counts_from_result, rank_weight_sets
+from metric_calculator import DEFAULT_KPI_WEIGHTS, prepare_metrics_for_analyzer
+from preprocess import COMMIT_TYPES
+
+CUSTOM = {"feature": 10, "fix": 50, "test": 30}
+
+
+@pytest.fixture(scope="module")
+def kpi_data() -> dict:
+    return prepare_metrics_for_analyzer(generate_backend_response(3000, 40, seed=17))
+
+
+def expected_order(developers: dict) -> list:
+    """Порядок таблицы: по убыванию KPI, при равенстве - порядок авторов"""
+    names = list(developers)
+    return sorted(names, key=lambda name: (-developers[name]["kpi"], names.index(name)))
+
+
+def scalar_kpi(counts: np.ndarray, weights: dict) -> float:
+    w = {**DEFAULT_KPI_WEIGHTS, **weights}
+    ratios = {t: counts[COMMIT_TYPES.index(t)] / max(counts.sum(), 1) for t in w}
+    score = (ratios["feature"] * w["feature"] + (1 - ratios["fix"]) * w["fix"] + ratios["refactor"] * w["refactor"]
+             + ratios["test"] * w["test"] + ratios["docs"] * w["docs"])
+    return round(min(max(score, 0), 100), 2)
+
+
+def test_default_scheme_equals_predict_kpi(client):
+    predicted = client.post("/predict_kpi", json=generate_backend_response(3000, 40, seed=17)).json()["data"]
+    response = client.post("/predict_kpi/what_if", json={
+        "kpi": predicted,
+        "schemes": [{"name": "default"}, {"name": "explicit", "weights": DEFAULT_KPI_WEIGHTS},
+                    {"name": "custom", "weights": CUSTOM}]
+    })
+    assert response.status_code == 200
+    default, explicit, custom = response.json()["schemes"]
+    developers = predicted["developers"]
+
+    for table in (default, explicit):
+        assert table["team_kpi"] == predicted["team_kpi"]
+        assert table["developers"] == expected_order(developers)
+        assert table["kpi"] == [developers[name]["kpi"] for name in table["developers"]]
+        assert set(table["rank_change"]) == {0}
+    assert custom["kpi"] != default["kpi"]
+
+
+def test_counts_without_baseline_match_predict_kpi(kpi_data):
+    authors, type_counts, team_counts = counts_from_result(kpi_data)
+    default, = rank_weight_sets(authors, type_counts, team_counts, [{"weights": {}}])
+
+    assert default["team_kpi"] == kpi_data["team_kpi"]
+    assert default["developers"] == expected_order(kpi_data["developers"])
+    assert default["kpi"] == [kpi_data["developers"][name]["kpi"] for name in default["developers"]]
+
+
+def test_custom_weights_match_scalar_formula(kpi_data):
+    authors, type_counts, team_counts = counts_from_result(kpi_data)
+    default, custom = rank_weight_sets(authors, type_counts, team_counts, [{}, {"weights": CUSTOM}])
+
+    expected = {name: scalar_kpi(counts, CUSTOM) for name, counts in zip(authors, type_counts)}
+    for name, value in zip(custom["developers"], custom["kpi"]):
+        assert value == pytest.approx(expected[name], abs=0.011), name
+    assert custom["team_kpi"] == pytest.approx(scalar_kpi(team_counts, CUSTOM), abs=0.011)
+
+    # rank_change - сдвиг места относительно весов по умолчанию
+    default_rank = {name: i for i, name in enumerate(default["developers"])}
+    for i, (name, change) in enumerate(zip(custom["developers"], custom["rank_change"])):
+        assert change == default_rank[name] - i
+
+
+def test_top_limits_tables(kpi_data):
+    authors, type_counts, team_counts = counts_from_result(kpi_data)
+    table, = rank_weight_sets(authors, type_counts, team_counts, [{"weights": CUSTOM}], top=5)
+    assert len(table["developers"]) == len(table["kpi"]) == len(table["rank_change"]) == 5
+
+
+@pytest.mark.parametrize("schemes", [[], [{"weights": {"unknown": 1}}], [{"weights": {"fix": float("inf")}}]])
+def test_invalid_schemes(kpi_data, schemes):
+    authors, type_counts, team_counts = counts_from_result(kpi_data)
+    with pytest.raises(ValueError):
+        rank_weight_sets(authors, type_counts, team_counts, schemes)
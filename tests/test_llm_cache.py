@@ -0,0 +1,86 @@
+# Кэш LLM-анализа: округление KPI и счетчиков (небольшое изменение данных
+# дает тот же промпт), сброс кэша в одном процессе очищает память других
+# экземпляров через поколение в SQLite, вытеснение по размеру и TTL.
+# Запуск из корня репозитория: python -m pytest -q tests
+import asyncio
+
+import pytest
+
+import llm_cache
+from benchmarks.generator import generate_backend_response
+from llm_cache import AnalysisCache, _round_count, bucket_kpi_data
+from metric_calculator import prepare_metrics_for_analyzer
+from metrics_analyzer import build_analysis_prompt
+
+
+@pytest.mark.parametrize("value, step, expected", [
+    (7, 5, 7), (19, 5, 19), (104, 5, 105), (1234, 5, 1250), (1249, 5, 1250), (1274, 5, 1250), (0, 5, 0)
+])
+def test_round_count(value, step, expected):
+    assert _round_count(value, step) == expected
+
+
+def test_bucket_zero_keeps_data():
+    data = prepare_metrics_for_analyzer(generate_backend_response(100, 4, seed=1))
+    assert bucket_kpi_data(data, 0) is data
+
+
+def test_extra_commit_gives_same_prompt():
+    payload = generate_backend_response(2000, 6, seed=21)
+    before = prepare_metrics_for_analyzer(payload)
+    extra = dict(payload["commits"][0], hash="extra0001")
+    payload["commits"].append(extra)
+    after = prepare_metrics_for_analyzer(payload)
+    assert after["team_metrics"]["commits_total"] == before["team_metrics"]["commits_total"] + 1
+
+    assert build_analysis_prompt(before, bucket=5)[0] == build_analysis_prompt(after, bucket=5)[0]
+    assert build_analysis_prompt(before, bucket=0)[0] != build_analysis_prompt(after, bucket=0)[0]
+
+
+def test_bucket_does_not_modify_input():
+    data = prepare_metrics_for_analyzer(generate_backend_response(500, 4, seed=2))
+    total = data["team_metrics"]["commits_total"]
+    bucket_kpi_data(data, 5)
+    assert data["team_metrics"]["commits_total"] == total
+
+
+def test_invalidate_clears_memory_of_other_instance(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = AnalysisCache(path), AnalysisCache(path)
+    first.put("a", "анализ A", project="P")
+    first.put("b", "анализ B", project="Q")
+    assert second.get("a") == "анализ A"
+    assert second.get("b") == "анализ B"
+
+    assert first.invalidate("P") == 1
+    # get перечитывает поколение на каждом вызове
+    assert second.get("a") is None
+    assert second.get("b") == "анализ B"
+
+    first.invalidate()
+    # aget отдает память без диска только в пределах GENERATION_INTERVAL
+    monkeypatch.setattr(llm_cache, "GENERATION_INTERVAL", 0.0)
+    assert asyncio.run(second.aget("b")) is None
+
+
+def test_aget_serves_memory_and_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = AnalysisCache(path)
+    cache.put("a", "анализ")
+    assert asyncio.run(cache.aget("a")) == "анализ"
+    assert asyncio.run(AnalysisCache(path).aget("a")) == "анализ"
+    assert asyncio.run(cache.aget("missing")) is None
+
+
+def test_expired_and_evicted_entries(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite3"), max_bytes=10, memory_items=1)
+    cache.put("a", "12345")
+    cache.put("b", "12345")
+    cache.put("c", "12345")
+    # На диске помещаются две записи, в памяти - одна
+    assert cache.get("a") is None
+    assert cache.get("b") == cache.get("c") == "12345"
+
+    expired = AnalysisCache(str(tmp_path / "ttl.sqlite3"), ttl=-1)
+    expired.put("a", "12345")
+    assert expired.get("a") is None
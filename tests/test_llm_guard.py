@@ -0,0 +1,130 @@
+# Допуск запросов к LLM: переходы размыкателя closed -> open -> half_open,
+# одна проба в half_open, освобождение пробы при отмене ожидания слота или
+# генерации, отказы по очереди и объединение одинаковых запросов.
+# Запуск из корня репозитория: python -m pytest -q tests
+import asyncio
+
+import pytest
+
+from llm_guard import CircuitBreaker, LLMGuard
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record(False)
+    return breaker
+
+
+def fallback(reason):
+    return reason, False
+
+
+def test_breaker_transitions():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record(False)
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    breaker.reset_timeout = 0
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Одна проба за раз
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_cancel_probe_allows_next_probe():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.cancel_probe()
+    assert breaker.allow()
+
+
+def test_cancelled_wait_releases_probe():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        guard = LLMGuard(max_in_flight=1, max_queue=4, queue_timeout=30, breaker=breaker)
+        assert await guard.acquire() is None
+        # Слот занят, цепь разомкнулась: следующий запрос - проба, ждущая слот
+        breaker.record(False)
+        waiter = asyncio.create_task(guard.acquire())
+        await asyncio.sleep(0)
+        assert guard.snapshot()["waiting"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert guard.snapshot()["waiting"] == 0
+        assert guard.breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_generation_is_neutral():
+    async def scenario():
+        guard = LLMGuard(max_in_flight=1, max_queue=1, queue_timeout=30, breaker=half_open_breaker())
+        started = asyncio.Event()
+
+        async def generate():
+            started.set()
+            await asyncio.sleep(60)
+            return "llm", True
+
+        task = asyncio.create_task(guard.run("k", generate, fallback))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        snapshot = guard.snapshot()
+        assert snapshot["in_flight"] == 0 and snapshot["coalescing"] == 0
+        assert snapshot["circuit"] == "half_open"
+        # Проба не засчитана ни успехом, ни отказом и доступна снова
+        assert await guard.run("k", lambda: asyncio.sleep(0, ("llm", True)), fallback) == ("llm", True)
+        assert guard.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_open_circuit_and_queue_limits():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record(False)
+        guard = LLMGuard(breaker=breaker)
+        assert await guard.run("k", lambda: asyncio.sleep(0, ("llm", True)), fallback) == ("circuit_open", False)
+
+        guard = LLMGuard(max_in_flight=1, max_queue=0, queue_timeout=30)
+        assert await guard.acquire() is None
+        assert await guard.acquire() == "queue_full"
+
+        guard = LLMGuard(max_in_flight=1, max_queue=1, queue_timeout=0.01)
+        assert await guard.acquire() is None
+        assert await guard.acquire() == "queue_timeout"
+
+    asyncio.run(scenario())
+
+
+def test_same_key_is_coalesced():
+    async def scenario():
+        guard = LLMGuard(max_in_flight=2, max_queue=2, queue_timeout=30)
+        calls = 0
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "llm", True
+
+        results = await asyncio.gather(*(guard.run("k", generate, fallback) for _ in range(3)))
+        assert results == [("llm", True)] * 3
+        assert calls == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,92 @@
+# Приближенный режим /predict_kpi/stream?sketch=true: точные счетчики
+# совпадают с полным расчетом, а число авторов, активные дни, bus factor,
+# коммиты разработчиков и квантили сложности лежат в возвращенных границах.
+# Запуск из корня репозитория: python -m pytest -q tests
+import random
+
+import numpy as np
+import pytest
+
+from benchmarks.generator import generate_backend_response
+from metric_calculator import prepare_metrics_for_analyzer
+from metric_sketch import AUTHOR_DAYS_PRECISION, COMPLEXITY_STEP, HyperLogLog, SketchAccumulator, hash_strings
+from preprocess import COMMIT_TYPES, build_commit_table
+
+BATCH = 1000
+
+
+def sketch_result(data: dict, top_k: int, precision: int = 10) -> dict:
+    accumulator = SketchAccumulator(top_k=top_k, precision=precision)
+    commits = data["commits"]
+    for i in range(0, len(commits), BATCH):
+        accumulator.add_many(commits[i:i + BATCH])
+    return accumulator.result()
+
+
+def uniform_authors(data: dict, authors: int, seed: int) -> dict:
+    """Авторы без явных лидеров: bus factor и вытеснения Misra-Gries максимальны"""
+    rng = random.Random(seed)
+    for commit in data["commits"]:
+        name = f"Dev {rng.randrange(authors)}"
+        commit["author"] = {"name": name, "email": f"{name}@example.com"}
+    return data
+
+
+def assert_within(bounds: dict, value):
+    # high=None - верхней границы нет (отслеживаемые не покрывают половину коммитов)
+    assert bounds["low"] <= value, (bounds, value)
+    assert bounds["high"] is None or value <= bounds["high"], (bounds, value)
+
+
+@pytest.mark.parametrize("data, top_k", [
+    (generate_backend_response(20000, 300, seed=9), 20),
+    (uniform_authors(generate_backend_response(20000, 10, seed=10), 200, seed=1), 30),
+])
+def test_sketch_bounds_contain_exact_values(data, top_k):
+    result = sketch_result(data, top_k)
+    expected = prepare_metrics_for_analyzer(data)
+    team, expected_team = result["team_metrics"], expected["team_metrics"]
+    bounds = result["sketch"]["error_bounds"]
+
+    # Точные счетчики
+    assert result["team_kpi"] == expected["team_kpi"]
+    for key in ("commits_total", "merge_conflicts", "feature_ratio", "fix_ratio", "refactor_ratio"):
+        assert team[key] == pytest.approx(expected_team[key], rel=1e-12), key
+    assert team["avg_complexity"] == pytest.approx(expected_team["avg_complexity"], rel=1e-9)
+
+    # Приближенные - в границах
+    assert_within(bounds["team_size"], expected_team["team_size"])
+    assert_within(bounds["active_days"], expected_team["active_days"])
+    assert_within(bounds["bus_factor"], expected_team["bus_factor"])
+
+    assert len(result["developers"]) <= top_k
+    undercount = bounds["developer_commits_max_undercount"]
+    for author, developer in result["developers"].items():
+        low, high = developer["bounds"]["total_commits"]
+        actual = expected["developers"][author]["metrics"]["total_commits"]
+        assert low <= actual <= high, author
+        assert actual - low <= undercount
+
+    complexity = build_commit_table(data["commits"]).complexity
+    for q, value in ((50, "p50"), (90, "p90"), (99, "p99")):
+        exact = float(np.percentile(complexity, q, method="inverted_cdf"))
+        assert abs(bounds["complexity_quantiles"][value] - exact) <= COMPLEXITY_STEP / 2 + 1e-9
+
+
+def test_untracked_authors_keep_memory_fixed():
+    small = sketch_result(uniform_authors(generate_backend_response(2000, 10, seed=3), 100, seed=2), top_k=10)
+    large = sketch_result(uniform_authors(generate_backend_response(20000, 10, seed=4), 2000, seed=3), top_k=10)
+    per_author = (1 << AUTHOR_DAYS_PRECISION) + len(COMMIT_TYPES) * 8
+    limit = SketchAccumulator(top_k=10, precision=10).memory_bytes() + 10 * per_author
+    for result in (small, large):
+        assert result["sketch"]["tracked_developers"] <= 10
+        assert result["sketch"]["memory_bytes"] <= limit
+
+
+@pytest.mark.parametrize("count", [10, 1000, 50000])
+def test_hyperloglog_error(count):
+    hll = HyperLogLog(precision=12)
+    hll.add_hashes(hash_strings([f"value {i}" for i in range(count)]))
+    bounds = hll.bounds()
+    assert_within(bounds, count)
+    assert abs(hll.count() - count) <= 3 * hll.relative_error * count + 1
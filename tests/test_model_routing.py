@@ -0,0 +1,75 @@
+# Маршрутизация LLM: небольшие команды и короткие промпты со всеми
+# разработчиками поименно идут в быструю модель, остальное - в основную;
+# без быстрой модели все идет в основную. Ключ кэша зависит от модели.
+# Запуск из корня репозитория: python -m pytest -q tests
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import metrics_analyzer
+from benchmarks.generator import generate_backend_response
+from metric_calculator import prepare_metrics_for_analyzer
+from metrics_analyzer import LLM_SMALL_MAX_DEVELOPERS, UniversalTeamAnalyzer, build_analysis_prompt
+
+LARGE, SMALL = "large-model", "small-model"
+
+
+def team(authors: int, commits: int = 2000) -> dict:
+    return prepare_metrics_for_analyzer(generate_backend_response(commits, authors, seed=authors))
+
+
+def stats(developers: int, tokens: int, summarized: bool) -> dict:
+    return {"developers_total": developers, "estimated_tokens": tokens, "summarized": summarized}
+
+
+@pytest.fixture
+def analyzer() -> UniversalTeamAnalyzer:
+    return UniversalTeamAnalyzer(model_name=LARGE, small_model_name=SMALL, token_budget=1200)
+
+
+def test_route_rules(analyzer):
+    assert analyzer.route(stats(LLM_SMALL_MAX_DEVELOPERS, 5000, False)) == "small"
+    assert analyzer.route(stats(LLM_SMALL_MAX_DEVELOPERS + 1, 100, False)) == "small"
+    assert analyzer.route(stats(LLM_SMALL_MAX_DEVELOPERS + 1, 100, True)) == "large"
+    assert analyzer.route(stats(LLM_SMALL_MAX_DEVELOPERS + 1, 5000, False)) == "large"
+    assert analyzer.model_for("small") == SMALL
+    assert analyzer.model_for("large") == LARGE
+
+
+@pytest.mark.parametrize("small_model", ["", LARGE])
+def test_without_small_model_everything_is_large(small_model):
+    analyzer = UniversalTeamAnalyzer(model_name=LARGE, small_model_name=small_model)
+    assert analyzer.route(stats(1, 10, False)) == "large"
+    assert analyzer.models == [LARGE]
+
+
+def test_models_to_keep_loaded(analyzer):
+    assert analyzer.models == [LARGE, SMALL]
+
+
+def test_prompt_stats_route_and_cache_key(analyzer):
+    _, small_stats = build_analysis_prompt(team(3), bucket=0, analyzer=analyzer)
+    _, large_stats = build_analysis_prompt(team(300, commits=10000), bucket=0, analyzer=analyzer)
+
+    assert (small_stats["route"], small_stats["model"]) == ("small", SMALL)
+    assert (large_stats["route"], large_stats["model"]) == ("large", LARGE)
+    assert metrics_analyzer.cache_key(SMALL, "p") != metrics_analyzer.cache_key(LARGE, "p")
+
+
+def test_request_goes_to_routed_model(analyzer, monkeypatch):
+    requested = []
+
+    def handler(request):
+        requested.append(json.loads(request.content)["model"])
+        return httpx.Response(200, json={"response": "анализ"})
+
+    monkeypatch.setattr(metrics_analyzer, "_async_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    async def scenario():
+        assert await analyzer.analyze_team_data_async(team(3)) == "анализ"
+        assert await analyzer.analyze_team_data_async(team(300, commits=10000)) == "анализ"
+
+    asyncio.run(scenario())
+    assert requested == [SMALL, LARGE]
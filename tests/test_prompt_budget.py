@@ -0,0 +1,79 @@
+# Бюджет промпта LLM: небольшая команда перечисляется поименно, большая
+# сокращается до лучших и худших N по KPI со сводкой по остальным, и промпт
+# укладывается в бюджет токенов.
+# Запуск из корня репозитория: python -m pytest -q tests
+import pytest
+
+from benchmarks.generator import generate_backend_response
+from metric_calculator import prepare_metrics_for_analyzer
+from metrics_analyzer import UniversalTeamAnalyzer, estimate_tokens
+
+
+@pytest.fixture(scope="module")
+def small_team() -> dict:
+    return prepare_metrics_for_analyzer(generate_backend_response(300, 4, seed=5))
+
+
+@pytest.fixture(scope="module")
+def large_team() -> dict:
+    return prepare_metrics_for_analyzer(generate_backend_response(20000, 400, seed=6))
+
+
+def analyzer(budget: int, top_n: int = 10) -> UniversalTeamAnalyzer:
+    return UniversalTeamAnalyzer(token_budget=budget, top_n=top_n, small_model_name="")
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("абвг" * 10) == 20
+    assert estimate_tokens("ab" + "вг") == 2
+
+
+def test_small_team_is_listed_in_full(small_team):
+    prompt, stats = analyzer(1200).build_prompt_info(small_team)
+    assert stats["summarized"] is False
+    assert stats["developers_listed"] == stats["developers_total"] == 4
+    assert stats["estimated_tokens"] == estimate_tokens(prompt) <= 1200
+    for name in small_team["developers"]:
+        assert name in prompt
+
+
+def test_large_team_is_truncated_to_budget(large_team):
+    prompt, stats = analyzer(1200, top_n=10).build_prompt_info(large_team)
+    assert stats["summarized"] is True
+    assert stats["developers_total"] == len(large_team["developers"])
+    assert 0 < stats["developers_listed"] <= 20
+    assert stats["estimated_tokens"] == estimate_tokens(prompt) <= 1200
+
+    # Поименно - лучшие по KPI, остальные - одной строкой сводки
+    ranked = sorted(large_team["developers"].items(),
+                    key=lambda item: (item[1]["kpi"], item[1]["metrics"]["total_commits"]), reverse=True)
+    listed_n = stats["developers_listed"] // 2
+    best = ranked[0][0]
+    assert f"- {best}: " in prompt
+    assert f"Остальные {len(ranked) - 2 * listed_n} разработчиков" in prompt
+    assert f"- {ranked[listed_n][0]}: " not in prompt
+
+
+def test_smaller_budget_lists_fewer(large_team):
+    listed = [analyzer(budget).build_prompt_info(large_team)[1]["developers_listed"]
+              for budget in (1200, 400, 300)]
+    assert listed == sorted(listed, reverse=True)
+    assert listed[0] > listed[-1]
+
+
+def test_budget_below_summary_keeps_summary_only(large_team):
+    prompt, stats = analyzer(50).build_prompt_info(large_team)
+    # Меньше сводки промпт не сокращается: бюджет превышен, поименно никого
+    assert stats["developers_listed"] == 0
+    assert stats["estimated_tokens"] > 50
+    assert "Остальные" in prompt
+
+
+def test_prompt_endpoint_reports_stats(client, large_team):
+    response = client.post("/analyze_kpi/prompt", json=large_team)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["stats"]["estimated_tokens"] == estimate_tokens(body["prompt"])
+    assert body["stats"]["summarized"] is True
@@ -0,0 +1,99 @@
+# Кэш результатов /predict_kpi: ETag по содержимому (hash коммитов и ветки),
+# 304 на If-None-Match, попадание в кэш для того же содержимого в другом
+# порядке или режиме разбора, вытеснение по размеру.
+# Запуск из корня репозитория: python -m pytest -q tests
+import random
+
+import orjson
+import pytest
+
+from benchmarks.generator import generate_backend_response
+from kpi_cache import KPIResultCache, content_fingerprint, etag_matches, get_result_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    get_result_cache().clear()
+    yield
+    get_result_cache().clear()
+
+
+def payload() -> dict:
+    return generate_backend_response(300, 6, seed=11)
+
+
+def post(client, data: dict, **kwargs):
+    return client.post("/predict_kpi", content=orjson.dumps(data),
+                       headers={"Content-Type": "application/json", **kwargs.pop("headers", {})}, **kwargs)
+
+
+def test_miss_then_hit_returns_same_body(client):
+    first = post(client, payload())
+    second = post(client, payload())
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers["X-Cache"] == "miss"
+    assert second.headers["X-Cache"] == "hit"
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert first.content == second.content
+
+
+def test_if_none_match_returns_304(client):
+    etag = post(client, payload()).headers["ETag"]
+
+    response = post(client, payload(), headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    assert post(client, payload(), headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_same_content_in_other_order_and_mode_hits(client):
+    data = payload()
+    first = post(client, data)
+
+    shuffled = payload()
+    random.Random(3).shuffle(shuffled["commits"])
+    response = post(client, shuffled, params={"mode": "fast"})
+
+    assert response.headers["X-Cache"] == "hit"
+    assert response.headers["ETag"] == first.headers["ETag"]
+
+
+def test_branches_change_etag_and_result(client):
+    data = payload()
+    first = post(client, data)
+
+    changed = payload()
+    changed["commits"][0]["branches"] = ["release/9.9"]
+    response = post(client, changed)
+
+    assert response.headers["X-Cache"] == "miss"
+    assert response.headers["ETag"] != first.headers["ETag"]
+    assert content_fingerprint(changed) != content_fingerprint(data)
+
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('W/"a"', '"a"')
+    assert etag_matches('"b", "a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches(None, '"a"')
+    assert not etag_matches('"b"', '"a"')
+
+
+def test_cache_evicts_by_size_and_count():
+    cache = KPIResultCache(max_bytes=10, max_items=3)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+    cache.put("c", b"1234")
+
+    # Превышен размер: вытесняется давно не использованный b
+    assert cache.get("b") is None
+    assert cache.get("a") == cache.get("c") == b"1234"
+    assert cache.snapshot()["bytes"] == 8
+
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
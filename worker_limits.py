@@ -0,0 +1,12 @@
+import math
+import os
+
+# Число воркеров serve.py (задает сам serve.py перед импортом приложения).
+# Лимиты параллелизма в переменных окружения - на весь сервис: каждый
+# воркер получает свою долю, иначе они умножаются на число воркеров
+SERVE_WORKERS = max(int(os.getenv("SERVE_WORKERS", "1")), 1)
+
+
+def worker_share(total: int) -> int:
+    """Доля лимита на один воркер (не меньше 1)"""
+    return max(math.ceil(total / SERVE_WORKERS), 1)